@@ -17,9 +17,17 @@ class BasicSequence(collections.Sequence):
     def _get(self, loc):
         raise exceptions.NotImplementedError("_get not implemented")
     
+    def _index(self, key):
+        "Turns a negative index into the matching positive one."
+        if key < 0:
+            key += len(self)
+            if key < 0:
+                raise IndexError('index out of range')
+        return key
+    
     def __getitem__(self, key):
         if not isinstance(key, slice):
-            return self._get(key)
+            return self._get(self._index(key))
         
         begin, end, stride = key.indices(len(self))
         
@@ -40,27 +48,65 @@ class BasicMutableSequence(collections.MutableSequence, BasicSequence):
     insert(self, index, item)
     __contains__(self, item)
     __len__(self)
-    __iter__(self)"""
+    __iter__(self)
+    
+    Slices with a step of 1 go through _setrange, _deleterange and
+    _insertmany, which fall back to calling _set, _delete and insert once per
+    item; subclasses that can change many items at once more cheaply than one
+    at a time can override them."""
     def _set(self, loc, item):
         raise exceptions.NotImplementedError("set not implemented")
     def _delete(self, loc):
         raise exceptions.NotImplementedError("delete not implemented")
     
+    def _setrange(self, begin, items):
+        "Sets self[begin + i] = items[i] for each item; items is a list."
+        for loc, val in enumerate(items, begin):
+            self._set(loc, val)
+    
+    def _deleterange(self, begin, end):
+        "Deletes the items from begin up to (not including) end."
+        for loc in reversed(range(begin, end)):
+            self._delete(loc)
+    
+    def _insertmany(self, index, items):
+        "Inserts the list items before index, in order."
+        for val in items:
+            self.insert(index, val)
+            index += 1
+    
     def __delitem__(self, key):
         if not isinstance(key, slice):
-            return self._delete(key)
+            return self._delete(self._index(key))
         
         begin, end, stride = key.indices(len(self))
         
+        if stride == 1:
+            if end > begin:
+                self._deleterange(begin, end)
+            return
+        
         for i in reversed(range(begin, end, stride)):
             self._delete(i)
     
     def __setitem__(self, key, item):
         if not isinstance(key, slice):
-            return self._set(key, item)
+            return self._set(self._index(key), item)
         
         begin, end, stride = key.indices(len(self))
         indices = range(begin, end, stride)
+        item = list(item)
+        
+        if stride == 1:
+            # set those that match, then delete or insert the rest
+            numset = min(len(indices), len(item))
+            if numset:
+                self._setrange(begin, item[:numset])
+            if len(indices) > numset:
+                self._deleterange(begin + numset, begin + len(indices))
+            if len(item) > numset:
+                self._insertmany(begin + numset, item[numset:])
+            return
         
         # set those that match
         for loc, val in zip(indices, item):
@@ -148,5 +194,16 @@ class basictester(BasicMutableSequence):
         print b
         assert str(b) == str(l)
 
+class bulktester(basictester):
+    """A basictester that overrides the bulk slice methods, to check that they
+    are called with the right arguments."""
+    def _setrange(self, begin, items):
+        self.list[begin:begin + len(items)] = items
+    def _deleterange(self, begin, end):
+        del self.list[begin:end]
+    def _insertmany(self, index, items):
+        self.list[index:index] = items
+
 if __name__ == '__main__':
-    basictester.runtest()
\ No newline at end of file
+    basictester.runtest()
+    bulktester.runtest()
\ No newline at end of file
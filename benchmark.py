@@ -0,0 +1,693 @@
+#!/usr/bin/env python
+"""Timing comparisons for the parts of the frontend that need to be fast.
+
+To run all benchmarks:
+python benchmark.py
+
+To run some of them:
+python benchmark.py findclosest
+"""
+from __future__ import print_function
+import random, timeit
+from optparse import OptionParser
+
+import cursesextras
+
+def timed(func, number=1, repeat=3):
+    "Returns the best time, in seconds, of calling func() number times."
+    return min(timeit.repeat(func, number=number, repeat=repeat))
+
+def report(name, seconds, baseline=None):
+    if baseline is None:
+        print('%-40s %10.4fs' % (name, seconds))
+    else:
+        print('%-40s %10.4fs  (%.1fx)' % (name, seconds,
+                baseline / max(seconds, 1e-9)))
+
+def bench_findclosest():
+    "Nearest-color lookups: brute force against the precomputed index."
+    rand = random.Random(0)
+    rgbs = [(rand.randrange(256), rand.randrange(256), rand.randrange(256))
+                for i in range(5000)]
+    for rgb in rgbs:
+        assert (cursesextras.closestcolor(rgb) ==
+                cursesextras.bruteclosest(rgb, cursesextras.colors256))
+
+    def brute():
+        for rgb in rgbs:
+            cursesextras.bruteclosest(rgb, cursesextras.colors256)
+    def indexed():
+        for rgb in rgbs:
+            cursesextras._closest256(rgb)
+    def memoized():
+        for rgb in rgbs:
+            cursesextras.closestcolor(rgb)
+
+    print('%d lookups in a 256 color palette:' % len(rgbs))
+    base = timed(brute)
+    report('brute force', base)
+    report('cube + grey ramp', timed(indexed), base)
+    report('memoized', timed(memoized), base)
+
+def samplesource():
+    "Returns the source of this package, as one string."
+    import glob, os
+    here = os.path.dirname(os.path.abspath(__file__))
+    return ''.join(open(f).read()
+                    for f in sorted(glob.glob(os.path.join(here, '*.py'))))
+
+def bench_formatgenerator():
+    "Mapping token types to attributes: walking parents against the table."
+    import pygments.lexers, pygments.styles
+    from cursespygments import CursesFormatter
+    
+    formatter = CursesFormatter(style='default')
+    # stand in for setup_styles, which needs a terminal
+    formatter.style_attrs = dict((str(ttype), n) for n, (ttype, ndef)
+                                    in enumerate(formatter.style))
+    formatter._setup = True
+    formatter._maketokentable()
+    lexer = pygments.lexers.get_lexer_by_name('python')
+    tokens = list(lexer.get_tokens(samplesource()))
+    
+    def walk():
+        # the lookup formatgenerator used to do
+        style_attrs = formatter.style_attrs
+        for (ttype, tstring) in tokens:
+            while str(ttype) not in style_attrs:
+                ttype = ttype.parent
+            style_attrs[str(ttype)]
+    def generator():
+        for pair in formatter.formatgenerator(tokens):
+            pass
+    def batch():
+        formatter.formattokens(tokens)
+    
+    print('Formatting %d tokens:' % len(tokens))
+    base = timed(walk)
+    report('walking str(ttype)', base)
+    report('formatgenerator', timed(generator), base)
+    report('formattokens', timed(batch), base)
+
+def _olddecompose(markup):
+    # markup.decompose, as it was with a list of (str, attr) tuples
+    fulltxt = ''
+    attrs = []
+    for txt, attr in markup:
+        fulltxt += txt
+        attrs.append((attr, len(txt)))
+    return fulltxt, attrs
+
+def _oldrecompose(text, attrlist):
+    markup = []
+    for (attr, length) in attrlist:
+        curtext, text = text[:length], text[length:]
+        markup.append((curtext, attr))
+    return markup
+
+def samplemarkup(nruns):
+    "Returns nruns (str, attr) pairs that look like highlighted code."
+    import pygments.lexers
+    lexer = pygments.lexers.get_lexer_by_name('python')
+    source = samplesource()
+    runs = []
+    while len(runs) < nruns:
+        runs.extend((tstring.encode('utf-8'), hash(ttype) % 64)
+                        for ttype, tstring in lexer.get_tokens(source))
+    return runs[:nruns]
+
+def bench_text():
+    "markup.Text: tuple lists against the array-backed representation."
+    import sys, markup
+    for nruns in (10000, 40000):
+        runs = samplemarkup(nruns)
+        listsize = sys.getsizeof(runs) + sum(sys.getsizeof(r) +
+                sys.getsizeof(r[0]) for r in runs)
+        text = markup.Text(runs)
+        print('%d runs, %d characters:' % (nruns, len(str(text))))
+        print('%-40s %10d bytes' % ('list of (str, attr)', listsize))
+        print('%-40s %10d bytes' % ('Text', text.memsize()))
+        
+        base = timed(lambda: _oldrecompose(*_olddecompose(runs)))
+        report('old decompose + recompose', base)
+        report('decompose + recompose',
+                timed(lambda: markup.recompose(*markup.decompose(runs))), base)
+        report('Text(markup).markup',
+                timed(lambda: markup.Text(runs).markup), base)
+        report('Text(markup).aslines()',
+                timed(lambda: markup.Text(runs).aslines()), base)
+
+def bench_rope():
+    "Building a transcript with +: Text against RopeText."
+    import markup
+    runs = samplemarkup(200000)
+    cells = [runs[i:i+20] for i in range(0, len(runs), 20)]
+    
+    def build(cls):
+        transcript = cls()
+        for cell in cells:
+            transcript = transcript + cls(cell)
+        return transcript
+    def trim(transcript):
+        # drop the oldest line and look up the newest, like a scrollback
+        for i in range(200):
+            transcript = transcript.lines(1)
+            transcript.line(transcript.linecount() - 2)
+    
+    print('Appending %d cells of 20 runs:' % len(cells))
+    base = timed(lambda: build(markup.Text), repeat=1)
+    report('Text +', base)
+    report('RopeText +', timed(lambda: build(markup.RopeText)), base)
+    rope = build(markup.RopeText)
+    report('RopeText: 200 trims + line lookups', timed(lambda: trim(rope)))
+
+def _oldwrappedlines(text, wrapper):
+    # Text.wrappedlines, as it was: TextWrapper on the plain text, with the
+    # attributes mapped back on afterwards
+    import markup
+    finallines = []
+    lineattrlist = []
+    for unwrappedline in text.aslines():
+        unwrappedtext, attrlist = markup.decompose(unwrappedline)
+        if not unwrappedtext:
+            finallines.append(('',[]))
+            continue
+        lines = wrapper.wrap(unwrappedtext)
+        curattr, curattrlen = attrlist.pop(0)
+        curcovered = 0
+        for l in lines:
+            linelen = len(l)
+            while curcovered + curattrlen < linelen:
+                if curattrlen > 0:
+                    lineattrlist.append((curattr, curattrlen))
+                curcovered += curattrlen
+                curattr, curattrlen = attrlist.pop(0)
+            if curcovered + curattrlen == linelen:
+                if curattrlen > 0:
+                    lineattrlist.append((curattr, curattrlen))
+                curattrlen = 0
+                curcovered = 0
+            else:
+                thislinecovered = linelen - curcovered
+                fornextline = curattrlen - thislinecovered
+                if thislinecovered > 0:
+                    lineattrlist.append((curattr, thislinecovered))
+                curattrlen = fornextline
+                curcovered = 0
+            finallines.append((l,lineattrlist))
+            lineattrlist = []
+    return [markup.recompose(t, a) for t, a in finallines]
+
+def bench_wrap():
+    "Wrapping markup: TextWrapper + attribute mapping against LineWrapper."
+    from textwrap import TextWrapper
+    import markup
+    
+    oldwrapper = TextWrapper(width=80, drop_whitespace=False,
+            expand_tabs=False, replace_whitespace=False)
+    runs = samplemarkup(40000)
+    # highlighted output with very long lines, where the old mapping was worst
+    longruns = [(txt.replace('\n', ' '), attr) for txt, attr in runs]
+    for name, sample in (('code', runs), ('long lines', longruns)):
+        print('Wrapping %s at 80 columns:' % name)
+        for nruns in (10000, 20000, 40000):
+            text = markup.Text(sample[:nruns], markup.LineWrapper(80))
+            assert (_oldwrappedlines(text, oldwrapper) == text.wrappedlines())
+            def wrap():
+                # wrapping again, not reading the cache (see bench_wrapcache)
+                text._wrapcache.clear()
+                text.wrappedlines()
+            base = timed(lambda: _oldwrappedlines(text, oldwrapper), repeat=1)
+            report('%d runs, TextWrapper' % nruns, base)
+            report('%d runs, LineWrapper' % nruns, timed(wrap), base)
+            text.wrapper = markup.LineWrapper(80, wordwrap=False)
+            report('%d runs, LineWrapper hard wrap' % nruns, timed(wrap), base)
+
+def bench_wrapcache():
+    "Rewrapping a whole history on every refresh, with and without caching."
+    import markup
+    runs = samplemarkup(40000)
+    linewrapper = markup.LineWrapper(80)
+    texts = [markup.Text(runs[i:i+20], linewrapper)
+                for i in range(0, len(runs), 20)]
+    
+    def uncached():
+        for t in texts:
+            t._wrapcache.clear()
+            t.wrappedlines()
+    def cached():
+        for t in texts:
+            t.wrappedlines()
+    
+    print('Wrapping a history of %d cells:' % len(texts))
+    base = timed(uncached)
+    report('rewrapping everything', base)
+    report('cached', timed(cached), base)
+
+def bench_textpanel():
+    "TextPanel redraws and scrolling, as the history grows."
+    import markup
+    from interpreterwidget import TextPanel
+    from memorywindow import MemoryWindow
+    runs = samplemarkup(100000)
+    cells = [runs[i:i+20] for i in range(0, len(runs), 20)]
+    
+    print('Redrawing an 80x40 TextPanel:')
+    for ncells in (100, 1000, 5000):
+        panel = TextPanel(MemoryWindow(40, 80))
+        panel.texts.extend(markup.Text(cell) for cell in cells[:ncells])
+        panel.refresh()
+        def redraw():
+            for i in range(20):
+                panel.refresh()
+        def scroll():
+            for line in range(0, panel.totallines(),
+                              max(1, panel.totallines() // 20)):
+                panel.scrollto(line)
+                panel.refresh()
+        report('%d cells, 20 redraws' % ncells, timed(redraw))
+        report('%d cells, 20 scrolls' % ncells, timed(scroll))
+    
+    # what the shadow frame buffer saves: cells rewritten per frame
+    win = MemoryWindow(40, 80)
+    panel = TextPanel(win)
+    panel.texts.extend(markup.Text(cell) for cell in cells[:100])
+    panel.refresh()
+    print('Cells written per frame, of %d:' % (40 * 80))
+    for name, change in (
+            ('no change', lambda: None),
+            ('new one-line cell', lambda: panel.texts.append(
+                    markup.Text('print(1)\n'))),
+            ('changing the last cell', lambda: (
+                    panel.texts.__setitem__(-1, markup.Text('print(2)\n')),
+                    panel.invalidate(len(panel.texts) - 1))),
+            ('scrolling up one line', lambda: panel.scroll(-1))):
+        change()
+        calls = win.calls['addstr']
+        panel.refresh()
+        print('%-40s %10d cells, %d addstr calls' % (name,
+                panel.cellswritten, win.calls['addstr'] - calls))
+
+def bench_panelastext():
+    "Editing a Panelastext below many wrapped lines."
+    import vipad
+    from memorywindow import MemoryWindow
+    
+    print('200 edits at the end of a Panelastext:')
+    for nlines in (500, 2000, 8000):
+        win = MemoryWindow(2 * nlines + 10, 40)
+        textbox = vipad.Panelastext(win)
+        for i in range(nlines):
+            # each line wraps onto a second physical line
+            textbox.append('%d: ' % i + 'x' * 50)
+        def edit():
+            for i in range(100):
+                textbox[-1] = 'short'
+                textbox[-1] = 'long ' + 'y' * 50
+        def read():
+            textbox[-20:]
+        report('%d wrapped lines above, edits' % nlines, timed(edit))
+        report('%d wrapped lines above, reads' % nlines, timed(read))
+
+def bench_slices():
+    "Large slice assignments, with and without the bulk slice methods."
+    import vipad
+    from basicsequence import basictester, BasicMutableSequence
+    from memorywindow import MemoryWindow
+    
+    class PerLinePanel(vipad.Panelastext):
+        # goes back to one _set, _delete or insert per line
+        _setrange = BasicMutableSequence._setrange.im_func
+        _deleterange = BasicMutableSequence._deleterange.im_func
+        _insertmany = BasicMutableSequence._insertmany.im_func
+    
+    print('Replacing all the lines, then half of them, then deleting them:')
+    for nlines in (200, 1000, 4000):
+        lines = ['%d: ' % i + 'x' * (i % 60) for i in range(nlines)]
+        def run(seq):
+            seq[:] = lines
+            seq[nlines // 4:nlines // 2] = lines[:nlines // 2]
+            del seq[:]
+        report('basictester, %d lines' % nlines, timed(lambda: run(basictester())))
+        calls = {}
+        for name, cls in (('per line', PerLinePanel), ('bulk', vipad.Panelastext)):
+            def panelrun():
+                win = MemoryWindow(3 * nlines, 40)
+                run(cls(win))
+                calls[name] = sum(win.calls[c] for c in
+                    ('insertln', 'deleteln', 'insdelln'))
+            seconds = timed(panelrun)
+            if name == 'per line':
+                baseline = seconds
+            report('Panelastext (%s), %d lines' % (name, nlines), seconds,
+                baseline if name == 'bulk' else None)
+        print('    line insertions/deletions: %d per line, %d bulk'
+            % (calls['per line'], calls['bulk']))
+
+def bench_sync():
+    "Replacing a Panelastext's lines with a few lines changed, or all of them."
+    import vipad
+    from memorywindow import MemoryWindow
+    
+    def fewchanged(lines):
+        newlines = list(lines)
+        newlines[len(lines) // 3] = 'changed'
+        del newlines[len(lines) // 2]
+        newlines.insert(len(lines) // 5, 'inserted')
+        return newlines
+    def allchanged(lines):
+        return ['changed ' + line for line in lines]
+    for title, change in (('Changing 3 of the lines', fewchanged),
+                          ('Changing every line', allchanged)):
+        print('%s, then assigning or syncing all of them:' % title)
+        for nlines in (100, 1000, 2000):
+            lines = ['%d: ' % i + 'x' * (i % 60) for i in range(nlines)]
+            newlines = change(lines)
+            draws = {}
+            for name in ('slice', 'sync'):
+                win = MemoryWindow(3 * nlines, 40)
+                textbox = vipad.Panelastext(win)
+                textbox[:] = lines
+                def update():
+                    for content in (newlines, lines):
+                        if name == 'slice':
+                            textbox[:] = content
+                        else:
+                            textbox.sync(content)
+                seconds = timed(update)
+                if name == 'slice':
+                    baseline = seconds
+                win.calls.clear()
+                update()
+                draws[name] = win.calls['addstr']
+                report('%s, %d lines' % (name, nlines), seconds,
+                    baseline if name == 'sync' else None)
+            print('    addstr calls: %d assigning, %d syncing'
+                % (draws['slice'], draws['sync']))
+
+def bench_scrollback():
+    "Memory used by a long session, kept in a list and in a Scrollback."
+    import markup
+    from scrollback import Scrollback
+    
+    nentries = 2000
+    entries = [markup.Text(samplemarkup(200)) for i in range(50)]
+    listbytes = sum(text.memsize() for text in entries) * (nentries // 50)
+    print('%d highlighted cells of %d runs:' % (nentries, 200))
+    print('    in a list:       %8d KiB' % (listbytes // 1024))
+    for maxbytes in (32 * 1024 * 1024, 1024 * 1024):
+        scrollback = Scrollback(maxbytes=maxbytes)
+        def fill():
+            for i in range(nentries):
+                scrollback.append(markup.Text(entries[i % 50]))
+        report('filling, %d KiB limit' % (maxbytes // 1024), timed(fill, repeat=1))
+        print('    in a Scrollback: %8d KiB, %d dropped'
+            % (scrollback.residentbytes() // 1024, scrollback.dropped))
+        def scrollup():
+            for i in reversed(range(len(scrollback))):
+                scrollback[i]
+        report('reading every cell, newest first', timed(scrollup))
+        print('    %(hits)d hits, %(misses)d misses' % scrollback.stats())
+
+def bench_stream():
+    "Output arriving a line at a time, below a long history."
+    import markup
+    from interpreterwidget import TextPanel
+    from memorywindow import MemoryWindow
+    
+    nchunks = 500
+    chunks = ['output line %d, ' % i + 'x' * (i % 70) + '\n'
+              for i in range(nchunks)]
+    def makepanel():
+        panel = TextPanel(MemoryWindow(40, 80))
+        for i in range(2000):
+            panel.texts.append(markup.Text('cell %d\n' % i))
+        panel.refresh()
+        return panel
+    
+    print('%d chunks of output, drawing after each:' % nchunks)
+    def rebuild():
+        # a new Text with everything so far, every time
+        panel = makepanel()
+        panel.texts.append(markup.Text(''))
+        for i in range(nchunks):
+            panel.texts[-1] = markup.Text(''.join(chunks[:i + 1]))
+            panel.invalidate(len(panel.texts) - 1)
+            panel.refresh()
+    baseline = timed(rebuild, repeat=1)
+    report('rebuilding the last text', baseline)
+    def stream(maxfps):
+        panel = makepanel()
+        panel.maxfps = maxfps
+        for chunk in chunks:
+            panel.write(chunk)
+        panel.flush()
+    report('write(), every chunk drawn', timed(lambda: stream(0), repeat=1),
+        baseline)
+    report('write(), at most 30 frames/s', timed(lambda: stream(30), repeat=1),
+        baseline)
+    
+    # one long stream: extending should take the same time per chunk however
+    # much has been written before
+    print('Extending one Text, with its lines wrapped:')
+    chunk = 'output line, ' * 6 + '\n'
+    for nchunks in (5000, 20000):
+        def extend():
+            text = markup.Text('', markup.LineWrapper(80))
+            text.wrappedlines()
+            for i in range(nchunks):
+                text.extend(chunk)
+        seconds = timed(extend, repeat=1)
+        report('%d chunks, %.1fus each' % (nchunks, 1e6 * seconds / nchunks),
+            seconds)
+
+def bench_frames():
+    "Terminal updates for three windows, refreshed directly or in frames."
+    from framescheduler import FrameScheduler
+    from memorywindow import MemoryWindow
+    
+    nupdates = 300
+    print('%d updates, each changing three windows:' % nupdates)
+    wins = [MemoryWindow(10, 80) for i in range(3)]
+    for win in wins:
+        win.calls.clear()
+    for i in range(nupdates):
+        for win in wins:
+            win.refresh()
+    # each refresh() is a noutrefresh() and a doupdate()
+    print('    refresh():            %4d terminal updates'
+        % sum(win.calls['refresh'] for win in wins))
+    for maxfps in (0, 60):
+        updates = []
+        scheduler = FrameScheduler(maxfps, doupdate=lambda: updates.append(1))
+        for i in range(nupdates):
+            for win in wins:
+                scheduler.mark(win)
+            scheduler.frame()
+        scheduler.flush()
+        stats = scheduler.stats()
+        print('    frames, maxfps %-6s %4d terminal updates, %d windows flushed,'
+            ' %d deferred' % (maxfps or 'none:', len(updates),
+            stats['windowsflushed'], stats['deferred']))
+
+def bench_kernel():
+    """A cell that prints a lot, and one that keeps a processor busy, run on a
+    thread in this process and in a kernel process: how long they take, how
+    many events their output arrives in, and how late a 60 frames/s timer is
+    while they run."""
+    import time, select
+    from executor import Executor
+    from kernel import KernelClient
+    
+    nprints = 100000
+    cells = [('printing %d lines' % nprints,
+              'for i in range(%d): print i' % nprints),
+             ('a busy loop', 'for i in xrange(10 ** 7): pass')]
+    interval = 1.0 / 60
+    for title, code in cells:
+        print('%s:' % title)
+        for name, make in (('thread', Executor), ('kernel', KernelClient)):
+            runner = make()
+            events = [0]
+            finished = []
+            def output(cell, name, txt):
+                events[0] += 1
+            runner.onoutput = output
+            runner.ondone = finished.append
+            runner.submit('pass')
+            while not finished:
+                select.select([runner], [], [], None)
+                runner.handleevents()
+            del finished[:]
+            start = time.time()
+            runner.submit(code)
+            # a frame every interval; how late does the loop get to it?
+            nextframe = start + interval
+            latenesses = []
+            while not finished:
+                select.select([runner], [], [],
+                              max(0, nextframe - time.time()))
+                runner.handleevents()
+                now = time.time()
+                if now >= nextframe:
+                    latenesses.append(now - nextframe)
+                    nextframe = now + interval
+            seconds = time.time() - start
+            runner.close()
+            report('    on a %s' % name, seconds)
+            print('        %d output events, frames late by %.1fms on average,'
+                ' %.1fms at worst' % (events[0],
+                1000 * sum(latenesses) / max(len(latenesses), 1),
+                1000 * max(latenesses or [0])))
+
+def bench_highlight():
+    """Showing a pasted module: lexing and formatting it before drawing,
+    against drawing it plain and having a worker lex it."""
+    import time, select
+    import pygments.lexers
+    import markup
+    from cursespygments import CursesFormatter
+    from highlighter import Highlighter
+    
+    formatter = CursesFormatter(style='default')
+    # stand in for setup_styles, which needs a terminal
+    formatter.style_attrs = dict((str(ttype), n) for n, (ttype, ndef)
+                                    in enumerate(formatter.style))
+    formatter._setup = True
+    formatter._maketokentable()
+    lexer = pygments.lexers.get_lexer_by_name('python')
+    source = samplesource()
+    print('Showing %d lines of code:' % source.count('\n'))
+    
+    def synchronous():
+        markup.Text(formatter.formatgenerator(lexer.get_tokens(source)))
+    baseline = timed(synchronous)
+    report('lexing first (all on the interface)', baseline)
+    
+    highlighter = Highlighter(lexer)
+    results = []
+    def shown():
+        markup.Text(source)
+        highlighter.submit(len(results), source, results.append)
+    report('plain first (on the interface)', timed(shown, repeat=1), baseline)
+    start = time.time()
+    while highlighter.pending():
+        select.select([highlighter], [], [])
+        highlighter.handleevents()
+    markup.Text(formatter.formattokens(results[-1]))
+    report('    until it is in color', time.time() - start, baseline)
+    highlighter.close()
+
+def bench_relex():
+    "Typing a line in a long cell: lexing the whole cell, or just what changed."
+    import pygments.lexers
+    from incrementallexer import IncrementalLexer
+    
+    lexer = pygments.lexers.get_lexer_by_name('python')
+    lines = samplesource().split('\n')[:2000]
+    typed = 'result = compute(first, second) # and a comment'
+    where = len(lines) // 2
+    print('Typing %d keys in the middle of %d lines:' % (len(typed), len(lines)))
+    def whole():
+        cell = list(lines)
+        cell.insert(where, '')
+        for i in range(len(typed)):
+            cell[where] = typed[:i + 1]
+            list(lexer.get_tokens('\n'.join(cell)))
+    baseline = timed(whole, repeat=1)
+    report('lexing the whole cell', baseline)
+    inc = IncrementalLexer(lexer)
+    inc.replace(0, 0, lines)
+    def incremental():
+        inc.replace(where, where, [''])
+        for i in range(len(typed)):
+            inc.replace(where, where + 1, [typed[:i + 1]])
+        inc.replace(where, where + 1, [])
+    lexed = inc.lexed
+    report('IncrementalLexer', timed(incremental, repeat=1), baseline)
+    print('    %d lines lexed' % (inc.lexed - lexed))
+
+def bench_fastlexer():
+    "Lexing real source files: pygments' PythonLexer against FastPythonLexer."
+    import glob, os
+    import pygments.lexers
+    import fastlexer
+    
+    here = os.path.dirname(os.path.abspath(__file__))
+    stdlib = os.path.dirname(os.__file__)
+    for title, pattern in (('this package', os.path.join(here, '*.py')),
+                           ('the standard library', os.path.join(stdlib, '*.py'))):
+        source = ''.join(open(f).read() for f in sorted(glob.glob(pattern)))
+        print('%s: %d lines, %d KiB' % (title, source.count('\n'),
+                                        len(source) // 1024))
+        slow = pygments.lexers.PythonLexer()
+        fast = fastlexer.FastPythonLexer()
+        baseline = timed(lambda: list(slow.get_tokens(source)), repeat=1)
+        report('    PythonLexer', baseline)
+        seconds = timed(lambda: list(fast.get_tokens(source)), repeat=1)
+        report('    FastPythonLexer', seconds, baseline)
+        print('    %.0f KiB/s against %.0f KiB/s; %.1f%% of characters the same'
+            ' type' % (len(source) / 1024.0 / seconds,
+                       len(source) / 1024.0 / baseline,
+                       100 * fastlexer.agreement(source)))
+
+def bench_tokencache():
+    "Showing the same code in several styles: lexing it every time, or once."
+    import pygments.lexers, pygments.styles
+    from cursespygments import CursesFormatter
+    from tokencache import TokenCache
+    
+    lexer = pygments.lexers.get_lexer_by_name('python')
+    source = samplesource()
+    styles = sorted(pygments.styles.get_all_styles())[:8]
+    formatters = []
+    for style in styles:
+        formatter = CursesFormatter(style=style)
+        # stand in for setup_styles, which needs a terminal
+        formatter.style_attrs = dict((str(ttype), n) for n, (ttype, ndef)
+                                        in enumerate(formatter.style))
+        formatter._setup = True
+        formatter._maketokentable()
+        formatters.append(formatter)
+    print('%d lines of code, in %d styles:' % (source.count('\n'), len(styles)))
+    def relex():
+        for formatter in formatters:
+            formatter.formattokens(lexer.get_tokens(source))
+    baseline = timed(relex, repeat=1)
+    report('lexing for every style', baseline)
+    cache = TokenCache()
+    def cached():
+        for formatter in formatters:
+            formatter.formattokens(cache.get_tokens(lexer, source))
+    report('with a TokenCache', timed(cached, repeat=1), baseline)
+    print('    %(hits)d hits, %(misses)d misses, %(bytes)d bytes' % cache.stats())
+
+benchmarks = [
+    ('findclosest', bench_findclosest),
+    ('formatgenerator', bench_formatgenerator),
+    ('text', bench_text),
+    ('rope', bench_rope),
+    ('wrap', bench_wrap),
+    ('wrapcache', bench_wrapcache),
+    ('textpanel', bench_textpanel),
+    ('panelastext', bench_panelastext),
+    ('slices', bench_slices),
+    ('sync', bench_sync),
+    ('scrollback', bench_scrollback),
+    ('stream', bench_stream),
+    ('frames', bench_frames),
+    ('kernel', bench_kernel),
+    ('highlight', bench_highlight),
+    ('relex', bench_relex),
+    ('fastlexer', bench_fastlexer),
+    ('tokencache', bench_tokencache),
+]
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog [benchmark ...]')
+    opts, args = parser.parse_args()
+    for name, func in benchmarks:
+        if args and name not in args:
+            continue
+        func()
+        print()
@@ -0,0 +1,209 @@
+"""Bookkeeping for curses color pairs and colors.
+
+curses has a small, global set of color pairs, and everything drawing in color
+(formatters, parsers, windows) has to share them. PairAllocator hands out pair
+numbers for (fg, bg) combinations, reusing an existing pair when the same
+combination is asked for twice, and only recycling pairs that nobody uses.
+
+ColorTable remembers what each color has been set to with init_color, so
+setting it to the same value again costs nothing; on slow links, every
+init_color can make the terminal repaint.
+
+Use allocator() and colortable() to get the ones shared by the whole
+process."""
+
+import curses
+import cursesextras
+from collections import OrderedDict
+
+class PairAllocator(object):
+    """Allocates curses color pairs in the range [first, end).
+
+    Every allocate() must be matched with a release() once the pair is no
+    longer needed. Released pairs keep their colors, so asking for the same
+    (fg, bg) again reuses them without another init_pair; when no pairs are
+    left, the least recently released one is redefined.
+
+    All operations are O(1)."""
+    def __init__(self, first=2, end=256):
+        """Pairs below 'first' are left alone: 0 is the terminal default, and
+        1 is used for window backgrounds. 'end' is one more than the last pair
+        that may be used."""
+        self.first = first
+        self.end = max(first, end)
+        self._nextpair = first # pairs from here up have never been used
+        self._pairs = {} # (fg,bg) -> pair
+        self._contents = {} # pair -> (fg,bg)
+        self._refs = {} # pair -> number of users
+        self._unused = OrderedDict() # pairs with no users, oldest first
+        self._reserved = {} # pair -> (fg,bg), for pairs below first
+        self.initcalls = 0
+        self.skipped = 0 # init_pair calls not needed
+        self.evictions = 0
+
+    def __len__(self):
+        "Returns the number of pairs that are currently defined."
+        return len(self._contents)
+
+    def capacity(self):
+        return self.end - self.first
+
+    def content(self, pair):
+        "Returns the (fg, bg) of an allocated pair."
+        return self._contents[pair]
+
+    def refcount(self, pair):
+        return self._refs.get(pair, 0)
+
+    def _initpair(self, pair, fg, bg):
+        curses.init_pair(pair, fg, bg)
+        self.initcalls += 1
+
+    def _newpair(self):
+        """Returns a pair number that can be (re)defined, or None if all pairs
+        are in use."""
+        if self._nextpair < self.end:
+            pair = self._nextpair
+            self._nextpair += 1
+            return pair
+        if not self._unused:
+            return None
+        pair, none = self._unused.popitem(last=False)
+        del self._pairs[self._contents.pop(pair)]
+        del self._refs[pair]
+        self.evictions += 1
+        return pair
+
+    def allocate(self, fg, bg):
+        """Returns a pair number for the colors (fg, bg), defining the pair if
+        needed.
+
+        If every pair is in use, returns 0 (the terminal's default colors)."""
+        key = (fg, bg)
+        pair = self._pairs.get(key)
+        if pair is None:
+            pair = self._newpair()
+            if pair is None:
+                return 0
+            self._initpair(pair, fg, bg)
+            self._pairs[key] = pair
+            self._contents[pair] = key
+            self._refs[pair] = 0
+        else:
+            self.skipped += 1
+            if self._refs[pair] == 0:
+                del self._unused[pair]
+
+        self._refs[pair] += 1
+        return pair
+
+    def release(self, pair):
+        """Marks one use of the pair as finished. Pairs that were not allocated
+        here (such as 0) are ignored."""
+        refs = self._refs.get(pair)
+        if not refs:
+            return
+        refs -= 1
+        self._refs[pair] = refs
+        if refs == 0:
+            self._unused[pair] = None
+
+    def setpair(self, pair, fg, bg):
+        """Defines one of the pairs below self.first (such as 1, for window
+        backgrounds), unless it already has those colors."""
+        if self._reserved.get(pair) == (fg, bg):
+            self.skipped += 1
+            return
+        self._initpair(pair, fg, bg)
+        self._reserved[pair] = (fg, bg)
+
+class ColorTable(object):
+    """Keeps track of the colors made with init_color."""
+    def __init__(self):
+        self._colors = {} # colnum -> (r,g,b), in curses' 0-1000 range
+        self.initcalls = 0
+        self.skipped = 0 # init_color calls not needed
+
+    def initcolor(self, colnum, r, g, b):
+        """Calls curses.init_color, unless the color already has that value.
+        Returns True if init_color was called."""
+        if self._colors.get(colnum) == (r, g, b):
+            self.skipped += 1
+            return False
+        curses.init_color(colnum, r, g, b)
+        self.initcalls += 1
+        self._colors[colnum] = (r, g, b)
+        return True
+
+_allocator = None
+_allocatorsession = None
+_colortable = None
+_colortablesession = None
+
+def allocator():
+    """Returns the PairAllocator shared by everything in this process.
+
+    curses.start_color() must have been called first. Pair numbers are limited
+    to 255, as that is all curses.color_pair() can fit into an attribute.
+    A new allocator is made whenever safescreen restarts curses."""
+    global _allocator, _allocatorsession
+    end = min(curses.COLOR_PAIRS, 256)
+    session = cursesextras.screensession
+    if (_allocator is None or _allocator.end != end
+            or _allocatorsession != session):
+        _allocator = PairAllocator(2, end)
+        _allocatorsession = session
+    return _allocator
+
+def colortable():
+    """Returns the ColorTable shared by everything in this process.
+
+    A new table is made whenever safescreen restarts curses."""
+    global _colortable, _colortablesession
+    session = cursesextras.screensession
+    if _colortable is None or _colortablesession != session:
+        _colortable = ColorTable()
+        _colortablesession = session
+    return _colortable
+
+def test():
+    """Allocates and releases pairs from a small PairAllocator, recording
+    the init_pair calls instead of making them."""
+    calls = []
+    class Allocator(PairAllocator):
+        def _initpair(self, pair, fg, bg):
+            calls.append((pair, fg, bg))
+            self.initcalls += 1
+    a = Allocator(first=2, end=5)
+    assert a.capacity() == 3
+    p1 = a.allocate(1, 0)
+    p2 = a.allocate(2, 0)
+    assert (p1, p2) == (2, 3) and calls == [(2, 1, 0), (3, 2, 0)]
+    # the same colors again share the pair
+    assert a.allocate(1, 0) == p1 and a.refcount(p1) == 2 and a.skipped == 1
+    p3 = a.allocate(3, 0)
+    assert p3 == 4 and len(a) == 3
+    # all in use
+    assert a.allocate(4, 0) == 0 and len(calls) == 3
+    a.release(p2)
+    a.release(p1)
+    assert a.refcount(p1) == 1
+    a.release(p3)
+    a.release(p1)
+    a.release(0) # not allocated here: ignored
+    # released pairs keep their colors until they are needed
+    assert a.allocate(3, 0) == p3 and len(calls) == 3
+    # the least recently released pair (p2) is redefined first, then p1
+    assert a.allocate(4, 0) == p2 and calls[-1] == (p2, 4, 0)
+    assert a.allocate(5, 0) == p1 and calls[-1] == (p1, 5, 0)
+    assert a.evictions == 2 and a.content(p1) == (5, 0)
+    assert a.allocate(6, 0) == 0
+    # the pairs below first
+    del calls[:]
+    a.setpair(1, 7, 0)
+    a.setpair(1, 7, 0)
+    a.setpair(1, 6, 0)
+    assert calls == [(1, 7, 0), (1, 6, 0)]
+
+if __name__ == '__main__':
+    test()
@@ -57,11 +57,104 @@ for grey in range(0,24):
     val = grey*10+8
     colors256[colnum] = (val,val,val)
 
+# the 'palette' used when there are no colors at all
+colorsbw = {-1:(0,0,0)}
+
+# per-channel values of the 6x6x6 cube, and of the greyscale ramp
+_cubelevels = [l*40+55 for l in range(6)]
+_greylevels = [g*10+8 for g in range(24)]
+
+def colordistance(col1, col2):
+    """Returns the squared distance between two (r,g,b) tuples."""
+    r1, g1, b1 = col1
+    r2, g2, b2 = col2
+
+    rd = r1 - r2
+    gd = g1 - g2
+    bd = b1 - b2
+
+    return rd*rd + gd*gd + bd*bd
+
+def bruteclosest(rgb, colordict):
+    """Finds the nearest color to rgb in colordict, where
+    colordict[colornum] = (r,g,b), by checking every color.
+
+    On a tie, the first color found wins."""
+    dist = 257 * 257 * 3
+    bestcol = None
+
+    for col,colrgb in colordict.items():
+        curdist = colordistance(rgb, colrgb)
+        if curdist < dist:
+            dist = curdist
+            bestcol = col
+
+    return bestcol
+
+def _nearestlevels(val, levels):
+    """Returns the (at most 2) indices into the sorted list levels that are
+    closest to val."""
+    for i, level in enumerate(levels):
+        if level >= val:
+            if i == 0:
+                return (0,)
+            return (i-1, i)
+    return (len(levels)-1,)
+
+def _closest256(rgb):
+    """Finds the nearest color in colors256 without checking all 256 colors.
+
+    Distance is separable by channel, so the nearest point of the color cube is
+    made of the nearest level of each channel; the nearest grey is the one
+    nearest the mean of the channels. Both neighbouring levels are kept as
+    candidates, so ties are broken exactly as bruteclosest breaks them (lowest
+    color number wins)."""
+    r, g, b = rgb
+    candidates = list(range(16))
+    for ri in _nearestlevels(r, _cubelevels):
+        for gi in _nearestlevels(g, _cubelevels):
+            for bi in _nearestlevels(b, _cubelevels):
+                candidates.append(16 + ri*36 + gi*6 + bi)
+    mean = (r + g + b) / 3.0
+    for grey in _nearestlevels(mean, _greylevels):
+        candidates.append(232 + grey)
+
+    return min(candidates,
+            key=lambda col: (colordistance(rgb, colors256[col]), col))
+
+# (id(colordict), rgb) -> colornum. Shared by everything that looks up colors;
+# the palettes are module-level constants, so their ids are stable.
+_closestcache = {}
+
+def closestcolor(rgb, colordict=colors256):
+    """Finds the nearest color to the (r,g,b) tuple rgb in colordict, where
+    colordict[colornum] = (r,g,b).
+
+    Gives the same answer as bruteclosest, but results are memoized, and
+    colors256 lookups only check a handful of candidates."""
+    key = (id(colordict), rgb)
+    try:
+        return _closestcache[key]
+    except KeyError:
+        pass
+
+    if colordict is colors256:
+        col = _closest256(rgb)
+    else:
+        col = bruteclosest(rgb, colordict)
+    _closestcache[key] = col
+    return col
+
 def log(*args, **kw):
     with file('/tmp/py.log','a') as f:
         kw['file'] = f
         print(*args, **kw)
 
+# incremented every time safescreen starts curses, so that anything cached
+# about the terminal (color support, color pairs, ...) can tell when it
+# needs to be worked out again
+screensession = 0
+
 @contextlib.contextmanager
 def safescreen(termstr=None):
     """A context manager that acts like curses.wrapper.
@@ -71,6 +164,7 @@ def safescreen(termstr=None):
         scr.addstr('123456')
         scr.getch()
     """
+    global screensession
     try:
         if 'TERM' in os.environ:
             oldterm = os.environ['TERM']
@@ -79,6 +173,7 @@ def safescreen(termstr=None):
         if termstr: # modify enviornmental variables to duplicate another term
             os.environ['TERM'] = termstr # only way 
         stdscr=curses.initscr()
+        screensession += 1
         log('colors:', curses.tigetnum('colors'),curses.longname())
         curses.noecho()
         curses.cbreak()
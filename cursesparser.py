@@ -1,7 +1,10 @@
 from pygments.lexers import PythonLexer
+from fastlexer import FastPythonLexer
 import pygments.token as pygtoken
 import curses
 
+from colorpairs import allocator
+
 standardcols = {
     pygtoken.Number: (curses.COLOR_CYAN, curses.A_BOLD),
     pygtoken.Operator: (curses.COLOR_YELLOW, curses.A_BOLD),
@@ -15,50 +18,67 @@ standardcols = {
 }
 
 class CursesParser:
-    def __init__(self, makecolors = True, style = standardcols):
+    def __init__(self, makecolors = True, style = standardcols, fast = False):
+        """fast: if true, Python is lexed with FastPythonLexer rather than
+        pygments' PythonLexer"""
         if makecolors:
             self.makecolorpairs()
         if style is None:
             style = standardcols
         self.style = style
-        self.lexer = PythonLexer()
+        self._resolved = {}
+        self._resolvedstyle = style
+        self.lexer = FastPythonLexer() if fast else PythonLexer()
     
     @classmethod
     def makecolorpairs(cls):
-        """Initializes curses for colors, makes a color pair of 
-        (color, defaultbg) for every color, and initializes self.colorpairs as
-        a dictionary with a color -> colorpair mapping"""
+        """Initializes curses for colors, and initializes cls.colorpairs as
+        a dictionary with a color -> colorpair mapping.
+        
+        Pairs are made as colors are needed (see colorpair), using the
+        allocator shared with the formatters."""
         if hasattr(cls, 'colorpairs'):
             return cls.colorpairs
         curses.start_color()
         curses.use_default_colors()
-        maxcolors = curses.COLORS
-        maxpairs = curses.COLOR_PAIRS
-        totalmax = min(maxcolors+1, maxpairs)
         cls.colorpairs = {}
-        for colpr in range(1,totalmax):
-            if colpr >= maxpairs:
-                break
-            col = colpr % maxcolors
-            curses.init_pair(colpr, col, -1)
-            cls.colorpairs[col] = curses.color_pair(colpr)
         return cls.colorpairs
     
+    @classmethod
+    def colorpair(cls, col):
+        """Returns the attribute for a color pair of (color, defaultbg),
+        making the pair if needed."""
+        colorpairs = cls.makecolorpairs()
+        if col not in colorpairs:
+            pair = allocator().allocate(col % curses.COLORS, -1)
+            colorpairs[col] = curses.color_pair(pair)
+        return colorpairs[col]
+    
+    def _lookup(self, tkn):
+        """Returns the (color, attr) for a token type, from the style entry of
+        the token or its nearest parent. Results are kept in self._resolved,
+        which is reset whenever self.style is replaced."""
+        if self._resolvedstyle is not self.style:
+            self._resolved = {}
+            self._resolvedstyle = self.style
+        
+        resolved = self._resolved.get(tkn)
+        if resolved is None:
+            if tkn is None:
+                resolved = (None, None)
+            elif tkn in self.style:
+                resolved = self.style[tkn]
+            else:
+                resolved = self._lookup(tkn.parent)
+            self._resolved[tkn] = resolved
+        return resolved
+    
     def get_colors(self, raw):
         """Uses pygments to parse the text, and yields (text, color, attr)
         tuples"""
         for tkn, txt in self.lexer.get_tokens(raw):
-            notyielded = True
-            while notyielded:
-                if tkn is None:
-                    yield (txt, None, None)
-                    notyielded = False
-                elif tkn in self.style:
-                    col, attr = self.style[tkn]
-                    yield (txt, col, attr)
-                    notyielded = False
-                else:
-                    tkn = tkn.parent
+            col, attr = self._lookup(tkn)
+            yield (txt, col, attr)
     
     def parsetoscr(self, scr, raw):
         """Parses text, and uses scr.addstr to print the text directly."""
@@ -67,6 +87,6 @@ class CursesParser:
             fullattr = attr
             if attr is None:
                 fullattr = curses.A_NORMAL
-            if col is not None: # and col in self.colorpairs:
-                fullattr |= self.colorpairs[col]
+            if col is not None:
+                fullattr |= self.colorpair(col)
             scr.addstr(txt, fullattr)
\ No newline at end of file
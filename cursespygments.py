@@ -4,6 +4,13 @@ from pygments.formatter import Formatter
 import curses, exceptions
 from pygments.token import Token
 from cursesextras import *
+import cursesextras
+import colorpairs
+
+# compiled styles, shared by all formatters; see CursesFormatter._setup_styles
+_stylecache = {}
+# screen session -> whether init_color works; see CursesFormatter.canchange
+_canchangecache = {}
 
 class CursesFormatter(Formatter):
     """Formatter that returns [(text,attr), ...],
@@ -38,8 +45,13 @@ class CursesFormatter(Formatter):
         self.defaultfg = options.get('defaultfg', -1)
         self.colors = options.get('colors', -1)
         self.style_attrs = {}
+        self._ttypeattrs = {} # _TokenType -> attr, filled from style_attrs
         self._tokentocolorpair = {}
         self._setup = False
+        # init_color / init_pair calls made, and those skipped because the
+        # terminal already had the right value
+        self.callsmade = 0
+        self.callssaved = 0
     
     def __setattr__(self, name, val):
         # if something important has changed, indicate style setup needs to 
@@ -50,14 +62,7 @@ class CursesFormatter(Formatter):
     
     @staticmethod
     def _distance(col1, col2):
-        r1, g1, b1 = col1
-        r2, g2, b2 = col2
-        
-        rd = r1 - r2
-        gd = g1 - g2
-        bd = b1 - b2
-        
-        return rd*rd + gd*gd + bd*bd
+        return colordistance(col1, col2)
     
     @staticmethod
     def hextorgb(hexstr):
@@ -71,82 +76,46 @@ class CursesFormatter(Formatter):
     
     def findclosest(self, rgb):
         """Takes an rgb tuple and finds the nearest color to it in the given
-        colordict, where colordict[colornum] = (r,g,b)"""
+        colordict, where colordict[colornum] = (r,g,b)
         
-        dist = 257 * 257 * 3
-        bestcol = None
-        
-        for col,colrgb in self.getcolordict().items():
-            curdist = self._distance(rgb, colrgb)
-            if curdist < dist:
-                dist = curdist
-                bestcol = col
-        
-        return bestcol
-    
-    def _regrouppairs(self):
-        """Goes through all the color pairs currently defined, and if two
-        tokens have the same color, they are reassigned to the same color pair.
-        
-        When you change colors... they won't be exactly right, but it frees up 
-        pairs."""
-        madepairs = {}
-        for (token, colpair) in list(self._tokentocolorpair.items()):
-            fg,bg = curses.pair_content(colpair)
-            if (fg,bg) in madepairs:
-                self._tokentocolorpair[token] = madepairs[(fg,bg)]
-            else:
-                madepairs[(fg,bg)] = colpair
+        Lookups are memoized and shared between formatters; see
+        cursesextras.closestcolor."""
+        return closestcolor(tuple(rgb), self.getcolordict())
     
     def _makeattr(self, token, fgcol, bgcol, otherattr):
         """Used by _make_all_colors and _setup_styles to fill a spot in
         self.style_attrs."""
         
-        # first get the right color pair for the token.
-        # if the style has been changed, we want to reuse the same color pairs
-        # as often as possible
-        if str(token) in self._tokentocolorpair:
-            colpair = self._tokentocolorpair[str(token)]
-        else:
-            usedcolpairs = list(self._tokentocolorpair.values())
-            # unused pairs start from 2; 0 is the 'default' white on black,
-            # and 1 is for the standard background.
-            colpair = -1
-            for pair in xrange(2,curses.COLOR_PAIRS):
-                if pair not in usedcolpairs:
-                    colpair = pair
-                    break
-            if colpair == -1:
-                # reuse old tokens if they're not in this style
-                styletokens = [str(token) for (token, ndef) in self.style]
-                for t in self._tokentocolorpair:
-                    if t not in styletokens:
-                        nextcol = self._tokentocolorpair[t]
-                        break
-            if colpair == -1:
-                # if we've used all available color pairs... its time 
-                # to reconsolidate and retry
-                self._regrouppairs()
-                
-                # this assumes the reconsolidation will do something.
-                # its conceivable it won't... but unlikely.
-                # if there are no more color pairs left even after 
-                # reconsolidation, we should get a recursion error here.
-                return self._makeattr(token, fgcol, bgcol, otherattr)
-                
-            self._tokentocolorpair[str(token)] = colpair
-        
-        #log(colpair,fgcol,bgcol)
-        try:
-            curses.init_pair(colpair, fgcol, bgcol)
-        except:
-            log(colpair, fgcol, bgcol)
-            raise
+        # get a color pair for the colors from the shared allocator; pairs
+        # with the same colors are shared, so restyling with mostly the same
+        # colors reuses the same pairs.
+        # the new pair is allocated before the old one is released, so that
+        # an unchanged token keeps its pair.
+        allocator = colorpairs.allocator()
+        made = allocator.initcalls
+        colpair = allocator.allocate(fgcol, bgcol)
+        self._countcalls(allocator.initcalls - made)
+        oldpair = self._tokentocolorpair.get(str(token))
+        if oldpair is not None:
+            allocator.release(oldpair)
+        self._tokentocolorpair[str(token)] = colpair
+        
         self.style_attrs[str(token)] = curses.color_pair(colpair) | otherattr
     
+    def _releasepair(self, token):
+        "Gives the color pair used by the given token back to the allocator."
+        colpair = self._tokentocolorpair.pop(token, None)
+        if colpair is not None:
+            colorpairs.allocator().release(colpair)
+    
+    def _countcalls(self, made):
+        """Records one init_color / init_pair call: made = 1 if it was sent to
+        the terminal, 0 if it was skipped."""
+        self.callsmade += made
+        self.callssaved += 1 - made
+    
     def _makecolor(self, colnum, rgb):
-        """Initializes a color and color pair in curses, as well as storing the
-        relevant data in self._tokentocolorpair.
+        """Initializes a color in curses, unless it already has that value.
         
         Assumes rgb is an (r,g,b) tuple, where r,g,b are in the range 0-255"""
         r,g,b = rgb
@@ -154,9 +123,17 @@ class CursesFormatter(Formatter):
         g = g*1000/255
         b = b*1000/255
         
-        curses.init_color(colnum, r,g,b)
+        made = colorpairs.colortable().initcolor(colnum, r,g,b)
+        self._countcalls(int(made))
     
-    def getstylefg(self):
+    def _setbackgroundpair(self, col):
+        "Sets color pair 1, used for window backgrounds, to be (-1, col)."
+        allocator = colorpairs.allocator()
+        made = allocator.initcalls
+        allocator.setpair(1, -1, col)
+        self._countcalls(allocator.initcalls - made)
+    
+    def _stylefgrgb(self):
         # get foreground from style
         # this is slightly complicated - pygments doesn't really give a way.
         # so we try Token.Text or Token.Generic.Output; if they don't work,
@@ -174,7 +151,10 @@ class CursesFormatter(Formatter):
         if not given:
             given = '000000'
         log('given:', given)
-        rgb = self.hextorgb(given)
+        return self.hextorgb(given)
+    
+    def getstylefg(self):
+        rgb = self._stylefgrgb()
         if self.canchange():
             self._makecolor(16, rgb) # we reserve color 16 for this purpose
             return 16
@@ -204,12 +184,12 @@ class CursesFormatter(Formatter):
         'formatter.updatewindow()' on every style change.
         """
         col = self.getstylebg()
-        curses.init_pair(1,-1, col)
+        self._setbackgroundpair(col)
         win.bkgd(' ', curses.color_pair(1))
         
     def updatewindow(self, win):
         col = self.getstylebg()
-        curses.init_pair(1,-1, col)
+        self._setbackgroundpair(col)
         win.redrawwin()
         
     def canchange(self):
@@ -218,14 +198,18 @@ class CursesFormatter(Formatter):
                     curses.COLORS > 16)
         if not canchange:
             return False
-        try:
-            self._makecolor(curses.COLORS-1,(0,0,0))
-            return True
-            log('CHANGE SUCCESSFUL!', curses.COLORS-1)
-        except:
-            log('CANCHANGE FALSE!')
-            return False
-            
+        # whether init_color works can only be found by trying it, and
+        # the answer won't change until the screen is restarted.
+        session = cursesextras.screensession
+        if session not in _canchangecache:
+            try:
+                self._makecolor(curses.COLORS-1,(0,0,0))
+                _canchangecache[session] = True
+                log('CHANGE SUCCESSFUL!', curses.COLORS-1)
+            except:
+                log('CANCHANGE FALSE!')
+                _canchangecache[session] = False
+        return _canchangecache[session]
     
     def getcolordict(self):
         colors = self.colors
@@ -242,10 +226,11 @@ class CursesFormatter(Formatter):
         
         # otherwise... black and white.
         #log('bw')
-        return {-1:(0,0,0)}
+        return colorsbw
     
     def setup_styles(self, force = False):
-        """Creates color pairs and fills the self.style_attrs dict."""
+        """Creates color pairs and fills the self.style_attrs dict, and the
+        token type -> attribute table used for formatting."""
         
         # if its already been setup, don't do it twice...
         if self._setup and not force:
@@ -253,14 +238,63 @@ class CursesFormatter(Formatter):
         self._setup = True
         
         log('SETTING UP STYLES...')
+        self._setup_styles()
+        self._maketokentable()
+    
+    def _stylekey(self):
+        """Returns everything a compiled style depends on, for use as a key in
+        _stylecache."""
+        return (self.style, self.colors, self.usebold, self.usebg,
+                self.defaultfg, self.defaultbg,
+                cursesextras.screensession, curses.COLORS, curses.COLOR_PAIRS)
+    
+    def _setup_styles(self):
+        # styles that have been used before are replayed from the cache,
+        # instead of being worked out again
+        key = self._stylekey()
+        if _stylecache.get('session') != cursesextras.screensession:
+            _stylecache.clear()
+            _stylecache['session'] = cursesextras.screensession
+        compiled = _stylecache.get(key)
+        if compiled is None:
+            compiled = _stylecache[key] = self._compilestyle()
+        self._applystyle(compiled)
+    
+    def _applystyle(self, compiled):
+        """Makes the colors and color pairs of a style compiled by
+        _compilestyle, and fills self.style_attrs."""
+        makecolors, tokenattrs = compiled
         
         # if we already have a style setup that has more definitions than the 
         # new one, clear those out...
         if self.style_attrs:
-            tokens = [token for (token, ndef) in self.style]
+            tokens = set(name for (name, fgcol, bgcol, attr) in tokenattrs)
             for k in list(self.style_attrs.keys()):
                 if k not in tokens:
                     del self.style_attrs[k]
+                    self._releasepair(k)
+        
+        for colnum, rgb in makecolors:
+            self._makecolor(colnum, rgb)
+        
+        for name, fgcol, bgcol, attr in tokenattrs:
+            if fgcol is None:
+                # no colors or color pairs to be had
+                self.style_attrs[name] = attr
+            else:
+                self._makeattr(name, fgcol, bgcol, attr)
+    
+    def _compilestyle(self):
+        """Works out the colors needed for the current style and settings.
+        
+        Returns (makecolors, tokenattrs), where makecolors is a list of
+        (colnum, rgb) colors that need to be made with init_color, and
+        tokenattrs is a list of (tokenname, fgcol, bgcol, attr). fgcol and
+        bgcol are None if the terminal has no color pairs.
+        
+        Nothing is sent to the terminal, except to check canchange()."""
+        makecolors = []
+        tokenattrs = []
         
         # if we can make our own colors, great!
         canchange = self.canchange()
@@ -268,10 +302,11 @@ class CursesFormatter(Formatter):
         # if we don't have colors or color pairs
         if curses.COLORS <= 1 or curses.COLOR_PAIRS <= 8:
             for ttype, ndef in self.style:
-                self.style_attrs[str(ttype)] = 0
+                attr = 0
                 if ndef['bold'] and self.usebold:
-                    self.style_attrs[str(ttype)] |= curses.A_BOLD
-            return
+                    attr |= curses.A_BOLD
+                tokenattrs.append((str(ttype), None, None, attr))
+            return makecolors, tokenattrs
         
         colors = self.colors
         
@@ -279,14 +314,22 @@ class CursesFormatter(Formatter):
         if colors == -1:
             colors = curses.COLORS
         
-        colordict = self.getcolordict()
-        
         defaultfg = self.defaultfg
         defaultbg = self.defaultbg
         if defaultfg == -2:
-            defaultfg = self.getstylefg()
+            rgb = self._stylefgrgb()
+            if canchange:
+                defaultfg = 16 # we reserve color 16 for this purpose
+                makecolors.append((16, rgb))
+            else:
+                defaultfg = self.findclosest(rgb)
         if defaultbg == -2:
-            defaultbg = self.getstylebg()
+            rgb = self.hextorgb(self.style.background_color)
+            if canchange:
+                defaultbg = 17 # we reserve color 17 for this purpose
+                makecolors.append((17, rgb))
+            else:
+                defaultbg = self.findclosest(rgb) % max(1,curses.COLORS)
         
         lastcolor = 17 # used for making colors - next color made will be 18.
                        # We don't touch colors 0-17:
@@ -301,7 +344,7 @@ class CursesFormatter(Formatter):
                 rgb = self.hextorgb(colstr)
                 if canchange:
                     lastcolor = fgcol = lastcolor + 1
-                    self._makecolor(lastcolor, rgb)
+                    makecolors.append((lastcolor, rgb))
                 else:
                     fgcol = self.findclosest(rgb)
             if self.usebg and ndef['bgcolor']:
@@ -309,7 +352,7 @@ class CursesFormatter(Formatter):
                 rgb = self.hextorgb(colstr)
                 if canchange:
                     lastcolor = bgcol = lastcolor + 1
-                    self._makecolor(lastcolor, rgb)
+                    makecolors.append((lastcolor, rgb))
                 else:
                     bgcol = self.findclosest(rgb)
             if self.usebold and ndef['bold']:
@@ -321,8 +364,38 @@ class CursesFormatter(Formatter):
             if colors <= 8 and bgcol >= 8:
                 bgcol %= colors
             
-            self._makeattr(ttype, fgcol, bgcol, attr)
+            tokenattrs.append((str(ttype), fgcol, bgcol, attr))
         
+        return makecolors, tokenattrs
+    
+    def _maketokentable(self):
+        """Fills self._ttypeattrs with the attribute of every token type known
+        to pygments, so formatting is a single dict lookup per token."""
+        self._ttypeattrs = {}
+        stack = [Token]
+        while stack:
+            ttype = stack.pop()
+            self._lookupattr(ttype)
+            stack.extend(ttype.subtypes)
+    
+    def _lookupattr(self, ttype):
+        """Finds the attribute for ttype in self.style_attrs, using that of the
+        nearest parent if ttype is not in the style, and stores it in
+        self._ttypeattrs."""
+        attr = self._ttypeattrs.get(ttype)
+        if attr is not None:
+            return attr
+        
+        name = str(ttype)
+        if name in self.style_attrs:
+            attr = self.style_attrs[name]
+        elif ttype.parent is not None:
+            attr = self._lookupattr(ttype.parent)
+        else:
+            attr = 0
+        self._ttypeattrs[ttype] = attr
+        return attr
+    
     def formatgenerator(self, tokensource):
         """Takes a token source, and generates (tokenstring, cursesattr) pairs.
         
@@ -332,16 +405,25 @@ class CursesFormatter(Formatter):
         
         self.setup_styles()
         
+        ttypeattrs = self._ttypeattrs
         for (ttype, tstring) in tokensource:
-            while str(ttype) not in self.style_attrs:
-                if str(ttype) == '':
-                    yield tstring, 0
-                    
-                ttype = ttype[:-1]
-
-            attr = self.style_attrs[str(ttype)]
+            attr = ttypeattrs.get(ttype)
+            if attr is None:
+                # a token type made after setup_styles
+                attr = self._lookupattr(ttype)
             yield tstring, attr
     
+    def formattokens(self, tokens):
+        """Like formatgenerator, but formats a whole token list at once,
+        returning a list of (tokenstring, cursesattr) pairs."""
+        self.setup_styles()
+        
+        ttypeattrs = self._ttypeattrs
+        lookup = self._lookupattr
+        return [(tstring, ttypeattrs[ttype] if ttype in ttypeattrs
+                                            else lookup(ttype))
+                    for (ttype, tstring) in tokens]
+    
     def format(self, tokensource, outfile):
         for (tstring, attr) in self.formatgenerator(tokensource):
             outfile.write(tstring, attr)
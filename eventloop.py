@@ -0,0 +1,228 @@
+"""An event loop for the interpreter, so that typing does not stop everything
+else from happening.
+
+Textbox.edit() blocks in getch() until a key is pressed. EventLoop instead
+waits (with select) for keys on stdin, timers, and any other file descriptors
+it is given, whichever comes first; keys are then read with getch() in nodelay
+mode, which never blocks, and passed to the key handler on top of a stack.
+Once everything ready has been handled, the loop draws a frame, if it has a
+FrameScheduler.
+
+Without a file descriptor for keys (keyfd=None), keys are only read from the
+window; this is how it is run headlessly, with a MemoryWindow: see test().
+"""
+
+import time
+import heapq
+import errno
+import select
+import curses
+from curses import textpad
+
+class EventLoop(object):
+    def __init__(self, win, scheduler=None, keyfd=0):
+        """win: the window keys are read from (with getch)
+        scheduler: a FrameScheduler to draw a frame with, after each round
+        keyfd: the file descriptor keys arrive on, or None to only read them
+            from win, without waiting for them"""
+        self.win = win
+        win.nodelay(1)
+        self.scheduler = scheduler
+        self.keyfd = keyfd
+        self.running = False
+        self._handlers = [] # key handlers; the last one gets the keys
+        self._timers = [] # a heap of [when, number, func, args]
+        self._timercount = 0
+        self._readers = {} # fd -> func
+
+    def pushhandler(self, handler):
+        """Sends the keys pressed to handler(ch) from now on, until it is
+        popped."""
+        self._handlers.append(handler)
+
+    def pophandler(self):
+        "Goes back to the key handler before the last one pushed."
+        return self._handlers.pop()
+
+    def edit(self, box, done):
+        """Edits in box (a curses.textpad.Textbox, or a vipad.ExtendedTextbox)
+        with the keys pressed, until it is finished; then calls done with the
+        text, as box.edit() would have returned it."""
+        istextpad = isinstance(box, textpad.Textbox)
+        if hasattr(box, 'startedit'):
+            box.startedit()
+        def handler(ch):
+            if istextpad:
+                # Textbox.do_command returns false when editing is finished
+                finished = not box.do_command(ch)
+            else:
+                finished = box.do_command(ch)
+            if self.scheduler is not None:
+                self.scheduler.mark(box.win)
+            elif istextpad:
+                box.win.refresh()
+            if finished:
+                self.pophandler()
+                done(box.gather())
+        self.pushhandler(handler)
+
+    def calllater(self, delay, func, *args):
+        """Calls func(*args) after delay seconds. Returns a timer, which can
+        be given to cancel()."""
+        self._timercount += 1
+        timer = [time.time() + delay, self._timercount, func, args]
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def every(self, interval, func, *args):
+        """Calls func(*args) every interval seconds. Returns a timer, which
+        can be given to cancel() (it stays the same timer every time)."""
+        timer = [None]
+        def repeat():
+            timer[0] = self.calllater(interval, repeat)
+            func(*args)
+        timer[0] = self.calllater(interval, repeat)
+        # the timer in the heap changes every time; cancel() looks in here
+        return timer
+
+    def cancel(self, timer):
+        "Stops a timer from calllater() or every() from going off."
+        if len(timer) == 1:
+            timer = timer[0]
+        # it is left in the heap, and skipped when it comes up
+        timer[2] = None
+
+    def addreader(self, fd, func):
+        "Calls func() whenever fd can be read from."
+        self._readers[fd] = func
+
+    def removereader(self, fd):
+        del self._readers[fd]
+
+    def stop(self):
+        "Makes run() return, once what it is handling is finished."
+        self.running = False
+
+    def dispatch(self, ch):
+        "Gives a key to the current key handler; keys with no handler are lost."
+        if self._handlers:
+            self._handlers[-1](ch)
+
+    def _readkeys(self):
+        "Handles every key that can be read without waiting."
+        while self.running:
+            ch = self.win.getch()
+            if ch == -1:
+                break
+            self.dispatch(ch)
+
+    def _runtimers(self):
+        "Calls the timers that are due."
+        now = time.time()
+        timers = self._timers
+        while timers and timers[0][0] <= now and self.running:
+            when, number, func, args = heapq.heappop(timers)
+            if func is not None:
+                func(*args)
+
+    def _timeout(self):
+        """Returns how long to wait for something to happen, or None for as
+        long as it takes."""
+        timers = self._timers
+        while timers and timers[0][2] is None:
+            heapq.heappop(timers)
+        timeouts = []
+        if timers:
+            timeouts.append(max(0, timers[0][0] - time.time()))
+        if self.scheduler is not None:
+            untilframe = self.scheduler.timeuntilnext()
+            if untilframe is not None:
+                timeouts.append(untilframe)
+        if not timeouts:
+            return None
+        return min(timeouts)
+
+    def runonce(self):
+        """Waits for keys, timers or readers, handles what is ready, and draws
+        a frame. Returns False if there is nothing left to wait for (which
+        only happens without a keyfd)."""
+        timeout = self._timeout()
+        fds = list(self._readers)
+        if self.keyfd is not None:
+            fds.append(self.keyfd)
+        ready = []
+        if fds:
+            try:
+                ready, w, x = select.select(fds, [], [], timeout)
+            except select.error as e:
+                # a signal, such as SIGWINCH when the terminal is resized
+                if e.args[0] != errno.EINTR:
+                    raise
+        elif timeout is not None:
+            time.sleep(timeout)
+
+        self._readkeys()
+        for fd in ready:
+            if fd != self.keyfd and fd in self._readers and self.running:
+                self._readers[fd]()
+        self._runtimers()
+        if self.scheduler is not None:
+            self.scheduler.frame()
+        return bool(fds) or self._timeout() is not None
+
+    def run(self):
+        "Handles keys, timers and readers until stop() is called."
+        self.running = True
+        while self.running:
+            if not self.runonce():
+                break
+        self.running = False
+
+def test():
+    """Runs an ExtendedTextbox, a curses Textbox and a TextPanel in an event
+    loop, with no terminal."""
+    from vipad import ExtendedTextbox
+    from interpreterwidget import TextPanel
+    from framescheduler import FrameScheduler
+    from memorywindow import MemoryWindow
+
+    keywin = MemoryWindow(3, 20)
+    outwin = MemoryWindow(4, 20)
+    updates = []
+    scheduler = FrameScheduler(0, doupdate=lambda: updates.append(1))
+    loop = EventLoop(keywin, scheduler, keyfd=None)
+    panel = TextPanel(outwin)
+    panel.scheduler = scheduler
+    results = []
+
+    box = ExtendedTextbox(keywin)
+    def edited(text):
+        results.append(text)
+        panel.write(text + '\n')
+        # then a curses Textbox, which finishes on Ctrl-G
+        keywin.erase()
+        loop.edit(textpad.Textbox(keywin), edited2)
+    def edited2(text):
+        # Textbox.gather() leaves spaces and newlines at the end
+        results.append(text.rstrip())
+        loop.stop()
+    loop.edit(box, edited)
+    loop.every(1.0 / panel.maxfps, panel.poll)
+    # keys arrive a few at a time, with output in between
+    loop.calllater(0, keywin.feed, 'helo')
+    loop.calllater(0.01, keywin.feed,
+                   [curses.KEY_LEFT, ord('l'), curses.KEY_END])
+    loop.calllater(0.02, keywin.feed, ' there\n')
+    loop.calllater(0.03, panel.write, 'timer\n')
+    loop.calllater(0.1, keywin.feed, 'second\x07')
+    loop.run()
+
+    print results
+    print outwin.lines()
+    print scheduler.stats()
+    assert results == ['hello there', 'second']
+    assert outwin.lines()[:2] == ['hello there'.ljust(20), 'timer'.ljust(20)]
+    assert not loop.running
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,320 @@
+"""Runs code on a worker thread, so that the interface keeps working while it
+runs.
+
+Cells of code given to Executor.submit() are run one at a time, in order, in a
+shared namespace, the way the interactive interpreter runs them: if the last
+statement is an expression, its value is printed. What they write to stdout
+and stderr is collected as it is written, and handed back to the thread that
+handles the interface, which is woken up through a pipe (fileno()): when it
+can be read from, call handleevents(), which calls onstart, onoutput and
+ondone as the cells start, write, and finish.
+
+interrupt() raises KeyboardInterrupt in the running cell. Like Ctrl-C in the
+interpreter, this only takes effect when the cell is running Python code: a
+cell blocked in a call such as time.sleep() is interrupted when it returns."""
+
+import os
+import sys
+import ast
+import time
+import fcntl
+import ctypes
+import thread
+import threading
+import traceback
+import Queue
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# the RUSAGE_THREAD of getrusage(2), which the resource module does not name
+_RUSAGE_THREAD = 1
+
+def cputime():
+    """Returns the CPU time used by the calling thread, where that can be
+    found (Linux), or else by the whole process."""
+    if resource is not None and sys.platform.startswith('linux'):
+        usage = resource.getrusage(_RUSAGE_THREAD)
+        return usage.ru_utime + usage.ru_stime
+    return time.clock()
+
+def runcode(code, filename, namespace):
+    """Runs code in namespace, the way the interactive interpreter would:
+    the value of a final expression is printed."""
+    tree = ast.parse(code, filename)
+    body = tree.body
+    last = None
+    if body and isinstance(body[-1], ast.Expr):
+        last = ast.Interactive([body.pop()])
+    if body:
+        exec compile(tree, filename, 'exec') in namespace
+    if last is not None:
+        exec compile(last, filename, 'single') in namespace
+
+def formatexception(etype, value, tb, hidden=()):
+    """Formats an exception raised by runcode, leaving out the frames before
+    the code's own (those of runcode, and whatever called it), and any at the
+    end whose code is in hidden (such as a signal handler's)."""
+    if issubclass(etype, SyntaxError):
+        return ''.join(traceback.format_exception_only(etype, value))
+    while tb is not None and tb.tb_frame.f_code.co_filename[:1] != '<':
+        tb = tb.tb_next
+    frames = []
+    t = tb
+    while t is not None:
+        frames.append(t.tb_frame.f_code)
+        t = t.tb_next
+    limit = len(frames)
+    while limit and frames[limit - 1] in hidden:
+        limit -= 1
+    return ''.join(traceback.format_exception(etype, value, tb, limit or None))
+
+class Cell(object):
+    """A piece of code given to an Executor. Once finished, walltime and
+    cputime say how long it took, and error is True if it raised an
+    exception (interrupted, if that exception was an interruption)."""
+    def __init__(self, number, code):
+        self.number = number
+        self.code = code
+        self.started = False
+        self.finished = False
+        self.error = False
+        self.interrupted = False
+        self.walltime = None
+        self.cputime = None
+
+    def __repr__(self):
+        return '<Cell %d>' % self.number
+
+class _ThreadStream(object):
+    """Stands in for sys.stdout or sys.stderr: writes from the executor's
+    thread go to the executor, and all others to the original stream."""
+    def __init__(self, executor, name, original):
+        self.executor = executor
+        self.name = name
+        self.original = original
+
+    def write(self, txt):
+        if thread.get_ident() == self.executor._threadid:
+            self.executor._output(self.name, txt)
+        else:
+            self.original.write(txt)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if thread.get_ident() != self.executor._threadid:
+            self.original.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.original, name)
+
+class Executor(object):
+    def __init__(self, namespace=None):
+        if namespace is None:
+            namespace = {'__name__': '__main__'}
+        self.namespace = namespace
+        # called on the interface's thread, by handleevents()
+        self.onstart = None # onstart(cell)
+        self.onoutput = None # onoutput(cell, name, txt); name is 'stdout' or 'stderr'
+        self.ondone = None # ondone(cell)
+        self.current = None # the cell being run, while it can be interrupted
+        self._cell = None # the cell being run, which output belongs to
+        self._cellcount = 0
+        self._cells = Queue.Queue() # cells to run, or None to stop
+        self._events = Queue.Queue() # (kind, cell, data) to hand back
+        self._lock = threading.Lock() # held while self.current changes
+        self._readfd, self._writefd = os.pipe()
+        # so that handleevents() can empty it without waiting
+        flags = fcntl.fcntl(self._readfd, fcntl.F_GETFL)
+        fcntl.fcntl(self._readfd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._stdout = sys.stdout
+        self._stderr = sys.stderr
+        sys.stdout = _ThreadStream(self, 'stdout', sys.stdout)
+        sys.stderr = _ThreadStream(self, 'stderr', sys.stderr)
+        self._thread = threading.Thread(target=self._run, name='executor')
+        self._thread.daemon = True
+        self._threadid = None
+        self._thread.start()
+
+    def fileno(self):
+        "A file descriptor that can be read from when there are events."
+        return self._readfd
+
+    def submit(self, code):
+        "Queues code to be run, returning its Cell."
+        self._cellcount += 1
+        cell = Cell(self._cellcount, code)
+        self._cells.put(cell)
+        return cell
+
+    def interrupt(self):
+        """Raises KeyboardInterrupt in the running cell. Returns False if no
+        cell was running."""
+        with self._lock:
+            if self.current is None:
+                return False
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                    ctypes.c_long(self._threadid),
+                    ctypes.py_object(KeyboardInterrupt))
+            return True
+
+    def busy(self):
+        "Returns True if a cell is running or waiting to run."
+        return self.current is not None or not self._cells.empty()
+
+    def close(self):
+        """Interrupts the running cell, stops the thread once the cells
+        already submitted have finished, and puts sys.stdout and sys.stderr
+        back."""
+        self._cells.put(None)
+        self.interrupt()
+        sys.stdout = self._stdout
+        sys.stderr = self._stderr
+
+    def handleevents(self):
+        """Calls onstart, onoutput and ondone for what has happened since the
+        last call. Call this from the thread the interface runs on."""
+        try:
+            os.read(self._readfd, 4096)
+        except OSError:
+            pass
+        while True:
+            try:
+                kind, cell, data = self._events.get_nowait()
+            except Queue.Empty:
+                break
+            if kind == 'start':
+                cell.started = True
+                if self.onstart:
+                    self.onstart(cell)
+            elif kind == 'output':
+                if self.onoutput:
+                    self.onoutput(cell, *data)
+            elif kind == 'done':
+                cell.finished = True
+                if self.ondone:
+                    self.ondone(cell)
+
+    def _event(self, kind, cell, data=None):
+        self._events.put((kind, cell, data))
+        os.write(self._writefd, 'x')
+
+    def _output(self, name, txt):
+        if txt:
+            self._event('output', self._cell, (name, txt))
+
+    def _run(self):
+        self._threadid = thread.get_ident()
+        while True:
+            cell = self._cells.get()
+            if cell is None:
+                break
+            self._cell = cell
+            self._event('start', cell)
+            self._runcell(cell)
+            self._event('done', cell)
+            self._cell = None
+
+    def _runcell(self, cell):
+        wallstart = time.time()
+        cpustart = cputime()
+        try:
+            try:
+                with self._lock:
+                    self.current = cell
+                runcode(cell.code, '<cell %d>' % cell.number, self.namespace)
+            finally:
+                self._clearcurrent()
+        except BaseException as e:
+            cell.error = True
+            cell.interrupted = isinstance(e, KeyboardInterrupt)
+            self._output('stderr', formatexception(*sys.exc_info()))
+        cell.walltime = time.time() - wallstart
+        cell.cputime = cputime() - cpustart
+
+    def _clearcurrent(self):
+        """Clears self.current, so that from here on interrupt() leaves this
+        thread alone, and cancels an interrupt it raised that has not arrived
+        yet.
+
+        An interrupt can arrive part way through this, before self.current is
+        cleared; it is then tried again, or the thread would be interrupted
+        later, between cells, where nothing catches it."""
+        while True:
+            try:
+                with self._lock:
+                    self.current = None
+                    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                            ctypes.c_long(self._threadid), None)
+                return
+            except KeyboardInterrupt:
+                pass
+
+def test():
+    "Runs a few cells, including one that has to be interrupted."
+    executor = Executor()
+    output = []
+    finished = []
+    executor.onoutput = lambda cell, name, txt: output.append((cell.number, name, txt))
+    executor.ondone = finished.append
+    executor.submit('x = 6\nprint "x is", x')
+    executor.submit('x * 7')
+    executor.submit('1/0')
+    loop = executor.submit('while True: x += 1')
+    executor.submit('x > 6')
+    executor.submit('x +')
+    start = time.time()
+    while len(finished) < 6 and time.time() - start < 5:
+        executor.handleevents()
+        if loop.started and not loop.finished and time.time() - start > 0.2:
+            executor.interrupt()
+        time.sleep(0.01)
+    executor.close()
+
+    for cell in finished:
+        print cell, 'wall %.3fs, CPU %.3fs' % (cell.walltime, cell.cputime),
+        print 'error' if cell.error else ''
+    print output
+    assert [cell.number for cell in finished] == [1, 2, 3, 4, 5, 6]
+    assert (1, 'stdout', 'x is') in output and (2, 'stdout', '42') in output
+    assert finished[2].error and not finished[2].interrupted
+    assert finished[3].interrupted and finished[3].cputime > 0.1
+    assert (5, 'stdout', 'True') in output
+    assert finished[5].error and 'SyntaxError' in output[-1][2]
+
+    # an interrupt arriving while current is being cleared, after the cell
+    # has finished, does not leave the executor busy
+    class Lock(object):
+        "Raises an interrupt the second time the executor's thread uses it."
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.uses = 0
+        def __enter__(self):
+            if thread.get_ident() == executor._threadid:
+                self.uses += 1
+                if self.uses == 2:
+                    raise KeyboardInterrupt
+            self.lock.acquire()
+        def __exit__(self, *exc):
+            self.lock.release()
+    executor = Executor()
+    finished = []
+    executor.ondone = finished.append
+    executor._lock = Lock()
+    cell = executor.submit('x = 1')
+    start = time.time()
+    while not finished and time.time() - start < 5:
+        executor.handleevents()
+        time.sleep(0.01)
+    assert finished == [cell] and not cell.error
+    assert executor._lock.uses == 3
+    assert executor.current is None and not executor.busy()
+    executor.close()
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,265 @@
+"""A fast tokenizer for Python, giving the same kind of tokens as pygments'
+PythonLexer, so CursesFormatter can format them as it does any others.
+
+PythonLexer tries its rules one after another, in a state machine, at every
+position; FastPythonLexer matches one compiled regular expression, with an
+alternative for each kind of token, and decides what a name is with a
+dictionary lookup. It tells apart what the usual styles color differently
+(keywords, builtins, exceptions, special __names__, function and class names,
+namespaces, decorators, docstrings, string prefixes, kinds of numbers,
+comments), but does not split strings into escapes and interpolations, or
+parse nested f-string expressions. Keywords and builtins are those of the
+running Python.
+
+get_lexer_by_name() gives a FastPythonLexer for Python, and pygments' lexer
+for anything else."""
+
+import re
+import keyword
+import __builtin__
+
+import pygments.lexers
+from pygments.lexer import Lexer
+from pygments.token import (Text, Error, Comment, Keyword, Name, String, Number,
+                            Operator, Punctuation)
+
+_master = re.compile(r'''
+    (?P<space>[ \t\f]+|\\\n)
+  | (?P<newline>\n)
+  | (?P<name>(?![rRuUbBfF]{1,2}['"])[^\W\d]\w*)
+  | (?P<punctuation>[]{}:(),;[])
+  | (?P<decorator>@[^\W\d]\w*)
+  | (?P<operator>\*\*=?|//=?|>>=?|<<=?|!=|[-+*/%&|^=<>]=?|[~@`]|\.(?!\d))
+  | (?P<string>(?P<prefix>[rRuUbBfF]{1,2})?
+        (?:'(?!'')(?:\\[\s\S]|[^\\'\n])*'?
+          |"(?!"")(?:\\[\s\S]|[^\\"\n])*"?))
+  | (?P<tstring>(?P<tprefix>[rRuUbBfF]{1,2})?
+        (?:\'\'\'(?:\\[\s\S]|[^\\])*?(?:\'\'\'|\Z)
+          |"""(?:\\[\s\S]|[^\\])*?(?:"""|\Z)))
+  | (?P<comment>\#[^\n]*)
+  | (?P<float>(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?[jJ]?|\d+[eE][+-]?\d+[jJ]?)
+  | (?P<hex>0[xX][0-9a-fA-F]+[lL]?)
+  | (?P<oct>0[oO][0-7]+[lL]?)
+  | (?P<bin>0[bB][01]+[lL]?)
+  | (?P<integer>\d+[lLjJ]?)
+  | (?P<error>.)
+''', re.VERBOSE | re.UNICODE)
+
+_simple = {
+    'comment': Comment.Single,
+    'float': Number.Float,
+    'hex': Number.Hex,
+    'oct': Number.Oct,
+    'bin': Number.Bin,
+    'integer': Number.Integer,
+    'decorator': Name.Decorator,
+    'operator': Operator,
+    'punctuation': Punctuation,
+    'space': Text,
+    'newline': Text,
+    'error': Error,
+}
+
+_operatorwords = ('and', 'or', 'not', 'in', 'is')
+
+# the special names that are not methods
+_magicvariables = ('__all__', '__bases__', '__builtins__', '__class__',
+    '__closure__', '__code__', '__defaults__', '__dict__',
+    '__doc__', '__file__', '__func__', '__globals__', '__metaclass__',
+    '__module__', '__mro__', '__name__', '__package__', '__path__',
+    '__self__', '__slots__', '__weakref__')
+
+def _nametypes():
+    "Returns a dict of the names that are not plain Name, to their types."
+    types = {}
+    for name in dir(__builtin__):
+        if name.startswith('_'):
+            continue
+        obj = getattr(__builtin__, name)
+        if isinstance(obj, type) and issubclass(obj, BaseException):
+            types[name] = Name.Exception
+        else:
+            types[name] = Name.Builtin
+    for name in ('self', 'cls', 'Ellipsis', 'NotImplemented'):
+        types[name] = Name.Builtin.Pseudo
+    for name in keyword.kwlist:
+        types[name] = Keyword
+    for name in ('True', 'False', 'None'):
+        types[name] = Keyword.Constant
+    for name in _operatorwords:
+        types[name] = Operator.Word
+    for name in ('import', 'from'):
+        types[name] = Keyword.Namespace
+    for name in _magicvariables:
+        types[name] = Name.Variable.Magic
+    return types
+
+class FastPythonLexer(Lexer):
+    name = 'Python (fast)'
+    aliases = ['fastpython']
+    nametypes = _nametypes()
+
+    def get_tokens_unprocessed(self, text):
+        """Yields (index, ttype, value) for the tokens of text, as pygments'
+        lexers do."""
+        nametypes = self.nametypes
+        simple = _simple
+        # what is expected after the last keyword: a 'function' or 'class'
+        # name, the names of an 'import', or the module of a 'from'
+        expect = None
+        afterdot = False # if true, the last token was a '.'
+        linestart = True # if true, only spaces since the start of the line
+        pos = 0
+        if text.startswith('#!'):
+            end = text.find('\n')
+            if end < 0:
+                end = len(text)
+            yield 0, Comment.Hashbang, text[:end]
+            pos = end
+        for m in _master.finditer(text, pos):
+            kind = m.lastgroup
+            start = m.start()
+            if kind == 'name':
+                value = m.group()
+                if expect is not None:
+                    if expect == 'function':
+                        if value[:2] == '__' and value[-2:] == '__':
+                            ttype = Name.Function.Magic
+                        else:
+                            ttype = Name.Function
+                        expect = None
+                    elif expect == 'class':
+                        ttype = Name.Class
+                        expect = None
+                    elif value == 'import':
+                        ttype = Keyword.Namespace
+                        expect = 'import' if expect == 'import' else None
+                    elif value == 'as':
+                        ttype = Keyword
+                    else:
+                        ttype = Name.Namespace
+                elif value[:2] == '__' and value[-2:] == '__':
+                    ttype = nametypes.get(value, Name.Function.Magic)
+                elif afterdot:
+                    ttype = Name
+                else:
+                    ttype = nametypes.get(value, Name)
+                    if ttype is Keyword:
+                        if value == 'def':
+                            expect = 'function'
+                        elif value == 'class':
+                            expect = 'class'
+                    elif ttype is Keyword.Namespace:
+                        expect = value
+                yield start, ttype, value
+                afterdot = False
+                linestart = False
+            elif kind == 'tstring' or kind == 'string':
+                prefix = m.group('tprefix' if kind == 'tstring' else 'prefix')
+                if prefix:
+                    yield start, String.Affix, prefix
+                    start += len(prefix)
+                value = text[start:m.end()]
+                if kind == 'tstring' and linestart:
+                    ttype = String.Doc
+                elif value[0] == '"':
+                    ttype = String.Double
+                else:
+                    ttype = String.Single
+                yield start, ttype, value
+                expect = None
+                afterdot = False
+                linestart = False
+            elif kind == 'space':
+                yield start, Text, m.group()
+            elif kind == 'newline':
+                yield start, Text, '\n'
+                expect = None
+                afterdot = False
+                linestart = True
+            else:
+                value = m.group()
+                ttype = simple[kind]
+                if expect is not None and expect != 'function' and expect != 'class':
+                    # the dots of a module's name, and the commas between
+                    # the names of an import
+                    if value == '.':
+                        ttype = Name.Namespace
+                    elif value == ',' and expect == 'import':
+                        ttype = Operator
+                    elif kind != 'comment':
+                        expect = None
+                elif kind != 'comment':
+                    expect = None
+                yield start, ttype, value
+                afterdot = value == '.'
+                linestart = False
+
+_pythonaliases = set(pygments.lexers.PythonLexer.aliases +
+                     FastPythonLexer.aliases)
+
+def get_lexer_by_name(name, **options):
+    """Returns a FastPythonLexer for Python, or else pygments' lexer for the
+    language."""
+    if name.lower() in _pythonaliases:
+        return FastPythonLexer(**options)
+    return pygments.lexers.get_lexer_by_name(name, **options)
+
+def agreement(text, lexer=None):
+    """Returns the fraction of the characters of text that FastPythonLexer
+    gives the same token type as lexer (pygments' PythonLexer by default)."""
+    if lexer is None:
+        lexer = pygments.lexers.PythonLexer()
+    def types(tokens):
+        result = []
+        for ttype, value in tokens:
+            result.extend([ttype] * len(value))
+        return result
+    fast = types(FastPythonLexer().get_tokens(text))
+    slow = types(lexer.get_tokens(text))
+    same = sum(1 for a, b in zip(fast, slow) if a == b)
+    return float(same) / max(len(slow), 1)
+
+def test():
+    "Checks the tokens of a few lines, and lexes this module."
+    lexer = FastPythonLexer()
+    src = ('#!/usr/bin/env python\n'
+           'from os.path import join as j\n'
+           '@dec\n'
+           'def f(self, a=None):\n'
+           '    """doc"""\n'
+           '    return u\'%s\' % 0x1F + 1.5e3 + len(a) + a.len\n'
+           'class C(ValueError): pass  # note\n')
+    tokens = [(ttype, value) for ttype, value in lexer.get_tokens(src)
+              if ttype is not Text]
+    expected = [
+        (Comment.Hashbang, '#!/usr/bin/env python'),
+        (Keyword.Namespace, 'from'), (Name.Namespace, 'os'),
+        (Name.Namespace, '.'), (Name.Namespace, 'path'),
+        (Keyword.Namespace, 'import'), (Name, 'join'), (Keyword, 'as'),
+        (Name, 'j'),
+        (Name.Decorator, '@dec'),
+        (Keyword, 'def'), (Name.Function, 'f'), (Punctuation, '('),
+        (Name.Builtin.Pseudo, 'self'), (Punctuation, ','), (Name, 'a'),
+        (Operator, '='), (Keyword.Constant, 'None'), (Punctuation, ')'),
+        (Punctuation, ':'),
+        (String.Doc, '"""doc"""'),
+        (Keyword, 'return'), (String.Affix, 'u'), (String.Single, "'%s'"),
+        (Operator, '%'), (Number.Hex, '0x1F'), (Operator, '+'),
+        (Number.Float, '1.5e3'), (Operator, '+'), (Name.Builtin, 'len'),
+        (Punctuation, '('), (Name, 'a'), (Punctuation, ')'), (Operator, '+'),
+        (Name, 'a'), (Operator, '.'), (Name, 'len'),
+        (Keyword, 'class'), (Name.Class, 'C'), (Punctuation, '('),
+        (Name.Exception, 'ValueError'), (Punctuation, ')'),
+        (Punctuation, ':'), (Keyword, 'pass'), (Comment.Single, '# note'),
+    ]
+    assert tokens == expected, [t for t in zip(tokens, expected) if t[0] != t[1]][:3]
+    source = open(__file__.replace('.pyc', '.py')).read()
+    # every character is in a token, in order
+    assert ''.join(v for t, v in lexer.get_tokens(source)) == source
+    print 'agreement with PythonLexer: %.1f%%' % (100 * agreement(source))
+    assert get_lexer_by_name('python').__class__ is FastPythonLexer
+    assert get_lexer_by_name('c').__class__ is not FastPythonLexer
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,96 @@
+"""Keeps a copy of what has been drawn in a window, so that redrawing it only
+sends the cells that have changed to curses.
+
+curses already avoids repainting unchanged parts of the terminal, but every
+addstr still has to be made from Python; a FrameBuffer skips those for rows
+that have not changed, and for changed rows only writes from the first to the
+last changed cell."""
+
+import curses
+
+class FrameBuffer(object):
+    def __init__(self, win):
+        self.win = win
+        self._rows = None # (text, attrs) for each row, as last drawn
+        self._size = None
+        self.cellswritten = 0 # cells written by the last draw()
+        self.rowswritten = 0 # rows (partly) written by the last draw()
+        self.totalcells = 0 # cells written by all draws
+
+    def reset(self):
+        """Forgets what is on screen, so the next draw() writes everything.
+        Call this if something else has drawn in (or cleared) the window."""
+        self._rows = None
+
+    @staticmethod
+    def _row(line, width):
+        """Turns a line of markup into (text, attrs): the characters of the
+        row, padded or cut to width, and a tuple of their attributes."""
+        txts = []
+        attrs = []
+        for txt, attr in line:
+            txts.append(txt)
+            attrs.extend([attr or 0] * len(txt))
+        text = ''.join(txts)[:width]
+        del attrs[width:]
+        padding = width - len(text)
+        return text + ' ' * padding, tuple(attrs) + (0,) * padding
+
+    def draw(self, lines):
+        """Makes the window show lines, a list of markup lines (each a list of
+        (str, attr) pairs), one per row; rows past the end are blanked.
+
+        Returns the number of cells written."""
+        height, width = self.win.getmaxyx()
+        if self._rows is None or self._size != (height, width):
+            self._rows = [None] * height
+            self._size = (height, width)
+
+        written = rows = 0
+        blank = None
+        for y in range(height):
+            if y < len(lines):
+                text, attrs = self._row(lines[y], width)
+            else:
+                if blank is None:
+                    blank = self._row([], width)
+                text, attrs = blank
+            old = self._rows[y]
+            if old is not None and old[0] == text and old[1] == attrs:
+                continue
+
+            # find the span of changed cells
+            first, last = 0, width - 1
+            if old is not None:
+                oldtext, oldattrs = old
+                while (text[first] == oldtext[first] and
+                        attrs[first] == oldattrs[first]):
+                    first += 1
+                while (text[last] == oldtext[last] and
+                        attrs[last] == oldattrs[last]):
+                    last -= 1
+            self._write(y, first, last + 1, text, attrs)
+            self._rows[y] = (text, attrs)
+            written += last + 1 - first
+            rows += 1
+
+        self.cellswritten = written
+        self.rowswritten = rows
+        self.totalcells += written
+        return written
+
+    def _write(self, y, begin, end, text, attrs):
+        "Writes the cells from begin up to end of row y, one addstr per run."
+        x = begin
+        while x < end:
+            attr = attrs[x]
+            runend = x + 1
+            while runend < end and attrs[runend] == attr:
+                runend += 1
+            try:
+                self.win.addstr(y, x, text[x:runend], attr)
+            except curses.error:
+                # writing to the bottom right corner moves the cursor off the
+                # window, which curses reports as an error
+                pass
+            x = runend
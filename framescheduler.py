@@ -0,0 +1,153 @@
+"""Refreshes several curses windows as one frame.
+
+win.refresh() copies the window to curses' picture of the screen and then
+sends the changes to the terminal; doing that for each window that changed
+sends several updates for what is really one change. A FrameScheduler is told
+which windows have changed (mark), and draws them all at once (frame): each
+with win.noutrefresh(), then a single curses.doupdate().
+
+Frames are drawn at most maxfps times a second; frame() does nothing if it is
+too soon, leaving the windows marked for the next one. The time each frame
+takes is recorded, along with how many windows it refreshed and how many
+times they were marked, so code that refreshes too often shows up in stats()."""
+
+import time
+import curses
+from collections import OrderedDict, deque, namedtuple
+
+# windows: the number refreshed; marks: the number of mark() calls it covered;
+# seconds: how long noutrefresh and doupdate took
+FrameStats = namedtuple('FrameStats', 'windows marks seconds')
+
+class FrameScheduler(object):
+    def __init__(self, maxfps=60, budget=None, historysize=100,
+                 doupdate=curses.doupdate):
+        """maxfps: the most frames drawn per second (0 for no limit)
+        budget: how long, in seconds, a frame should take; frames that take
+            longer are counted in self.overbudget. Defaults to 1/maxfps.
+        historysize: how many FrameStats to keep in self.history
+        doupdate: called once per frame to update the terminal"""
+        self.maxfps = maxfps
+        if budget is None and maxfps:
+            budget = 1.0 / maxfps
+        self.budget = budget
+        self.doupdate = doupdate
+        self._dirty = OrderedDict() # windows to refresh, in order
+        self._marks = 0 # mark() calls since the last frame
+        self._lastframe = 0
+        # if set, this window is refreshed last in every frame, so that the
+        # terminal's cursor is left where it is in that window
+        self.cursorwin = None
+        self.history = deque(maxlen=historysize)
+        self.frames = 0
+        self.windowsflushed = 0
+        self.marks = 0
+        self.deferred = 0 # frame() calls that were too soon
+        self.overbudget = 0
+        self.seconds = 0.0
+
+    def mark(self, win):
+        """Marks a window as needing a refresh in the next frame.
+
+        Windows are refreshed in the order they were first marked, so windows
+        that others overlap should be marked first."""
+        self._dirty[win] = None
+        self._marks += 1
+        self.marks += 1
+
+    def dirty(self):
+        "Returns True if any windows are waiting for a frame."
+        return bool(self._dirty)
+
+    def timeuntilnext(self):
+        """Returns how many seconds until a frame may be drawn (0 if one may
+        be drawn now), or None if nothing is waiting for one."""
+        if not self._dirty:
+            return None
+        if not self.maxfps:
+            return 0
+        return max(0, self._lastframe + 1.0 / self.maxfps - time.time())
+
+    def frame(self):
+        """Draws a frame, if any windows are marked and it is not too soon
+        after the last. Returns True if a frame was drawn."""
+        if not self._dirty:
+            return False
+        if self.timeuntilnext() > 0:
+            self.deferred += 1
+            return False
+        return self.flush()
+
+    def flush(self):
+        """Draws a frame now, if any windows are marked, even if it is too
+        soon after the last. Returns True if a frame was drawn."""
+        if not self._dirty:
+            return False
+        start = time.time()
+        for win in self._dirty:
+            if win is not self.cursorwin:
+                win.noutrefresh()
+        if self.cursorwin is not None:
+            self.cursorwin.noutrefresh()
+        self.doupdate()
+        end = time.time()
+
+        stats = FrameStats(len(self._dirty), self._marks, end - start)
+        self.history.append(stats)
+        self.frames += 1
+        self.windowsflushed += stats.windows
+        self.seconds += stats.seconds
+        if self.budget is not None and stats.seconds > self.budget:
+            self.overbudget += 1
+        self._dirty.clear()
+        self._marks = 0
+        self._lastframe = end
+        return True
+
+    def stats(self):
+        """Returns a dict of totals over all frames: frames, windowsflushed,
+        marks, deferred, overbudget and seconds."""
+        return dict(frames=self.frames, windowsflushed=self.windowsflushed,
+                    marks=self.marks, deferred=self.deferred,
+                    overbudget=self.overbudget, seconds=self.seconds)
+
+def test():
+    """Draws frames of a few stand-in windows, checking the order they are
+    refreshed in, that frames too close together wait, and the stats."""
+    calls = []
+    class Window(object):
+        def __init__(self, name):
+            self.name = name
+        def noutrefresh(self):
+            calls.append(self.name)
+    a, b, c = Window('a'), Window('b'), Window('c')
+    scheduler = FrameScheduler(maxfps=10,
+                               doupdate=lambda: calls.append('doupdate'))
+    scheduler.cursorwin = b
+    assert not scheduler.frame() and scheduler.timeuntilnext() is None
+    for win in [b, a, c, a]:
+        scheduler.mark(win)
+    assert scheduler.dirty() and scheduler.frame()
+    # in the order first marked, except the cursor's window, which is last
+    assert calls == ['a', 'c', 'b', 'doupdate']
+    assert not scheduler.dirty()
+    # too soon for another frame: c stays marked
+    del calls[:]
+    scheduler.mark(c)
+    assert scheduler.timeuntilnext() > 0
+    assert not scheduler.frame() and calls == [] and scheduler.dirty()
+    assert scheduler.flush()
+    # the cursor's window is refreshed even when it was not marked
+    assert calls == ['c', 'b', 'doupdate']
+    scheduler._lastframe -= 1
+    assert not scheduler.frame() # nothing marked
+    scheduler.mark(a)
+    assert scheduler.timeuntilnext() == 0 and scheduler.frame()
+    stats = scheduler.stats()
+    assert (stats['frames'], stats['windowsflushed'], stats['marks'],
+            stats['deferred']) == (3, 5, 6, 1), stats
+    assert [s.windows for s in scheduler.history] == [3, 1, 1]
+    assert [s.marks for s in scheduler.history] == [4, 1, 1]
+
+if __name__ == '__main__':
+    test()
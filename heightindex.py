@@ -0,0 +1,239 @@
+"""An index of the heights of a sequence of items, such as the number of screen
+lines each wrapped text takes up.
+
+HeightIndex works like a list of heights, but can also say where each item
+starts (offset) and which item covers a given line (find), and all of these,
+along with inserting and deleting, take O(log n) time. It is kept as a treap
+(a binary tree, balanced by random priorities) ordered by position, where each
+node knows the number of items and the total height below it."""
+
+import random
+
+class _Node(object):
+    __slots__ = ('left', 'right', 'priority', 'height', 'size', 'total')
+    def __init__(self, height):
+        self.left = self.right = None
+        self.priority = random.random()
+        self.height = height
+        self.size = 1
+        self.total = height
+
+def _size(node):
+    return node.size if node is not None else 0
+
+def _total(node):
+    return node.total if node is not None else 0
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+    node.total = node.height + _total(node.left) + _total(node.right)
+
+def _merge(a, b):
+    "Joins two treaps, with all of a before all of b."
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        a.right = _merge(a.right, b)
+        _update(a)
+        return a
+    b.left = _merge(a, b.left)
+    _update(b)
+    return b
+
+def _split(node, count):
+    "Splits a treap into (first count items, the rest)."
+    if node is None:
+        return None, None
+    leftsize = _size(node.left)
+    if count <= leftsize:
+        left, node.left = _split(node.left, count)
+        _update(node)
+        return left, node
+    node.right, right = _split(node.right, count - leftsize - 1)
+    _update(node)
+    return node, right
+
+class HeightIndex(object):
+    """A list of non-negative heights, with O(log n) prefix sums.
+
+    Supports len(), index[i], index[i] = h, del index[i], insert(i, h),
+    append(h), as a list would (negative indices are not supported), plus:
+
+    insertmany(i, heights): inserts several heights before item i
+    deleterange(begin, end): deletes the items from begin up to end
+    total(): the sum of all heights
+    offset(i): the sum of the heights before item i
+    find(y): the item covering line y, and the line within it"""
+    def __init__(self, heights=()):
+        self._root = None
+        for height in heights:
+            self.append(height)
+
+    def __len__(self):
+        return _size(self._root)
+
+    def __iter__(self):
+        stack = []
+        node = self._root
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+            else:
+                node = stack.pop()
+                yield node.height
+                node = node.right
+
+    def __repr__(self):
+        return 'HeightIndex(%r)' % list(self)
+
+    def total(self):
+        return _total(self._root)
+
+    def _path(self, index):
+        """Returns the list of nodes from the root down to item index."""
+        if not 0 <= index < len(self):
+            raise IndexError('HeightIndex index out of range')
+        path = []
+        node = self._root
+        while True:
+            path.append(node)
+            leftsize = _size(node.left)
+            if index < leftsize:
+                node = node.left
+            elif index == leftsize:
+                return path
+            else:
+                index -= leftsize + 1
+                node = node.right
+
+    def __getitem__(self, index):
+        return self._path(index)[-1].height
+
+    def __setitem__(self, index, height):
+        path = self._path(index)
+        path[-1].height = height
+        for node in reversed(path):
+            _update(node)
+
+    def insert(self, index, height):
+        index = max(0, min(index, len(self)))
+        left, right = _split(self._root, index)
+        self._root = _merge(_merge(left, _Node(height)), right)
+
+    def append(self, height):
+        self._root = _merge(self._root, _Node(height))
+
+    def insertmany(self, index, heights):
+        index = max(0, min(index, len(self)))
+        middle = None
+        for height in heights:
+            middle = _merge(middle, _Node(height))
+        left, right = _split(self._root, index)
+        self._root = _merge(_merge(left, middle), right)
+
+    def __delitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError('HeightIndex index out of range')
+        left, right = _split(self._root, index)
+        middle, right = _split(right, 1)
+        self._root = _merge(left, right)
+
+    def deleterange(self, begin, end):
+        left, right = _split(self._root, begin)
+        middle, right = _split(right, end - begin)
+        self._root = _merge(left, right)
+
+    def offset(self, index):
+        """Returns the total height of the items before item index
+        (index may be len(self), giving total())."""
+        offset = 0
+        node = self._root
+        while node is not None:
+            leftsize = _size(node.left)
+            if index <= leftsize:
+                node = node.left
+            else:
+                offset += _total(node.left) + node.height
+                index -= leftsize + 1
+                node = node.right
+        return offset
+
+    def find(self, y):
+        """Returns (index, line) such that line y is line 'line' of item
+        'index'. Items of height 0 are skipped. If y is past the end,
+        returns (len(self), y - total())."""
+        if y < 0:
+            return 0, y
+        index = 0
+        node = self._root
+        while node is not None:
+            lefttotal = _total(node.left)
+            if y < lefttotal:
+                node = node.left
+            elif y < lefttotal + node.height:
+                return index + _size(node.left), y - lefttotal
+            else:
+                y -= lefttotal + node.height
+                index += _size(node.left) + 1
+                node = node.right
+        return index, y
+
+def test():
+    """Makes random changes to a HeightIndex and to a list of the same
+    heights, checking offset and find against the list after each."""
+    rand = random.Random(0)
+    index = HeightIndex([1, 0, 3])
+    heights = [1, 0, 3]
+    for step in range(2000):
+        kind = rand.randrange(7)
+        where = rand.randrange(len(heights) + 1)
+        if kind == 0:
+            new = [rand.randrange(4) for i in range(rand.randrange(5))]
+            index.insertmany(where, new)
+            heights[where:where] = new
+        elif kind == 1:
+            end = rand.randrange(where, min(len(heights), where + 5) + 1)
+            index.deleterange(where, end)
+            del heights[where:end]
+        elif kind == 2:
+            height = rand.randrange(4)
+            index.insert(where, height)
+            heights.insert(where, height)
+        elif kind == 3:
+            height = rand.randrange(4)
+            index.append(height)
+            heights.append(height)
+        elif heights and kind == 4:
+            where = rand.randrange(len(heights))
+            height = rand.randrange(4)
+            index[where] = height
+            heights[where] = height
+        elif heights and kind == 5:
+            where = rand.randrange(len(heights))
+            del index[where]
+            del heights[where]
+        assert list(index) == heights and len(index) == len(heights)
+        assert index.total() == sum(heights)
+        # every offset, every line, and a couple of lines past the end
+        y = 0
+        for i, height in enumerate(heights):
+            assert index.offset(i) == y
+            for line in range(height):
+                assert index.find(y) == (i, line)
+                y += 1
+        assert index.offset(len(heights)) == y
+        assert index.find(y) == (len(heights), 0)
+        assert index.find(y + 1) == (len(heights), 1)
+    try:
+        index[len(heights)]
+    except IndexError:
+        pass
+    else:
+        assert False, 'no IndexError'
+    print '%d heights, total %d' % (len(index), index.total())
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,227 @@
+"""Lexes code on worker threads, so that highlighting a large piece of code
+does not hold up the interface.
+
+Code given to Highlighter.submit() is shown plain first, by the caller; a
+worker turns it into pygments tokens, and hands them back to the interface's
+thread, which is woken up through a pipe (fileno()): when it can be read from,
+call handleevents(), which calls each job's ondone(tokens). Only turning the
+tokens into curses attributes (CursesFormatter.formattokens) is left for the
+interface's thread, since that allocates color pairs.
+
+Every job has a key, saying what it is highlighting (such as the position of
+a text in a TextPanel). Jobs whose keys were last given to setvisible() are
+done first, so what is on screen is highlighted before what is not; a job
+submitted with the key of one that has not finished replaces it, and the old
+one is dropped, even if a worker has already started on it.
+
+With a TokenCache, code that has been lexed before is not lexed again: its
+job is done as soon as it is submitted (ondone is still called from
+handleevents())."""
+
+import os
+import fcntl
+import threading
+import Queue
+
+class HighlightJob(object):
+    def __init__(self, key, code, ondone):
+        self.key = key
+        self.code = code
+        self.ondone = ondone
+        self.cancelled = False
+        self.tokens = None # [(ttype, str)], once lexed
+
+    def __repr__(self):
+        return '<HighlightJob %r>' % (self.key,)
+
+class Highlighter(object):
+    # how many tokens a worker lexes between checks that its job is still
+    # wanted
+    checkevery = 256
+
+    def __init__(self, lexer, workers=2, cache=None):
+        self.lexer = lexer
+        self.cache = cache # a TokenCache, or None
+        self._cond = threading.Condition() # guards the next four
+        self._waiting = [] # jobs not yet started, oldest first
+        self._jobs = {} # key -> the job for it, until ondone is called
+        self._visible = frozenset()
+        self._closed = False
+        self._done = Queue.Queue() # lexed jobs, to hand back
+        self._readfd, self._writefd = os.pipe()
+        flags = fcntl.fcntl(self._readfd, fcntl.F_GETFL)
+        fcntl.fcntl(self._readfd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.submitted = 0
+        self.completed = 0 # jobs whose ondone was called
+        self.cancelled = 0
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._work, name='highlighter')
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def fileno(self):
+        "A file descriptor that can be read from when jobs are done."
+        return self._readfd
+
+    def submit(self, key, code, ondone):
+        """Queues code to be lexed; ondone(tokens) is called from
+        handleevents() once it is. Replaces any unfinished job with the same
+        key. Returns the HighlightJob."""
+        job = HighlightJob(key, code, ondone)
+        # (once the job is waiting, a worker may set job.tokens at any time)
+        cached = None
+        if self.cache is not None:
+            cached = job.tokens = self.cache.lookup(self.lexer, code)
+        with self._cond:
+            self._cancel(key)
+            self._jobs[key] = job
+            self.submitted += 1
+            if cached is None:
+                self._waiting.append(job)
+                self._cond.notify()
+        if cached is not None:
+            self._finished(job)
+        return job
+
+    def cancel(self, key):
+        "Drops the unfinished job with key, if there is one."
+        with self._cond:
+            self._cancel(key)
+
+    def _cancel(self, key):
+        job = self._jobs.pop(key, None)
+        if job is None:
+            return
+        job.cancelled = True
+        self.cancelled += 1
+        if job in self._waiting:
+            self._waiting.remove(job)
+
+    def keys(self):
+        "Returns the keys of the unfinished jobs."
+        with self._cond:
+            return list(self._jobs)
+
+    def setvisible(self, keys):
+        "Makes the jobs with these keys go ahead of the rest."
+        with self._cond:
+            self._visible = frozenset(keys)
+
+    def pending(self):
+        "Returns the number of unfinished jobs."
+        return len(self._jobs)
+
+    def close(self, timeout=1.0):
+        """Drops the unfinished jobs, and stops the workers, waiting up to
+        timeout seconds for each."""
+        with self._cond:
+            for key in list(self._jobs):
+                self._cancel(key)
+            self._closed = True
+            self._cond.notify_all()
+        # a worker part way through a job notices it was dropped, and stops
+        # within checkevery tokens
+        for t in self._threads:
+            t.join(timeout)
+
+    def handleevents(self):
+        """Calls ondone for the jobs lexed since the last call. Call this from
+        the thread the interface runs on."""
+        try:
+            os.read(self._readfd, 4096)
+        except OSError:
+            pass
+        while True:
+            try:
+                job = self._done.get_nowait()
+            except Queue.Empty:
+                break
+            with self._cond:
+                if job.cancelled:
+                    continue
+                del self._jobs[job.key]
+            self.completed += 1
+            job.ondone(job.tokens)
+
+    def _take(self):
+        "Waits for a job, taking a visible one if there is any."
+        with self._cond:
+            while not self._waiting and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return None
+            waiting = self._waiting
+            for i, job in enumerate(waiting):
+                if job.key in self._visible:
+                    return waiting.pop(i)
+            return waiting.pop(0)
+
+    def _work(self):
+        checkevery = self.checkevery
+        while True:
+            job = self._take()
+            if job is None:
+                return
+            tokens = []
+            for token in self.lexer.get_tokens(job.code):
+                tokens.append(token)
+                if len(tokens) % checkevery == 0 and job.cancelled:
+                    break
+            if job.cancelled:
+                continue
+            if self.cache is not None:
+                self.cache.store(self.lexer, job.code, tokens)
+            job.tokens = tokens
+            self._finished(job)
+
+    def _finished(self, job):
+        "Hands a job with its tokens back to the interface's thread."
+        self._done.put(job)
+        os.write(self._writefd, 'x')
+
+def test():
+    """Highlights a few pieces of code, one of them replaced before it is
+    done, with the visible ones first."""
+    import time
+    import pygments.lexers
+    lexer = pygments.lexers.get_lexer_by_name('python')
+    code = open(__file__.replace('.pyc', '.py')).read()
+    # one worker, so the order is predictable
+    highlighter = Highlighter(lexer, workers=1)
+    results = []
+    def ondone(key):
+        return lambda tokens: results.append((key, ''.join(s for t, s in tokens)))
+    with highlighter._cond:
+        # the worker cannot start until all of these are queued
+        highlighter.setvisible([3])
+        for key in range(4):
+            highlighter.submit(key, code, ondone(key))
+        highlighter.submit(2, 'x = 2\n', ondone(2))
+    start = time.time()
+    while highlighter.pending() and time.time() - start < 10:
+        time.sleep(0.01)
+        highlighter.handleevents()
+    highlighter.close()
+    print [key for key, txt in results]
+    assert [key for key, txt in results] == [3, 0, 1, 2]
+    assert results[0][1] == code and results[3][1] == 'x = 2\n'
+    assert highlighter.cancelled == 1 and highlighter.completed == 4
+
+    # with a cache, code seen before is not lexed again
+    from tokencache import TokenCache
+    highlighter = Highlighter(lexer, cache=TokenCache())
+    results = []
+    for key in range(3):
+        highlighter.submit(key, code, ondone(key))
+        start = time.time()
+        while highlighter.pending() and time.time() - start < 10:
+            time.sleep(0.01)
+            highlighter.handleevents()
+    highlighter.close()
+    assert [txt for key, txt in results] == [code] * 3
+    assert highlighter.cache.hits == 2 and highlighter.cache.misses == 1
+
+if __name__ == '__main__':
+    test()
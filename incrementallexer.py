@@ -0,0 +1,462 @@
+"""Lexes text a line at a time, keeping the lexer's state at the start of every
+line, so that after an edit only the lines from the edit on are lexed again,
+and only until the state is the same as it was before: typing in a long cell
+lexes a line or two, not the whole cell.
+
+The state at the start of a line is the pygments lexer's stack of states,
+which says, for example, that the line is inside a triple-quoted string. The
+brackets each line opens and closes are kept too, so that depth() can say how
+many are open at the start of a line (inside brackets, a line continues the
+statement before it); they are not part of the state, so opening a bracket
+does not mean lexing every line after it again.
+
+Some rules can look further than the line they are tried on: PythonLexer's
+rule for docstrings, for one, only matches where a docstring opens if it is
+closed somewhere after, and so depends on lines that come later. How far each
+line's rules may have looked is kept too, and an edit there lexes again from
+that line; a line that a token ends at the start of, after looking at its
+first character, is treated as starting inside the token.
+
+Only RegexLexers (such as PythonLexer) keep their state where it can be saved;
+with any other lexer, the whole text is lexed again after every change."""
+
+import sre_parse
+import sre_compile
+from sre_constants import (LITERAL, NOT_LITERAL, ANY, IN, SUBPATTERN, BRANCH,
+                           MAX_REPEAT, MIN_REPEAT, GROUPREF, SRE_FLAG_DOTALL)
+
+from pygments.lexer import RegexLexer
+from pygments.token import Token, Error, Punctuation, _TokenType
+
+_opening = '([{'
+_closing = ')]}'
+
+class IncrementalLexer(object):
+    def __init__(self, lexer):
+        """lexer: a pygments lexer; its options (such as tabsize and stripnl)
+        are not applied, since the lines are lexed one by one."""
+        self.lexer = lexer
+        self.incremental = isinstance(lexer, RegexLexer)
+        self._lines = []
+        self._tokens = [] # [(ttype, str)] for each line, without its '\n'
+        # (net, low) for each line: it takes a bracket depth d to
+        # max(d + net, low)
+        self._brackets = []
+        # the lexer's stack at the start of each line, and at the end of the
+        # last; None for lines that start inside a token
+        self._states = [('root',)]
+        # line -> the last line it looked at, for the lines whose tokens
+        # depend on lines after them (len(self) for the end of the text)
+        self._reaches = {}
+        self.lexed = 0 # the number of lines lexed, over all changes
+
+    def __len__(self):
+        return len(self._lines)
+
+    def tokens(self, linenum):
+        "Returns the tokens of a line, as a list of (ttype, str)."
+        return self._tokens[linenum]
+
+    def depth(self, linenum):
+        "Returns the number of brackets open at the start of a line."
+        depth = 0
+        for net, low in self._brackets[:linenum]:
+            depth = max(depth + net, low)
+        return depth
+
+    def replace(self, begin, end, newlines):
+        """Replaces lines begin up to end with newlines (a list of str, with
+        no '\\n'), and lexes what needs lexing again.
+
+        Returns (first, stop): the lines from first up to stop have new
+        tokens. first is begin, unless begin was inside a token that started
+        on an earlier line (such as a docstring); stop is at least
+        begin + len(newlines)."""
+        newlines = list(newlines)
+        count = len(newlines)
+        self._lines[begin:end] = newlines
+        self._tokens[begin:end] = [None] * count
+        self._brackets[begin:end] = [None] * count
+        if not self.incremental:
+            return self._lexall(begin, begin + count)
+        states = self._states
+        start = states[begin]
+        # the state at the start of the line after the new ones is kept as it
+        # was, to tell when the lexing has caught up with the old tokens
+        oldafter = states[end]
+        if count:
+            states[begin:end + 1] = [start] + [None] * (count - 1) + [oldafter]
+        else:
+            # the line now at begin was lexed from oldafter
+            states[begin:end + 1] = [oldafter]
+        first = begin
+        if self._reaches:
+            # an earlier line that looked at the lines changed may lex
+            # differently now
+            shift = count - (end - begin)
+            reaches = {}
+            for line, reach in self._reaches.iteritems():
+                if line < begin:
+                    if reach >= begin:
+                        first = min(first, line)
+                        reach = max(begin, reach + shift)
+                    reaches[line] = reach
+                elif line >= end:
+                    reaches[line + shift] = reach + shift
+            self._reaches = reaches
+        if first == begin:
+            if start is None:
+                # begin is inside a token that started on an earlier line
+                first -= 1
+            elif not count:
+                if start == oldafter:
+                    return begin, begin
+                states[begin] = start
+                if begin == len(self._lines):
+                    # the lines at the end were deleted: the state at the
+                    # end of the text is the one they started in
+                    return begin, begin
+        while states[first] is None:
+            first -= 1
+        stop = self._lex(first, begin + count)
+        self.lexed += stop - first
+        for i in range(first, stop):
+            self._brackets[i] = _brackets(self._tokens[i])
+        return first, stop
+
+    def _lex(self, first, after):
+        """Lexes from the start of line first (which must have a state) to the
+        first line, from line 'after' on, that starts in the state it did
+        before; returns the number of that line (or len(self)).
+
+        This is RegexLexer.get_tokens_unprocessed, lexing the lines joined,
+        and noting the state wherever a line starts between two tokens. A
+        line that starts inside a token gets no state: lexing cannot start
+        there."""
+        lexer = self.lexer
+        lines = self._lines
+        tokens = self._tokens
+        states = self._states
+        reaches = self._reaches
+        text = '\n'.join(lines[first:]) + '\n'
+        stack = states[first]
+        tokendefs = _tokendefs(lexer)
+        statestack = list(stack)
+        statetokens = tokendefs[statestack[-1]]
+        # the line pos is in, and where its '\n' is
+        line = first
+        lineend = len(lines[first])
+        # the line the tokens are being added to, and where its '\n' is
+        tline = first
+        tlineend = lineend
+        tokens[first] = []
+        reaches.pop(first, None)
+        pos = 0
+        while pos < len(text):
+            peeked = False # if true, the last match looked at text[pos]
+            for rexmatch, action, newstate, lookaheads in statetokens:
+                m = rexmatch(text, pos)
+                if m:
+                    if action is None:
+                        items = ()
+                    elif type(action) is _TokenType:
+                        items = [(pos, action, m.group())]
+                    else:
+                        items = action(lexer, m)
+                    pos = m.end()
+                    peeked = bool(lookaheads)
+                    if newstate is not None:
+                        _changestack(statestack, newstate)
+                        statetokens = tokendefs[statestack[-1]]
+                    break
+                else:
+                    for lookahead in lookaheads:
+                        m = lookahead(text, pos)
+                        if m and m.end() > lineend:
+                            # the rule failed, having looked at (at least)
+                            # the character after m
+                            reach = line + text.count('\n', lineend, m.end())
+                            if reach > reaches.get(line, line):
+                                reaches[line] = reach
+            else:
+                if text[pos] == '\n':
+                    # at the end of a line, RegexLexer goes back to 'root'
+                    statestack = ['root']
+                    statetokens = tokendefs['root']
+                    items = [(pos, Token.Text, '\n')]
+                else:
+                    items = [(pos, Error, text[pos])]
+                pos += 1
+
+            # share the tokens out among the lines they are on
+            for index, ttype, value in items:
+                if not value:
+                    continue
+                while index > tlineend:
+                    tline += 1
+                    tokens[tline] = []
+                    tlineend += len(lines[tline]) + 1
+                parts = value.split('\n')
+                for i, part in enumerate(parts):
+                    if i:
+                        if not part and i == len(parts) - 1:
+                            # the next line is entered when its first token
+                            # is, or when pos gets there (it may not need
+                            # lexing at all)
+                            break
+                        tline += 1
+                        tokens[tline] = []
+                        tlineend += len(lines[tline]) + 1
+                    if part:
+                        tokens[tline].append((ttype, part))
+
+            # note the states of the lines pos has gone past the start of
+            while pos > lineend:
+                line += 1
+                if line == len(lines):
+                    states[line] = None if peeked else tuple(statestack)
+                    return line
+                if pos > lineend + 1:
+                    states[line] = None
+                    reaches.pop(line, None)
+                else:
+                    state = None if peeked else tuple(statestack)
+                    if (state is not None and line >= after and
+                            states[line] == state):
+                        return line
+                    states[line] = state
+                    reaches.pop(line, None)
+                    if tline < line:
+                        tline = line
+                        tokens[line] = []
+                        tlineend = lineend + 1 + len(lines[line])
+                lineend += len(lines[line]) + 1
+        return len(lines)
+
+    def _lexall(self, begin, stop):
+        "Lexes the whole text, for lexers that cannot be lexed a line at a time."
+        self.lexed += len(self._lines)
+        text = '\n'.join(self._lines) + '\n'
+        old = self._tokens
+        self._tokens = [[]]
+        for index, ttype, value in self.lexer.get_tokens_unprocessed(text):
+            parts = value.split('\n')
+            for i, part in enumerate(parts):
+                if i:
+                    self._tokens.append([])
+                if part:
+                    self._tokens[-1].append((ttype, part))
+        # lexing the whole text leaves an empty line after the last
+        del self._tokens[len(self._lines):]
+        self._brackets = [_brackets(tokens) for tokens in self._tokens]
+        self._states = [None] * (len(self._lines) + 1)
+        self._reaches = {}
+        # the changed lines, as far as can be told
+        while begin > 0 and old[begin - 1] != self._tokens[begin - 1]:
+            begin -= 1
+        stop = max(stop, len(self._lines) - _commonsuffix(old, self._tokens))
+        return begin, stop
+
+# lexer class -> its states, as _tokendefs returns them
+_tokendefcache = {}
+
+def _tokendefs(lexer):
+    """Returns a dict of lexer's states to their rules, as a list of
+    (rexmatch, action, newstate, lookaheads). lookaheads are match functions
+    for the rule up to each of its repeats that can match a '\\n', made
+    greedy: where the rule fails and one of them matches, the rule may have
+    looked as far as the end of its match."""
+    cls = type(lexer)
+    try:
+        return _tokendefcache[cls]
+    except KeyError:
+        pass
+    tokendefs = {}
+    for state, rules in lexer._tokens.items():
+        tokendefs[state] = [(rexmatch, action, newstate,
+                             _lookaheads(rexmatch.__self__))
+                            for rexmatch, action, newstate in rules]
+    _tokendefcache[cls] = tokendefs
+    return tokendefs
+
+def _lookaheads(regex):
+    "Returns the lookaheads of a compiled regex (see _tokendefs)."
+    parsed = sre_parse.parse(regex.pattern, regex.flags)
+    pattern = parsed.pattern
+    flags = regex.flags | pattern.flags
+    return [sre_compile.compile(sre_parse.SubPattern(pattern, items),
+                                flags).match
+            for items in _prefixes(parsed, pattern, flags)]
+
+def _prefixes(data, pattern, flags):
+    """Yields the items of a parsed regex up to and including each repeat
+    that can match a '\\n', made greedy (inside a branch, the alternative
+    the repeat is in)."""
+    items = list(data)
+    for i, (op, av) in enumerate(items):
+        if op in (MAX_REPEAT, MIN_REPEAT):
+            if _newline(av[2], pattern, flags):
+                yield items[:i] + [(MAX_REPEAT, av)]
+        elif op == SUBPATTERN:
+            for inner in _prefixes(av[1], pattern, flags):
+                sub = sre_parse.SubPattern(pattern, inner)
+                yield items[:i] + [(SUBPATTERN, (av[0], sub))]
+        elif op == BRANCH:
+            for branch in av[1]:
+                for inner in _prefixes(branch, pattern, flags):
+                    sub = sre_parse.SubPattern(pattern, inner)
+                    yield items[:i] + [(SUBPATTERN, (None, sub))]
+
+def _newline(data, pattern, flags):
+    "Returns True if part of a parsed regex can match a '\\n'."
+    for op, av in data:
+        if op == LITERAL:
+            if av == 10:
+                return True
+        elif op == NOT_LITERAL:
+            if av != 10:
+                return True
+        elif op == ANY:
+            if flags & SRE_FLAG_DOTALL:
+                return True
+        elif op == IN:
+            sub = sre_parse.SubPattern(pattern, [(op, av)])
+            if sre_compile.compile(sub, flags).match('\n'):
+                return True
+        elif op == SUBPATTERN:
+            if _newline(av[1], pattern, flags):
+                return True
+        elif op == BRANCH:
+            if any(_newline(branch, pattern, flags) for branch in av[1]):
+                return True
+        elif op in (MAX_REPEAT, MIN_REPEAT):
+            if _newline(av[2], pattern, flags):
+                return True
+        elif op == GROUPREF:
+            return True
+    return False
+
+def _changestack(statestack, newstate):
+    "Applies a RegexLexer state transition to statestack."
+    if isinstance(newstate, tuple):
+        for state in newstate:
+            if state == '#pop':
+                if len(statestack) > 1:
+                    statestack.pop()
+            elif state == '#push':
+                statestack.append(statestack[-1])
+            else:
+                statestack.append(state)
+    elif isinstance(newstate, int):
+        # pop, but keep at least one state on the stack
+        if abs(newstate) >= len(statestack):
+            del statestack[1:]
+        else:
+            del statestack[newstate:]
+    elif newstate == '#push':
+        statestack.append(statestack[-1])
+    else:
+        assert False, "wrong state def: %r" % newstate
+
+def _brackets(tokens):
+    """Returns (net, low) for a line's tokens: the brackets in them take a
+    depth d to max(d + net, low) (a closing bracket with none open is
+    ignored)."""
+    net = low = 0
+    for ttype, value in tokens:
+        if ttype in Punctuation:
+            for ch in value:
+                if ch in _opening:
+                    net += 1
+                    low += 1
+                elif ch in _closing:
+                    net -= 1
+                    low = max(0, low - 1)
+    return net, low
+
+def _commonsuffix(a, b):
+    "Returns how many items at the end of a and b are equal."
+    count = 0
+    while count < min(len(a), len(b)) and a[-1 - count] == b[-1 - count]:
+        count += 1
+    return count
+
+def test():
+    """Makes random edits to this module's source, some of them typing a line
+    a key at a time, checking the tokens against lexing the whole text again;
+    then times typing a line."""
+    import random
+    import pygments.lexers
+    lexer = pygments.lexers.get_lexer_by_name('python')
+    source = open(__file__.replace('.pyc', '.py')).read().split('\n')
+    def check(inc, lines):
+        # the same as lexing the whole text, split into lines
+        whole = IncrementalLexer(lexer)
+        whole.incremental = False
+        whole.replace(0, 0, lines)
+        assert [inc.tokens(i) for i in range(len(inc))] == \
+               [whole.tokens(i) for i in range(len(whole))]
+        fresh = IncrementalLexer(lexer)
+        fresh.replace(0, 0, lines)
+        assert inc._states == fresh._states
+        assert inc._reaches == fresh._reaches
+    rand = random.Random(0)
+    inc = IncrementalLexer(lexer)
+    inc.replace(0, 0, source)
+    lines = list(source)
+    edits = ['"""', "'", '(', ')', '#', 'x = 1', '', 'def f(a,', '"""doc',
+             'def', 'import os', 'from x import (a,', '    ']
+    typed = ['    """doc', '    more"""', "s = '''x", 'def g(x):']
+    lexedbefore = inc.lexed
+    changes = 0
+    for n in range(200):
+        begin = rand.randrange(len(lines) + 1)
+        if n % 4 == 0:
+            # a new line typed a key at a time
+            lines.insert(begin, '')
+            inc.replace(begin, begin, [''])
+            for ch in rand.choice(typed):
+                lines[begin] += ch
+                inc.replace(begin, begin + 1, [lines[begin]])
+                changes += 1
+        else:
+            end = min(len(lines), begin + rand.choice([0, 0, 1, 1, 2]))
+            new = [rand.choice(edits) for i in range(rand.choice([0, 1, 1, 2]))]
+            lines[begin:end] = new
+            first, stop = inc.replace(begin, end, new)
+            assert first <= begin and stop >= begin + len(new)
+            changes += 1
+        if n % 20 == 0:
+            check(inc, lines)
+    check(inc, lines)
+    perchange = float(inc.lexed - lexedbefore) / changes
+    print '%d lines; %.1f lines lexed per random change' % (len(lines), perchange)
+
+    # a docstring typed a key at a time, closed on the line after
+    inc.replace(0, len(inc), ['def f():', 'x = 1'])
+    lines = ['def f():', '', '', 'x = 1']
+    inc.replace(1, 1, ['', ''])
+    for linenum, text in [(1, '    """doc'), (2, '    more"""')]:
+        for i in range(len(text)):
+            inc.replace(linenum, linenum + 1, [text[:i + 1]])
+        lines[linenum] = text
+    check(inc, lines)
+    assert inc.tokens(2)[-1][0] in Token.Literal.String.Doc
+    # deleting the last lines, from inside a string
+    inc.replace(0, len(inc), ['x = 1', 'y = """', 'z'])
+    inc.replace(1, 3, [])
+    check(inc, ['x = 1'])
+
+    inc.replace(0, len(inc), source)
+    lexedbefore = inc.lexed
+    line = ''
+    for ch in 'print f(x, "a string")':
+        line += ch
+        inc.replace(100, 101 if line != ch else 100, [line])
+    assert inc.lexed - lexedbefore == len(line)
+    assert inc.tokens(100)[-1][1] == ')'
+    inc.replace(0, len(inc), ['x = f(a, [b,', '  c]', ')', ')', '(', 'y'])
+    assert [inc.depth(i) for i in range(7)] == [0, 2, 1, 0, 0, 1, 1]
+
+if __name__ == '__main__':
+    test()
@@ -1,53 +1,210 @@
 import curses
+import time
 from curses.textpad import Textbox
-import textwrap
 
+import markup
+from framebuffer import FrameBuffer
+from heightindex import HeightIndex
+from scrollback import Scrollback
+from framescheduler import FrameScheduler
 from vipad import Panelastext
 #from cursesextras import log
 
 class TextPanel(object):
+    """Shows a list of markup.Text objects (self.texts) in a window, wrapped to
+    its width.
+    
+    Only the texts that are on screen are wrapped and drawn: the wrapped
+    height of every text is kept in a HeightIndex, so finding what is on
+    screen, and scrolling, take O(log n) time however long the history is.
+    
+    Texts can be appended to self.texts directly; if a text already in the
+    list is changed or replaced, call invalidate(index). self.texts is a
+    Scrollback, so old texts are compressed, and dropped when it is full.
+    
+    Output that arrives a piece at a time can be given to write(), which adds
+    it to the last text and draws it, at most maxfps times a second."""
+    # the most times per second that write() draws; output written in between
+    # waits for the next write() or flush()
+    maxfps = 30
+    
     def __init__(self, win):
         self.win = win
-        self.texts = []
+        self.texts = Scrollback()
+        self._dropped = 0 # self.texts.dropped, as of the last update
         self.firstline = 0
-        self.wrapper = textwrap.TextWrapper()
+        # if true, the panel stays scrolled to the end as texts are added
+        self.follow = True
+        self.wrapper = markup.LineWrapper()
+        self._heights = HeightIndex()
+        self._heightskey = None # the wrapper settings of self._heights
+        self._frame = FrameBuffer(win)
+        # if set (to a FrameScheduler), refresh() marks the window for the
+        # next frame instead of refreshing it straight away
+        self.scheduler = None
+        self.cellswritten = 0 # cells written by the last update
+        self._stream = None # the text write() is adding to
+        self._pending = [] # (str, attr) written, but not yet added
+        self._lastflush = 0
     
     def _updatewidth(self):
-        self.width, self.height = self.win.getmaxyx()
+        self.height, self.width = self.win.getmaxyx()
+        self.wrapper.width = self.width
+    
+    def _wrap(self, text):
+        text.wrapper = self.wrapper
+        return text.wrappedlines()
+    
+    def _updateheights(self):
+        """Brings self._heights up to date with self.texts and the width of
+        the window. Only new texts are wrapped, unless the width changed."""
+        dropped = getattr(self.texts, 'dropped', 0)
+        if dropped != self._dropped:
+            # texts were dropped from the front of the scrollback
+            count = dropped - self._dropped
+            if count < 0:
+                self._heights = HeightIndex()
+            else:
+                count = min(count, len(self._heights))
+                self.firstline = max(0,
+                        self.firstline - self._heights.offset(count))
+                self._heights.deleterange(0, count)
+            self._dropped = dropped
+        key = self.wrapper.key()
+        if key != self._heightskey or len(self._heights) > len(self.texts):
+            self._heights = HeightIndex()
+            self._heightskey = key
+        for text in self.texts[len(self._heights):]:
+            self._heights.append(len(self._wrap(text)))
+    
+    def invalidate(self, index):
+        "Tells the panel that self.texts[index] has been changed or replaced."
+        if index < len(self._heights):
+            self._heights[index] = len(self._wrap(self.texts[index]))
     
-    def _getlines(self):
+    def totallines(self):
+        "Returns the number of wrapped lines of all the texts."
         self._updatewidth()
+        self._updateheights()
+        return self._heights.total()
+    
+    def scrollto(self, line):
+        """Scrolls so that the given wrapped line is at the top, as far as
+        possible. Scrolling to the end (or past it) turns self.follow on;
+        scrolling anywhere else turns it off."""
+        lastfirst = max(0, self.totallines() - self.height)
+        self.firstline = max(0, min(line, lastfirst))
+        self.follow = self.firstline == lastfirst
+    
+    def scroll(self, lines):
+        "Scrolls down by the given number of lines (up, if negative)."
+        self.scrollto(self.firstline + lines)
+    
+    def pageup(self):
+        self._updatewidth()
+        self.scroll(-max(1, self.height - 1))
+    
+    def pagedown(self):
+        self._updatewidth()
+        self.scroll(max(1, self.height - 1))
+    
+    def scrolltoend(self):
+        self.scrollto(self.totallines())
+    
+    def _visiblelines(self):
+        """Returns the wrapped lines that are on screen, wrapping only the
+        texts they come from."""
+        if self.follow:
+            self.firstline = max(0, self._heights.total() - self.height)
+        index, skip = self._heights.find(self.firstline)
         lines = []
-        self.wrapper.width = self.width
-        for t in self.texts:
-            t.wrapper = self.wrapper
-            lines.extend(t.wrappedlines())
-        return lines
+        while len(lines) < skip + self.height and index < len(self.texts):
+            lines.extend(self._wrap(self.texts[index]))
+            index += 1
+        return lines[skip:skip + self.height]
+    
+    def visibletexts(self):
+        "Returns the indexes of the texts that are (at least partly) on screen."
+        self._updatewidth()
+        self._updateheights()
+        if self.follow:
+            self.firstline = max(0, self._heights.total() - self.height)
+        first, skip = self._heights.find(self.firstline)
+        last, skip = self._heights.find(self.firstline + self.height - 1)
+        return range(first, min(last + 1, len(self.texts)))
+    
+    def write(self, chunk, attr=None):
+        """Adds chunk (a str, shown with attr) to the end of the last text
+        written to, or to a new text if another text has been added since.
+        
+        The chunk is drawn straight away unless the panel was drawn less than
+        1/maxfps seconds ago; then it is kept, and drawn with whatever is
+        written after it. Call flush() once there is no more to write."""
+        self._pending.append((chunk, attr))
+        if not self.maxfps or time.time() - self._lastflush >= 1.0 / self.maxfps:
+            self.flush()
+    
+    def flush(self):
+        "Adds what has been written to the last text, and draws the panel."
+        self._lastflush = time.time()
+        if self._pending:
+            text = self._stream
+            if not self.texts or self.texts[-1] is not text:
+                text = self._stream = markup.Text([], self.wrapper)
+                self.texts.append(text)
+            # only the last line of the text is wrapped again
+            text.extend(self._pending)
+            self._pending = []
+            index = len(self.texts) - 1
+            # storing it again lets self.texts know how big it is now
+            self.texts[index] = text
+            self.invalidate(index)
+        self.refresh()
+    
+    def poll(self):
+        """Flushes, if output is waiting and it is time to draw it; call this
+        regularly while output may be written. Returns True if it flushed."""
+        if not self._pending:
+            return False
+        if self.maxfps and time.time() - self._lastflush < 1.0 / self.maxfps:
+            return False
+        self.flush()
+        return True
+    
+    def endstream(self):
+        "Flushes, and makes the next write() start a new text."
+        self.flush()
+        self._stream = None
     
     def update(self):
+        """Draws the visible lines. Only cells that differ from the last
+        update are written; self.cellswritten says how many were."""
         self._updatewidth()
-        lines = self._getlines()
-        start = self.firstline
-        end = self.firstline + self.height
-        self.win.move(0,0)
-        for l in lines[start:]:
-            for t, a in l:
-                if a is not None:
-                    self.win.addstr(t,a)
-                else:
-                    self.win.addstr(t)
-            try:
-                self.win.addstr('\n')
-            except:
-                break
+        self._updateheights()
+        self.cellswritten = self._frame.draw(self._visiblelines())
+    
+    def redraw(self):
+        """Redraws everything, for when something else has drawn in or cleared
+        the window."""
+        self._frame.reset()
+        self.refresh()
         
     def refresh(self):
         self.update()
-        self.win.refresh()
-        # call
+        if self.scheduler is not None:
+            self.scheduler.mark(self.win)
+        else:
+            self.win.refresh()
 
 class InterpWidget(object):
+    """The windows of the interpreter: completions at the top (topwin,
+    toppad), the history in the middle (midwin, midpad) and the code being
+    edited at the bottom (botwin, textbox).
+    
+    The panels' refresh() only marks their windows in self.scheduler; call
+    frame() to draw them (and mark() anything else drawn on)."""
     def __init__(self, win, topsize=4, botsize=4):
+        self.scheduler = FrameScheduler()
         self.mainwin = win
         self.maxy, self.maxx = win.getmaxyx()
         self.topwin = curses.newwin(topsize, self.maxx, 0, 0)
@@ -70,3 +227,21 @@ class InterpWidget(object):
         self.mainwin.hline(locy -1,0,curses.ACS_HLINE, self.maxx)
         self.botwin = curses.newwin(height, width,locy,locx)
         self.textbox = Textbox(self.botwin)
+        
+        self.toppad.scheduler = self.scheduler
+        self.midpad.scheduler = self.scheduler
+        self.scheduler.cursorwin = self.botwin
+        # the main window is underneath the others, so it goes first
+        self.scheduler.mark(self.mainwin)
+    
+    def mark(self, *wins):
+        "Marks windows as needing to be drawn in the next frame."
+        for win in wins:
+            self.scheduler.mark(win)
+    
+    def frame(self, force=False):
+        """Draws the marked windows, if it is time for a frame (or anyway, if
+        force is true). Returns True if a frame was drawn."""
+        if force:
+            return self.scheduler.flush()
+        return self.scheduler.frame()
@@ -0,0 +1,551 @@
+"""Runs code in a separate process (the kernel), so that code that runs away,
+or keeps a processor busy, cannot take the interface down with it.
+
+KernelClient starts the kernel, and talks to it over a Unix socket. Every
+message is a frame: its length (4 bytes, network order) and then a dict,
+serialized with marshal, whose 'type' is one of
+
+to the kernel:
+    execute (id, code): run a cell
+    input_reply (value): the answer to an input_request
+    interrupt: raise KeyboardInterrupt in the running cell
+    shutdown: finish the cells already sent, then exit
+from the kernel:
+    started (id): a cell has started running
+    stream (id, chunks, writes): output, as a list of (name, text), where
+        name is 'stdout' or 'stderr'; writes is how many write() calls it
+        holds
+    input_request (id, prompt): the cell called raw_input (or input)
+    done (id, error, interrupted, walltime, cputime): a cell has finished
+
+Output is not sent for every write(): the kernel collects it, and sends
+whatever has been written every 'interval' seconds, or as soon as 'maxbatch'
+bytes are waiting, so a loop that prints a lot crosses to the interface in a
+few large messages. If the interface falls behind, the cell is made to wait
+when it writes, instead of the output piling up.
+
+KernelClient has the same interface as executor.Executor (submit, interrupt,
+fileno, handleevents and the onstart, onoutput and ondone callbacks), plus
+oninput(cell, prompt), which should lead to a call to reply(value).
+
+If the kernel dies (os._exit, a crash, or being killed), the cells it had not
+finished are finished with an error, and onexit(returncode) is called, which
+should stop reading fileno(); start() then starts a new kernel, with a new
+namespace and a new fileno(). Until it does, submitted cells fail at once."""
+
+import os
+import sys
+import time
+import errno
+import signal
+import socket
+import struct
+import marshal
+import threading
+import subprocess
+import fcntl
+import __builtin__
+import Queue
+
+from executor import Cell, runcode, formatexception, cputime
+
+_header = struct.Struct('!I')
+
+def _frame(msg):
+    "Returns the bytes of the frame holding msg."
+    data = marshal.dumps(msg)
+    return _header.pack(len(data)) + data
+
+class _FrameReader(object):
+    "Splits the bytes read from a socket into messages."
+    def __init__(self):
+        self._buffer = ''
+
+    def feed(self, data):
+        "Adds data, returning the list of messages it completes."
+        buf = self._buffer + data
+        msgs = []
+        loc = 0
+        while len(buf) - loc >= _header.size:
+            length, = _header.unpack_from(buf, loc)
+            end = loc + _header.size + length
+            if len(buf) < end:
+                break
+            msgs.append(marshal.loads(buf[loc + _header.size:end]))
+            loc = end
+        self._buffer = buf[loc:]
+        return msgs
+
+class _KernelStream(object):
+    "Stands in for sys.stdout or sys.stderr in the kernel."
+    softspace = 0
+
+    def __init__(self, kernel, name):
+        self.kernel = kernel
+        self.name = name
+
+    def write(self, txt):
+        self.kernel._write(self.name, txt)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+class Kernel(object):
+    """The kernel's side: runs the cells sent to it on the main thread (so
+    that SIGINT interrupts them), while one thread reads messages and another
+    sends them."""
+    # how often waiting output is sent, in seconds
+    interval = 1.0 / 60
+    # how many bytes of output are worth sending straight away
+    maxbatch = 64 * 1024
+    # how many bytes of output a cell can get ahead of the interface
+    maxbuffered = 16 * maxbatch
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.namespace = {'__name__': '__main__'}
+        self._cells = Queue.Queue() # execute messages, or None to stop
+        self._inputs = Queue.Queue() # input_reply values
+        self._cond = threading.Condition() # guards everything below
+        self._chunks = [] # [name, text] of output not yet sent
+        self._writes = 0 # write() calls in self._chunks
+        self._buffered = 0 # bytes in self._chunks
+        self._messages = [] # other messages to send, after the output
+        self._current = None # the id of the cell that is running
+        self._executing = False # if true, SIGINT interrupts the cell
+
+    def run(self):
+        signal.signal(signal.SIGINT, self._sigint)
+        sys.stdout = _KernelStream(self, 'stdout')
+        sys.stderr = _KernelStream(self, 'stderr')
+        __builtin__.raw_input = self._rawinput
+        __builtin__.input = lambda prompt='': eval(self._rawinput(prompt),
+                                                   self.namespace)
+        for target in (self._readloop, self._sendloop):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+        while True:
+            try:
+                msg = self._cells.get()
+                if msg is None:
+                    break
+                self._execute(msg)
+            except KeyboardInterrupt:
+                # an interrupt that arrived just as a cell finished
+                pass
+        self._send(None)
+
+    def _sigint(self, signum, frame):
+        if self._executing:
+            raise KeyboardInterrupt
+
+    def _execute(self, msg):
+        self._current = msg['id']
+        self._send({'type': 'started', 'id': msg['id']})
+        error = interrupted = False
+        wallstart = time.time()
+        cpustart = cputime()
+        try:
+            try:
+                self._executing = True
+                runcode(msg['code'], '<cell %d>' % msg['id'], self.namespace)
+            finally:
+                self._executing = False
+        except BaseException as e:
+            error = True
+            interrupted = isinstance(e, KeyboardInterrupt)
+            self._write('stderr', formatexception(*sys.exc_info(),
+                    hidden=[Kernel._sigint.__func__.__code__]))
+        self._send({'type': 'done', 'id': msg['id'], 'error': error,
+                    'interrupted': interrupted,
+                    'walltime': time.time() - wallstart,
+                    'cputime': cputime() - cpustart})
+        self._current = None
+
+    def _rawinput(self, prompt=''):
+        self._send({'type': 'input_request', 'id': self._current,
+                    'prompt': str(prompt)})
+        while True:
+            # waiting with a timeout lets SIGINT through
+            try:
+                value = self._inputs.get(timeout=0.1)
+                break
+            except Queue.Empty:
+                pass
+        if value is None:
+            raise EOFError
+        return value
+
+    def _write(self, name, txt):
+        "Collects output, waiting if too much is collected already."
+        if not txt:
+            return
+        with self._cond:
+            while self._buffered >= self.maxbuffered:
+                self._cond.wait(0.1)
+            chunks = self._chunks
+            if chunks and chunks[-1][0] == name:
+                chunks[-1][1] += txt
+            else:
+                chunks.append([name, txt])
+            self._writes += 1
+            self._buffered += len(txt)
+            if self._buffered >= self.maxbatch:
+                self._cond.notify_all()
+
+    def _takeoutput(self):
+        "Returns a stream message with the output collected (with self._cond)."
+        if not self._chunks:
+            return None
+        msg = {'type': 'stream', 'id': self._current,
+               'chunks': [tuple(chunk) for chunk in self._chunks],
+               'writes': self._writes}
+        self._chunks = []
+        self._writes = 0
+        self._buffered = 0
+        self._cond.notify_all()
+        return msg
+
+    def _send(self, msg):
+        "Sends msg after the output so far; None stops the sending thread."
+        with self._cond:
+            output = self._takeoutput()
+            if output is not None:
+                self._messages.append(output)
+            self._messages.append(msg)
+            self._cond.notify_all()
+
+    def _sendloop(self):
+        while True:
+            with self._cond:
+                if not self._messages and self._buffered < self.maxbatch:
+                    self._cond.wait(self.interval)
+                msgs = self._messages
+                self._messages = []
+                output = self._takeoutput()
+            if output is not None:
+                msgs.append(output)
+            stop = None in msgs
+            # all of them in one go, so they arrive together
+            self.sock.sendall(''.join(_frame(msg) for msg in msgs
+                                      if msg is not None))
+            if stop:
+                return
+
+    def _readloop(self):
+        reader = _FrameReader()
+        while True:
+            data = self.sock.recv(65536)
+            if not data:
+                # the interface has gone
+                msgs = [{'type': 'shutdown'}]
+            else:
+                msgs = reader.feed(data)
+            for msg in msgs:
+                kind = msg['type']
+                if kind == 'execute':
+                    self._cells.put(msg)
+                elif kind == 'input_reply':
+                    self._inputs.put(msg['value'])
+                elif kind == 'interrupt':
+                    if self._executing:
+                        os.kill(os.getpid(), signal.SIGINT)
+                elif kind == 'shutdown':
+                    self._cells.put(None)
+                    self._inputs.put(None)
+                    if self._executing:
+                        os.kill(os.getpid(), signal.SIGINT)
+                    return
+
+class KernelClient(object):
+    "The interface's side: starts a kernel, and sends it cells to run."
+    def __init__(self):
+        self.onstart = None # onstart(cell)
+        self.onoutput = None # onoutput(cell, name, txt)
+        self.ondone = None # ondone(cell)
+        self.oninput = None # oninput(cell, prompt); then call reply()
+        self.onexit = None # onexit(returncode), when the kernel has died
+        self._cells = {} # id -> Cell, until done
+        self._cellcount = 0
+        self.messages = 0 # messages received
+        self.streammessages = 0
+        self.writes = 0 # write() calls in the kernel, over all stream messages
+        self.bytesread = 0
+        self.sock = None
+        self.process = None
+        self.alive = False
+        self.start()
+
+    def start(self):
+        """Starts the kernel; after it has died, starts a new one, which
+        fileno() is then the file descriptor of."""
+        if self.sock is not None:
+            self.sock.close()
+        self._reader = _FrameReader()
+        self.sock, kernelsock = socket.socketpair()
+        path = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        devnull = open(os.devnull, 'r+')
+        # its own session, so that Ctrl-C in the terminal does not reach it,
+        # and no access to the terminal at all
+        self.process = subprocess.Popen(
+                [sys.executable, path, str(kernelsock.fileno())],
+                stdin=devnull, stdout=devnull, stderr=devnull,
+                preexec_fn=os.setsid)
+        devnull.close()
+        kernelsock.close()
+        self.sock.setblocking(0)
+        self.alive = True
+
+    def fileno(self):
+        "A file descriptor that can be read from when there are events."
+        return self.sock.fileno()
+
+    def _sendmsg(self, msg):
+        """Sends msg, returning False if it could not be sent (the kernel has
+        died: handleevents() will find out, since the socket is at its end)."""
+        self.sock.setblocking(1)
+        try:
+            self.sock.sendall(_frame(msg))
+            return True
+        except socket.error:
+            return False
+        finally:
+            self.sock.setblocking(0)
+
+    def submit(self, code):
+        """Sends code to be run, returning its Cell. If the kernel is not
+        running, the cell is finished (with ondone) straight away, with an
+        error."""
+        self._cellcount += 1
+        cell = Cell(self._cellcount, code)
+        if not self.alive:
+            self._fail(cell, 'The kernel is not running.\n')
+            return cell
+        self._cells[cell.number] = cell
+        self._sendmsg({'type': 'execute', 'id': cell.number, 'code': code})
+        return cell
+
+    def busy(self):
+        "Returns True if a cell is running or waiting to run."
+        return bool(self._cells)
+
+    def interrupt(self):
+        """Interrupts the running cell. Returns False if no cell was running
+        (as far as the interface knows)."""
+        if not any(cell.started for cell in self._cells.values()):
+            return False
+        self._sendmsg({'type': 'interrupt'})
+        return True
+
+    def reply(self, value):
+        "Answers an input request."
+        self._sendmsg({'type': 'input_reply', 'value': value})
+
+    def close(self, timeout=1.0):
+        """Asks the kernel to stop, and kills it if it has not within
+        timeout seconds."""
+        self.alive = False
+        self._sendmsg({'type': 'shutdown'})
+        end = time.time() + timeout
+        while self.process.poll() is None and time.time() < end:
+            time.sleep(0.01)
+        if self.process.poll() is None:
+            os.kill(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+        self.sock.close()
+
+    def handleevents(self):
+        """Reads what the kernel has sent, calling onstart, onoutput, oninput
+        and ondone for it; and, if the kernel has died, ondone for the cells
+        it had not finished, and onexit."""
+        if not self.alive:
+            return
+        msgs = []
+        ended = False
+        while True:
+            try:
+                data = self.sock.recv(256 * 1024)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                ended = True
+                break
+            if not data:
+                ended = True
+                break
+            self.bytesread += len(data)
+            msgs.extend(self._reader.feed(data))
+        for msg in msgs:
+            self._handle(msg)
+        if ended or self.process.poll() is not None:
+            self._died()
+
+    def checkalive(self):
+        """Finds out if the kernel has died without the socket showing it
+        (which happens when a process it started still has the socket open).
+        Returns True if it is running."""
+        if self.alive and self.process.poll() is not None:
+            self.handleevents()
+        return self.alive
+
+    def _died(self):
+        "Finishes the cells the kernel had not, and calls onexit."
+        self.alive = False
+        if self.process.poll() is None:
+            # the socket closed under a kernel that is still running
+            os.kill(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+        returncode = self.process.returncode
+        if returncode < 0:
+            reason = 'killed by signal %d' % -returncode
+        else:
+            reason = 'exit code %d' % returncode
+        for number in sorted(self._cells):
+            self._fail(self._cells.pop(number),
+                       'The kernel died (%s).\n' % reason)
+        if self.onexit:
+            self.onexit(returncode)
+
+    def _fail(self, cell, message):
+        """Finishes a cell that the kernel did not, with an error; it has no
+        walltime or cputime. onstart is called for it first if it was not
+        yet, so that all cells are seen to start, and then finish."""
+        if not cell.started and self.onstart:
+            self.onstart(cell)
+        if self.onoutput:
+            self.onoutput(cell, 'stderr', message)
+        cell.finished = True
+        cell.error = True
+        if self.ondone:
+            self.ondone(cell)
+
+    def _handle(self, msg):
+        self.messages += 1
+        kind = msg['type']
+        cell = self._cells.get(msg['id'])
+        if cell is None:
+            return
+        if kind == 'started':
+            cell.started = True
+            if self.onstart:
+                self.onstart(cell)
+        elif kind == 'stream':
+            self.streammessages += 1
+            self.writes += msg['writes']
+            if self.onoutput:
+                for name, txt in msg['chunks']:
+                    self.onoutput(cell, name, txt)
+        elif kind == 'input_request':
+            if self.oninput:
+                self.oninput(cell, msg['prompt'])
+            else:
+                self.reply(None)
+        elif kind == 'done':
+            del self._cells[cell.number]
+            cell.finished = True
+            cell.error = msg['error']
+            cell.interrupted = msg['interrupted']
+            cell.walltime = msg['walltime']
+            cell.cputime = msg['cputime']
+            if self.ondone:
+                self.ondone(cell)
+
+def main(fd):
+    "Runs a kernel, talking over the socket with file descriptor fd."
+    sock = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close(fd)
+    # processes started by cells do not get the socket, so it ends when the
+    # kernel does
+    flags = fcntl.fcntl(sock.fileno(), fcntl.F_GETFD)
+    fcntl.fcntl(sock.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    Kernel(sock).run()
+
+def test():
+    """Runs a few cells in a kernel, including one that prints a lot, one
+    that asks for input, and one that has to be interrupted; then kills the
+    kernel while a cell runs, and starts another."""
+    import select
+    client = KernelClient()
+    output = []
+    finished = []
+    client.onoutput = lambda cell, name, txt: output.append((cell.number, name, txt))
+    client.oninput = lambda cell, prompt: client.reply(prompt.upper())
+    client.ondone = finished.append
+    client.submit('x = 6\nprint "x is", x')
+    client.submit('for i in range(100000): print i')
+    client.submit('print raw_input("name? ")')
+    loop = client.submit('while True: x += 1')
+    client.submit('x > 6')
+    client.submit('1/0')
+    start = time.time()
+    while len(finished) < 6 and time.time() - start < 10:
+        select.select([client], [], [], 0.05)
+        client.handleevents()
+        if loop.started and not loop.finished and time.time() - start > 0.5:
+            client.interrupt()
+    client.close()
+
+    for cell in finished:
+        print cell, 'wall %.3fs, CPU %.3fs' % (cell.walltime, cell.cputime),
+        print 'error' if cell.error else ''
+    print '%d writes in %d stream messages' % (client.writes,
+                                                client.streammessages)
+    text = lambda number: ''.join(txt for n, name, txt in output
+                                  if n == number)
+    assert [cell.number for cell in finished] == [1, 2, 3, 4, 5, 6]
+    assert text(1) == 'x is 6\n'
+    assert text(2) == ''.join('%d\n' % i for i in range(100000))
+    assert text(3) == 'NAME? \n'
+    assert finished[3].interrupted and 'KeyboardInterrupt' in text(4)
+    assert text(5) == 'True\n'
+    assert finished[5].error and 'ZeroDivisionError' in text(6)
+    assert client.streammessages < client.writes / 100
+    assert client.process.poll() is not None
+
+    client = KernelClient()
+    output = []
+    finished = []
+    exits = []
+    client.onoutput = lambda cell, name, txt: output.append((cell.number, txt))
+    client.ondone = finished.append
+    client.onexit = exits.append
+    busy = client.submit('while True: pass')
+    queued = client.submit('print "never"')
+    start = time.time()
+    while not busy.started and time.time() - start < 10:
+        select.select([client], [], [], 0.05)
+        client.handleevents()
+    os.kill(client.process.pid, signal.SIGKILL)
+    # the socket ends when the kernel does
+    ready, w, x = select.select([client], [], [], 10)
+    assert ready
+    client.handleevents()
+    assert finished == [busy, queued] and busy.error and queued.error
+    assert exits == [-signal.SIGKILL] and not client.busy()
+    assert 'killed by signal' in output[0][1]
+    # a dead kernel refuses cells, without raising
+    refused = client.submit('x = 1')
+    assert refused.finished and refused.error and finished[-1] is refused
+    client.interrupt()
+    client.reply('ignored')
+    client.start()
+    client.submit('print "again"')
+    while len(finished) < 4 and time.time() - start < 10:
+        select.select([client], [], [], 0.05)
+        client.handleevents()
+    client.close()
+    assert not finished[-1].error and output[-1] == (4, 'again\n')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        test()
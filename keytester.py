@@ -1,4 +1,5 @@
 import curses, vipad
+from eventloop import EventLoop
 
 with vipad.safescreen() as scr:
     keys = dict()
@@ -9,11 +10,14 @@ with vipad.safescreen() as scr:
     
     scr.scrollok(1)
     p = vipad.Panelastext(scr)
-    ch = 0
-    while ch != ord('q'):
-        ch = scr.getch()
+    loop = EventLoop(scr)
+    def showkey(ch):
         given = curses.keyname(ch)
         if ch in keys:
             p.append('{0:03d} :: {1}, {2}'.format(ch, given, keys[ch]))
         else:
-            p.append('{0:03d} :: {1}'.format(ch, given))
\ No newline at end of file
+            p.append('{0:03d} :: {1}'.format(ch, given))
+        if ch == ord('q'):
+            loop.stop()
+    loop.pushhandler(showkey)
+    loop.run()
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""Finds the differences between two sequences of lines, for redrawing a window
+with as few changed lines as possible.
+
+hunks(a, b) uses Myers' O(ND) algorithm ("An O(ND) Difference Algorithm and
+Its Variations", 1986), which finds a shortest edit script: the fewest lines
+to delete from a and insert from b to turn a into b. It uses the linear space
+version, so memory only grows with the number of lines, and gives up on
+finding the shortest script once it would be longer than maxedits. Lines are
+only compared with ==, so they need not be hashable."""
+
+def _middlesnake(a, alo, ahi, b, blo, bhi, maxedits):
+    """Finds the middle snake of a shortest edit script from a[alo:ahi] to
+    b[blo:bhi]: the diagonal run of equal lines it goes through half way.
+
+    Returns (x, y, u, v, edits), the snake going from a[alo + x], b[blo + y]
+    to a[alo + u], b[blo + v], and the length of the edit script; or None if
+    that is more than maxedits."""
+    n, m = ahi - alo, bhi - blo
+    delta = n - m
+    odd = delta % 2
+    # forward[k] is the furthest x reached from the start on diagonal k
+    # (where k = x - y); backward[k] is the same from the end, going back,
+    # with k = (n - x) - (m - y)
+    forward = {1: 0}
+    backward = {1: 0}
+    for d in range((n + m + 1) // 2 + 1):
+        if 2 * d - 1 > maxedits:
+            return None
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[k - 1] < forward[k + 1]):
+                x = forward[k + 1] # down: insert b[y]
+            else:
+                x = forward[k - 1] + 1 # right: delete a[x]
+            y = x - k
+            startx, starty = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[k] = x
+            if (odd and -(d - 1) <= delta - k <= d - 1
+                    and x + backward[delta - k] >= n):
+                return startx, starty, x, y, 2 * d - 1
+        if 2 * d > maxedits:
+            return None
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[k - 1] < backward[k + 1]):
+                x = backward[k + 1]
+            else:
+                x = backward[k - 1] + 1
+            y = x - k
+            startx, starty = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[k] = x
+            if (not odd and -d <= delta - k <= d
+                    and x + forward[delta - k] >= n):
+                return n - x, m - y, n - startx, m - starty, 2 * d
+
+def _matches(a, alo, ahi, b, blo, bhi, maxedits, matches):
+    """Appends to matches the (i, j) pairs with a[i] == b[j] that are kept by
+    a shortest edit script from a[alo:ahi] to b[blo:bhi], in order. Keeps
+    none if the script would be longer than maxedits.
+
+    This is the linear space version of the algorithm: rather than keeping
+    the furthest points reached after every number of edits, to walk back
+    through, it finds the middle snake and works on each side of it."""
+    if alo == ahi or blo == bhi:
+        return
+    snake = _middlesnake(a, alo, ahi, b, blo, bhi, maxedits)
+    if snake is None:
+        return
+    x, y, u, v, edits = snake
+    if edits > 1:
+        _matches(a, alo, alo + x, b, blo, blo + y, maxedits, matches)
+        matches.extend((alo + x + i, blo + y + i) for i in range(u - x))
+        _matches(a, alo + u, ahi, b, blo + v, bhi, maxedits, matches)
+        return
+    # with one edit or none, the shorter is the longer with a line left out:
+    # the lines match up to the first that does not, and then from the next
+    i, j = alo, blo
+    while i < ahi and j < bhi and a[i] == b[j]:
+        matches.append((i, j))
+        i += 1
+        j += 1
+    if ahi - alo > bhi - blo:
+        i += 1
+    elif bhi - blo > ahi - alo:
+        j += 1
+    matches.extend((i + k, j + k) for k in range(ahi - i))
+
+def hunks(a, b, maxedits=400):
+    """Returns the changes from a to b, as a list of (i1, i2, j1, j2), each
+    meaning that a[i1:i2] should be replaced with b[j1:j2], in order.
+
+    Every line not in a hunk is kept, and the total number of lines deleted
+    and inserted is as small as possible, as long as that is at most
+    maxedits. Past that, finding which lines to keep would take too long
+    (the time grows with the square of the number of edits), and everything
+    but the lines common to the start and end is one hunk."""
+    # lines that are the same at the start and end are common, and cheap
+    # to skip before running the diff
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < len(a) - prefix and suffix < len(b) - prefix
+            and a[-suffix - 1] == b[-suffix - 1]):
+        suffix += 1
+    aend, bend = len(a) - suffix, len(b) - suffix
+    if prefix == aend and prefix == bend:
+        return []
+    if prefix == aend or prefix == bend:
+        # only insertions, or only deletions
+        return [(prefix, aend, prefix, bend)]
+
+    result = []
+    i, j = prefix, prefix
+    matches = []
+    _matches(a, prefix, aend, b, prefix, bend, maxedits, matches)
+    for mi, mj in matches + [(aend, bend)]:
+        if mi > i or mj > j:
+            result.append((i, mi, j, mj))
+        i, j = mi + 1, mj + 1
+    return result
+
+def test():
+    """Diffs random sequences, checking that the hunks turn a into b and
+    change as few lines as a longest common subsequence allows."""
+    import random
+    rand = random.Random(0)
+    for trial in range(500):
+        a = [rand.choice('abc') for i in range(rand.randrange(12))]
+        b = [rand.choice('abc') for i in range(rand.randrange(12))]
+        if trial % 2:
+            # lists, which cannot be hashed
+            a = [[x] for x in a]
+            b = [[x] for x in b]
+        result = hunks(a, b)
+        patched = list(a)
+        for i1, i2, j1, j2 in reversed(result):
+            patched[i1:i2] = b[j1:j2]
+        assert patched == b, (a, b, result)
+        # the length of a longest common subsequence, the slow way
+        lcs = [[0] * (len(b) + 1) for i in range(len(a) + 1)]
+        for i in range(len(a)):
+            for j in range(len(b)):
+                if a[i] == b[j]:
+                    lcs[i + 1][j + 1] = lcs[i][j] + 1
+                else:
+                    lcs[i + 1][j + 1] = max(lcs[i][j + 1], lcs[i + 1][j])
+        changed = sum((i2 - i1) + (j2 - j1) for i1, i2, j1, j2 in result)
+        assert changed == len(a) + len(b) - 2 * lcs[-1][-1], (a, b, result)
+        # in order, and not touching
+        for (i1, i2, j1, j2), (k1, k2, l1, l2) in zip(result, result[1:]):
+            assert i2 < k1 and j2 < l1
+    assert hunks(['x', 'y'], ['x', 'y']) == []
+    assert hunks([], ['x']) == [(0, 0, 0, 1)]
+    # too many edits: one hunk, between the common start and end
+    a = ['a%d' % i for i in range(3000)]
+    b = ['b%d' % i for i in range(3000)]
+    assert hunks(a, b) == [(0, 3000, 0, 3000)]
+    assert hunks(['x'] + a + ['y'], ['x'] + b + ['y']) == [(1, 3001, 1, 3001)]
+    assert hunks(a, []) == [(0, 3000, 0, 0)]
+    b = list(a)
+    b[10:20] = ['changed']
+    assert hunks(a, b, maxedits=0) == [(10, 20, 10, 11)]
+    b[2000] = 'changed'
+    assert hunks(a, b, maxedits=12) == [(10, 2010, 10, 2001)]
+    assert hunks(a, b) == [(10, 20, 10, 11), (2009, 2010, 2000, 2001)]
+
+if __name__ == '__main__':
+    test()
@@ -8,12 +8,11 @@ The most useful thing here is the Text object. It can be instantiated with a
 plain string, with a '(str, attr) pair, or a list of (str, attr) pairs.
 """
 
+import re, sys
+from array import array
+from collections import OrderedDict
 from textwrap import TextWrapper
 
-# The default TextWrapper object; used as a default by Text objects if no other
-# is given
-wrapper = TextWrapper()
-
 def fullmarkup(obj):
     """Accepts strings, (string, attr) tuples, or lists of tuples and yields
     (string, attr) pairs. Allows users to give varied forms of markup, and
@@ -34,55 +33,328 @@ def decompose(markup):
         txt is a string
         attrs is a list of (attr, len) pairs, where (len) is the number
         of characters to which the attr is to be applied."""
-        loc = 0
-        fulltxt = ''
+        txts = []
         attrs = []
         for txt, attr in markup:
-            fulltxt += txt
+            txts.append(txt)
             attrs.append((attr, len(txt)))
         
-        return fulltxt, attrs
+        return ''.join(txts), attrs
 
 def recompose(text, attrlist):
     """Recomposes text, attrlist objects into a parsed markup format."""
     markup = []
+    loc = 0
     for (attr, length) in attrlist:
-        curtext, text = text[:length], text[length:]
-        markup.append((curtext, attr))
+        markup.append((text[loc:loc+length], attr))
+        loc += length
     return markup
 
+# Attributes are stored in Text objects as small integer ids, to keep them
+# compact; these map between the two. Unhashable attributes (lists, ...) are
+# found by equality instead.
+_attrids = {}
+_attrlist = []
+_unhashableids = []
+
+def internattr(attr):
+    "Returns the id used to store attr in a Text object."
+    try:
+        return _attrids[attr]
+    except KeyError:
+        pass
+    except TypeError:
+        for attrid in _unhashableids:
+            if _attrlist[attrid] == attr:
+                return attrid
+        _unhashableids.append(len(_attrlist))
+        _attrlist.append(attr)
+        return len(_attrlist) - 1
+    
+    attrid = _attrids[attr] = len(_attrlist)
+    _attrlist.append(attr)
+    return attrid
+
+def attrfromid(attrid):
+    "Returns the attribute stored as attrid; see internattr."
+    return _attrlist[attrid]
+
+# How TextWrapper splits text into words; LineWrapper uses the same rules, so
+# that it breaks lines in the same places.
+_wordsep = re.compile(TextWrapper.wordsep_re.pattern)
+_wordsep_uni = re.compile(TextWrapper.wordsep_re.pattern, re.U)
+
+class LineWrapper(object):
+    """Wraps lines of markup, keeping the attributes with their characters.
+    
+    Unlike textwrap.TextWrapper, this works on (str, attr) runs directly, in a
+    single pass, and never changes the text other than to break it up (and to
+    expand tabs, if asked to).
+    
+    width: the number of characters per line
+    wordwrap: if true, lines are broken between words, where possible, the
+        way TextWrapper breaks them (with whitespace kept, as with
+        drop_whitespace = False). If false, lines are broken every width
+        characters, which is cheaper and suits code.
+    tabsize: if not None, tabs are expanded to spaces, with tab stops every
+        tabsize columns."""
+    def __init__(self, width = 70, wordwrap = True, tabsize = None):
+        self.width = width
+        self.wordwrap = wordwrap
+        self.tabsize = tabsize
+    
+    @classmethod
+    def fromwrapper(cls, wrapper):
+        """Returns a LineWrapper for a TextWrapper (or LineWrapper), taking
+        only its width."""
+        if isinstance(wrapper, LineWrapper):
+            return wrapper
+        return cls(wrapper.width)
+    
+    def key(self):
+        "Returns a tuple of the settings that affect how text is wrapped."
+        return (self.width, self.wordwrap, self.tabsize)
+    
+    def _expandtabs(self, line):
+        "Returns the line (a list of (str, attr)) with tabs expanded."
+        tabsize = self.tabsize
+        newline = []
+        col = 0
+        for txt, attr in line:
+            if '\t' in txt:
+                pieces = []
+                for piece in txt.split('\t')[:-1]:
+                    col += len(piece)
+                    spaces = tabsize - (col % tabsize)
+                    pieces.append(piece + ' ' * spaces)
+                    col += spaces
+                pieces.append(txt[txt.rfind('\t')+1:])
+                txt = ''.join(pieces)
+                col += len(pieces[-1])
+            else:
+                col += len(txt)
+            newline.append((txt, attr))
+        return newline
+    
+    def _breaks(self, text):
+        """Returns the positions in text at which wrapped lines should end,
+        the last being len(text)."""
+        width = max(self.width, 1)
+        length = len(text)
+        if not self.wordwrap:
+            return list(range(width, length, width)) + [length]
+        
+        if isinstance(text, unicode):
+            wordsep = _wordsep_uni
+        else:
+            wordsep = _wordsep
+        # chunk lengths, in reverse order, as TextWrapper._wrap_chunks uses
+        chunks = [len(c) for c in wordsep.split(text) if c]
+        chunks.reverse()
+        
+        breaks = []
+        loc = 0
+        while chunks:
+            curlen = 0
+            while chunks and curlen + chunks[-1] <= width:
+                curlen += chunks.pop()
+            if chunks and chunks[-1] > width:
+                # the chunk won't fit on any line: break it up
+                spaceleft = width - curlen
+                curlen += spaceleft
+                chunks[-1] -= spaceleft
+            if curlen:
+                loc += curlen
+                breaks.append(loc)
+        return breaks
+    
+    def wrapline(self, line):
+        """Wraps a single line of markup (a list of (str, attr) pairs with no
+        newlines), returning a list of lines in the same format.
+        
+        Empty runs are dropped; an empty line gives [[]]."""
+        if self.tabsize:
+            line = self._expandtabs(line)
+        text = ''.join(txt for txt, attr in line)
+        if not text:
+            return [[]]
+        
+        wrapped = []
+        curline = []
+        runs = iter(line)
+        txt, attr = '', None
+        loc = 0 # position in text
+        runend = 0 # position in text of the end of txt
+        for end in self._breaks(text):
+            while loc < end:
+                if loc == runend:
+                    txt, attr = next(runs)
+                    runend += len(txt)
+                    continue
+                # the part of the run from loc up to end
+                runstart = runend - len(txt)
+                pieceend = min(end, runend)
+                curline.append((txt[loc-runstart:pieceend-runstart], attr))
+                loc = pieceend
+            wrapped.append(curline)
+            curline = []
+        return wrapped
+
+# The default wrapper; used as a default by Text objects if no other is given.
+# TextWrapper instances can also be given, but only their width is used.
+wrapper = LineWrapper()
+
+def _cachedwrap(cache, cachesize, linewrapper, aslines):
+    """Returns the lines of aslines() wrapped with linewrapper, using and
+    filling cache, an OrderedDict of LineWrapper.key() -> wrapped lines that
+    holds at most cachesize entries (least recently used are dropped)."""
+    key = linewrapper.key()
+    wrapped = cache.pop(key, None)
+    if wrapped is None:
+        wrapped = []
+        for line in aslines():
+            wrapped.extend(linewrapper.wrapline(line))
+        while cache and len(cache) >= cachesize:
+            cache.popitem(last=False)
+    cache[key] = wrapped
+    return wrapped
+
+def _splitlines(runs):
+    """Splits (str, attr) runs into a list of lines, each a list of
+    (str, attr) pairs without newlines. The last line is empty if the runs end
+    with a newline."""
+    lines = []
+    curline = []
+    
+    for txt, attr in runs:
+        if '\n' in txt:
+            splittxt = txt.split('\n')
+            
+            txt = splittxt.pop(-1)
+            # now txt is a line beginning, and splittxt is a list of
+            # line endings
+            
+            for lineend in splittxt:
+                if len(lineend) > 0:
+                    curline.append((lineend, attr))
+                lines.append(curline)
+                curline = []
+        
+        if len(txt) > 0:
+            curline.append((txt, attr))
+    
+    lines.append(curline)
+    return lines
+
 class Text(object):
     """Provides an object for interacting with markup.
     
     Text.aslines() returns a list of [line, line, line...] where each line is
     markup; str(Text) returns it as plain text, without attributes; and
     Text.wrappedlines() uses the TextWrapper instance to wrap the text, while
-    maintaining the attributes in the correct place."""
+    maintaining the attributes in the correct place.
+    
+    Internally, the text is kept as one string, with arrays of the length and
+    (interned) attribute of each run, instead of a list of tuples. What extend
+    adds is kept in a list, and only joined onto the string when the text is
+    next needed, so that extending a long text many times is not quadratic."""
     def __init__(self, markup = None, textwrapper = wrapper):
         """Parameters:
         'markup' is another Text object, a string, a (str, attr) pair, or a list
          of (str, attr) pairs.
-        'wrapper' is a TextWrapper instance for later use by wrappedlines. It 
-        can be shared.
+        'wrapper' is a LineWrapper (or TextWrapper) instance for later use by
+        wrappedlines. It can be shared.
         """
+        if isinstance(markup, RopeText):
+            markup = markup.totext()
         if isinstance(markup, Text):
             self.wrapper = markup.wrapper
-            self.markup = markup.markup
+            self._setruns(markup._text, array('i', markup._lengths),
+                          array('i', markup._attrids))
         else:
             if markup == None:
                 markup = []
             self.markup = markup
             self.wrapper = textwrapper
     
+    @classmethod
+    def fromruns(cls, text, lengths, attrids, textwrapper = wrapper):
+        """Makes a Text directly from its internal representation: the full
+        text, and arrays of run lengths and attribute ids (see internattr).
+        The arrays are used, not copied."""
+        self = cls.__new__(cls)
+        self.wrapper = textwrapper
+        self._setruns(text, lengths, attrids)
+        return self
+    
+    def _setruns(self, text, lengths, attrids):
+        self._joined = text
+        self._pieces = [] # strs added by extend since _joined was joined
+        self._piecesbytes = 0
+        self._lengths = lengths
+        self._attrids = attrids
+        self._lines = None
+        self._wrapcache = OrderedDict()
+    
+    @property
+    def _text(self):
+        "The whole text, as one string."
+        if self._pieces:
+            self._pieces.insert(0, self._joined)
+            self._joined = ''.join(self._pieces)
+            self._pieces = []
+            self._piecesbytes = 0
+        return self._joined
+    
+    def runs(self):
+        "Yields the (str, attr) pairs of the markup of this object."
+        text = self._text
+        loc = 0
+        for length, attrid in zip(self._lengths, self._attrids):
+            yield text[loc:loc+length], _attrlist[attrid]
+            loc += length
+    
     @property
     def markup(self):
         "A list representing the markup of this object."
-        return self._markup
+        return list(self.runs())
     
     @markup.setter
     def markup(self, newmarkup):
-        self._markup = list(fullmarkup(newmarkup))
-        self._lines = None
+        txts = []
+        lengths = array('i')
+        attrids = array('i')
+        for txt, attr in fullmarkup(newmarkup):
+            txts.append(txt)
+            lengths.append(len(txt))
+            attrids.append(internattr(attr))
+        self._setruns(''.join(txts), lengths, attrids)
+    
+    def slice(self, begin, end):
+        """Returns a new Text with the characters from begin up to end,
+        keeping their attributes."""
+        begin = max(begin, 0)
+        end = min(end, len(self._text))
+        lengths = array('i')
+        attrids = array('i')
+        loc = 0
+        for length, attrid in zip(self._lengths, self._attrids):
+            if loc >= end:
+                break
+            runend = loc + length
+            overlap = min(runend, end) - max(loc, begin)
+            if overlap > 0:
+                lengths.append(overlap)
+                attrids.append(attrid)
+            loc = runend
+        return Text.fromruns(self._text[begin:end], lengths, attrids,
+                             self.wrapper)
+    
+    def memsize(self):
+        "Returns roughly how many bytes this object is using."
+        return (sys.getsizeof(self._joined) + self._piecesbytes +
+                self._lengths.itemsize * len(self._lengths) +
+                self._attrids.itemsize * len(self._attrids))
     
     def aslines(self, removelastnewline = True):
         """Takes parsed markup and splits it into lines.
@@ -95,29 +367,7 @@ class Text(object):
         where line is in [(txt, attr), ...] format"""
         
         if self._lines is None:
-            lines = []
-            curline = []
-            
-            for txt, attr in self._markup:
-                if '\n' in txt:
-                    splittxt = txt.split('\n')
-                    
-                    txt = splittxt.pop(-1)
-                    # now txt is a line beginning, and splittxt is a list of
-                    # line endings
-                    
-                    for lineend in splittxt:
-                        if len(lineend) > 0:
-                            curline.append((lineend, attr))
-                        lines.append(curline)
-                        curline = []
-                
-                if len(txt) > 0:
-                    curline.append((txt, attr))
-            
-            lines.append(curline)
-            
-            self._lines = lines
+            self._lines = _splitlines(self.runs())
         
         lines = self._lines
         
@@ -127,83 +377,351 @@ class Text(object):
         return lines
     
     def __str__(self):
-        return ''.join(t for t,a in self.markup)
+        return self._text
     
     def __repr__(self):
         return 'Text(' + repr(list(self.markup)) + ')'
     
+    # how many wrapped versions of the text (for different widths or wrapper
+    # settings) to keep
+    wrapcachesize = 4
+    
     def wrappedlines(self):
-        """Uses self.wrapper to wrap the text.
+        """Uses self.wrapper to wrap the text, returning a list of lines of
+        markup.
         
-        NOTE: The attributes of self.wrapper below will be set to the values 
-        below. This is necessary to ensure that the attributes are lined up 
-        correctly:
+        self.wrapper may be a LineWrapper, or a TextWrapper, of which only the
+        width is used; either way, it is not modified.
         
-        self.wrapper.drop_whitespace = False
-        self.wrapper.initial_indent = ''
-        self.wrapper.expand_tabs = False
-        self.wrapper.replace_whitespace = False
-        self.wrapper.fix_sentence_endings = False
+        The result is cached for each width / wrapper setting, until the markup
+        is changed, so it should not be modified."""
+        linewrapper = LineWrapper.fromwrapper(self.wrapper)
+        return _cachedwrap(self._wrapcache, self.wrapcachesize, linewrapper,
+                           self.aslines)
+    
+    def extend(self, newmarkup):
+        """Adds markup to the end of this Text, in place.
         
-        Some of these (such as initial indent and expand_tabs) could be worked
-        around, but I just haven't gotten there yet.
-        """
-        self.wrapper.drop_whitespace = False
-        self.wrapper.initial_indent = ''
-        self.wrapper.expand_tabs = False
-        self.wrapper.replace_whitespace = False
-        self.wrapper.fix_sentence_endings = False
-        finallines = []
-        # this will be filled and reset for every new wrapped line
-        lineattrlist = []
-        lencovered = 0
-        
-        for unwrappedline in self.aslines():
-            unwrappedtext, attrlist = decompose(unwrappedline)
-            
-            if not unwrappedtext:
-                finallines.append(('',[]))
+        Lines and wrapped lines that have been worked out are kept: only the
+        last line is split and wrapped again, with whatever is added to it."""
+        # runs are joined to the run before when their attributes are the
+        # same, as (attribute id, str) pairs
+        runs = []
+        for txt, attr in fullmarkup(newmarkup):
+            if not txt:
                 continue
-            
-            lines = self.wrapper.wrap(unwrappedtext)
-            
-            curattr, curattrlen = attrlist.pop(0)
-            curcovered = 0
-            for l in lines:
-                linelen = len(l)
-                if linelen == 0:
-                    finallines.append((l,[]))
-                while curcovered + curattrlen < linelen:
-                    if curattrlen > 0:
-                        lineattrlist.append((curattr, curattrlen))
-                    curcovered += curattrlen
-                    curattr, curattrlen = attrlist.pop(0)
-                if curcovered + curattrlen == linelen:
-                    if curattrlen > 0:
-                        lineattrlist.append((curattr, curattrlen))
-                    curattrlen = 0
-                    curcovered = 0
-                else:
-                    thislinecovered = linelen - curcovered
-                    fornextline = curattrlen - thislinecovered
-                    if thislinecovered > 0:
-                        lineattrlist.append((curattr, thislinecovered))
-                    curattrlen = fornextline
-                    curcovered = 0
-                finallines.append((l,lineattrlist))
-                lineattrlist = []
-        
-        #return finallines
-        recomposed = [recompose(t, a) for t, a in finallines]
-        return recomposed
+            attrid = internattr(attr)
+            if runs and runs[-1][0] == attrid:
+                runs[-1] = (attrid, runs[-1][1] + txt)
+            else:
+                runs.append((attrid, txt))
+        if not runs:
+            return
+        lines = self._lines
+        lastline = lines[-1] if lines is not None else None
+        
+        lengths = self._lengths
+        attrids = self._attrids
+        for attrid, txt in runs:
+            self._pieces.append(txt)
+            self._piecesbytes += sys.getsizeof(txt)
+        if attrids and attrids[-1] == runs[0][0]:
+            attrid, txt = runs.pop(0)
+            lengths[-1] += len(txt)
+            if lastline and internattr(lastline[-1][1]) == attrid:
+                # the last run of the last line gets longer too
+                lastline = lastline[:-1] + [(lastline[-1][0] + txt,
+                                             lastline[-1][1])]
+            else:
+                # (the run was empty, so the line does not end with it)
+                lastline = (lastline or []) + [(txt, _attrlist[attrid])]
+        for attrid, txt in runs:
+            lengths.append(len(txt))
+            attrids.append(attrid)
+        runs = [(txt, _attrlist[attrid]) for attrid, txt in runs]
+        
+        if lines is None:
+            self._wrapcache.clear()
+            return
+        # lines[-1] becomes newlines; the wrapped lines of the old one are
+        # replaced with those of the new ones
+        newlines = _splitlines(lastline + runs)
+        for key, wrapped in self._wrapcache.items():
+            linewrapper = LineWrapper(*key)
+            if lines[-1]:
+                del wrapped[len(wrapped) - len(linewrapper.wrapline(lines[-1])):]
+            for line in newlines[:-1]:
+                wrapped.extend(linewrapper.wrapline(line))
+            if newlines[-1]:
+                wrapped.extend(linewrapper.wrapline(newlines[-1]))
+        del lines[-1]
+        lines.extend(newlines)
     
     def __add__(self, other):
-        newmarkup = self.markup + Text(other).markup
-        return Text(newmarkup)
+        if not isinstance(other, Text):
+            other = Text(other)
+        return Text.fromruns(self._text + other._text,
+                             self._lengths + other._lengths,
+                             self._attrids + other._attrids)
     
     def __radd__(self, other):
-        return self.__add__(other)
+        return Text(other).__add__(self)
+
+
+class _RopeLeaf(object):
+    "A piece of a RopeText; holds a Text."
+    __slots__ = ('text', 'length', 'newlines', 'height')
+    def __init__(self, text):
+        self.text = text
+        self.length = len(text._text)
+        self.newlines = text._text.count('\n')
+        self.height = 0
+
+class _RopeNode(object):
+    """A node of the balanced (AVL) tree in a RopeText; length and newlines
+    are the totals of everything below."""
+    __slots__ = ('left', 'right', 'length', 'newlines', 'height')
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length = left.length + right.length
+        self.newlines = left.newlines + right.newlines
+        self.height = max(left.height, right.height) + 1
+
+def _rotate(node):
+    """Rebalances a node whose children differ in height by at most 2,
+    returning the new top node."""
+    left, right = node.left, node.right
+    if left.height > right.height + 1:
+        if left.left.height < left.right.height:
+            inner = left.right
+            return _RopeNode(_RopeNode(left.left, inner.left),
+                             _RopeNode(inner.right, right))
+        return _RopeNode(left.left, _RopeNode(left.right, right))
+    if right.height > left.height + 1:
+        if right.right.height < right.left.height:
+            inner = right.left
+            return _RopeNode(_RopeNode(left, inner.left),
+                             _RopeNode(inner.right, right.right))
+        return _RopeNode(_RopeNode(left, right.left), right.right)
+    return node
+
+def _join(a, b):
+    """Concatenates two balanced trees (either may be None), in time
+    proportional to the difference in their heights."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if (a.height == 0 and b.height == 0 and
+            a.length + b.length <= RopeText.leafsize):
+        # keep leaves from getting too small
+        return _RopeLeaf(a.text + b.text)
+    if a.height > b.height + 1:
+        return _rotate(_RopeNode(a.left, _join(a.right, b)))
+    if b.height > a.height + 1:
+        return _rotate(_RopeNode(_join(a, b.left), b.right))
+    return _RopeNode(a, b)
+
+def _split(node, loc):
+    """Splits a tree at character loc, returning (left, right) trees (either
+    may be None)."""
+    if node is None:
+        return None, None
+    if loc <= 0:
+        return None, node
+    if loc >= node.length:
+        return node, None
+    if node.height == 0:
+        text = node.text
+        return (_RopeLeaf(text.slice(0, loc)),
+                _RopeLeaf(text.slice(loc, node.length)))
+    leftlen = node.left.length
+    if loc <= leftlen:
+        left, right = _split(node.left, loc)
+        return left, _join(right, node.right)
+    left, right = _split(node.right, loc - leftlen)
+    return _join(node.left, left), right
+
+def _linestart(node, linenum):
+    """Returns the character position at which line linenum (counting from 0)
+    starts, or None if there are not that many lines."""
+    if linenum == 0:
+        return 0
+    if node is None or linenum > node.newlines:
+        return None
+    loc = 0
+    while node.height > 0:
+        if linenum <= node.left.newlines:
+            node = node.left
+        else:
+            linenum -= node.left.newlines
+            loc += node.left.length
+            node = node.right
+    # the leaf holding the (linenum)th newline
+    txt = node.text._text
+    pos = -1
+    for i in range(linenum):
+        pos = txt.index('\n', pos + 1)
+    return loc + pos + 1
 
+def _leaves(node):
+    "Yields the leaves of a tree, in order."
+    stack = []
+    while stack or node is not None:
+        if node is not None:
+            if node.height == 0:
+                yield node
+                node = None
+            else:
+                stack.append(node.right)
+                node = node.left
+        else:
+            node = stack.pop()
+
+class RopeText(object):
+    """A variant of Text kept as a balanced tree of smaller Text objects.
+    
+    Concatenation (+), slicing by character position (rope[begin:end]) and
+    finding a line (line(n)) all take O(log n) time, so it can be used for
+    long histories that are appended to and trimmed.
+    
+    It has the same aslines(), wrappedlines(), markup and wrapper as Text, so
+    can be used in the same places; these work on the whole text, in linear
+    time."""
+    # the size, in characters, that leaves are split into / merged up to.
+    # Leaves are only split between runs, so may be larger.
+    leafsize = 512
+    
+    def __init__(self, markup = None, textwrapper = wrapper):
+        """Takes the same parameters as Text."""
+        self._root = None
+        self._wrapcache = OrderedDict()
+        if isinstance(markup, RopeText):
+            self._root = markup._root
+            self.wrapper = markup.wrapper
+            return
+        if isinstance(markup, Text):
+            textwrapper = markup.wrapper
+        else:
+            markup = Text(markup)
+        self.wrapper = textwrapper
+        
+        # split into leaves of about leafsize characters, between runs
+        start = loc = 0
+        for length in markup._lengths:
+            loc += length
+            if loc - start >= self.leafsize:
+                self._root = _join(self._root,
+                                   _RopeLeaf(markup.slice(start, loc)))
+                start = loc
+        if loc > start:
+            self._root = _join(self._root, _RopeLeaf(markup.slice(start, loc)))
+    
+    @classmethod
+    def _fromroot(cls, root, textwrapper):
+        self = cls.__new__(cls)
+        self._root = root
+        self._wrapcache = OrderedDict()
+        self.wrapper = textwrapper
+        return self
+    
+    def __len__(self):
+        "Returns the number of characters."
+        if self._root is None:
+            return 0
+        return self._root.length
+    
+    def linecount(self):
+        "Returns the number of lines, counting a last line with no newline."
+        if self._root is None:
+            return 0
+        return self._root.newlines + 1
+    
+    def __getitem__(self, key):
+        """Slicing by character position returns a RopeText; a single index
+        returns that character."""
+        if not isinstance(key, slice):
+            if key < 0:
+                key += len(self)
+            return str(self[key:key+1])
+        begin, end, stride = key.indices(len(self))
+        if stride != 1:
+            raise ValueError('RopeText slices must be contiguous')
+        if end <= begin:
+            return RopeText._fromroot(None, self.wrapper)
+        rest, right = _split(self._root, end)
+        left, mid = _split(rest, begin)
+        return RopeText._fromroot(mid, self.wrapper)
+    
+    def lines(self, begin, end=None):
+        """Returns a RopeText of the lines from begin up to (but not
+        including) end; each keeps its newline."""
+        length = len(self)
+        beginloc = _linestart(self._root, begin)
+        if beginloc is None:
+            beginloc = length
+        endloc = length
+        if end is not None:
+            endloc = _linestart(self._root, end)
+            if endloc is None:
+                endloc = length
+        return self[beginloc:endloc]
+    
+    def line(self, linenum):
+        """Returns line linenum (counting from 0) as markup, in the same
+        format as the lines returned by aslines()."""
+        if linenum < 0 or linenum >= self.linecount():
+            raise IndexError('line %d out of range' % linenum)
+        lines = self.lines(linenum, linenum + 1).aslines()
+        if not lines:
+            return []
+        return lines[0]
+    
+    def totext(self):
+        "Returns the whole text as a single Text object."
+        texts = [leaf.text for leaf in _leaves(self._root)]
+        return Text.fromruns(''.join(t._text for t in texts),
+                             array('i', [l for t in texts for l in t._lengths]),
+                             array('i', [a for t in texts for a in t._attrids]),
+                             self.wrapper)
+    
+    def runs(self):
+        "Yields the (str, attr) pairs of the markup of this object."
+        for leaf in _leaves(self._root):
+            for run in leaf.text.runs():
+                yield run
+    
+    @property
+    def markup(self):
+        "A list representing the markup of this object."
+        return list(self.runs())
+    
+    def aslines(self, removelastnewline = True):
+        return self.totext().aslines(removelastnewline)
+    
+    wrapcachesize = Text.wrapcachesize
+    
+    def wrappedlines(self):
+        """Wraps the text, as Text.wrappedlines does; the result is cached
+        the same way."""
+        linewrapper = LineWrapper.fromwrapper(self.wrapper)
+        return _cachedwrap(self._wrapcache, self.wrapcachesize, linewrapper,
+                           self.aslines)
+    
+    def __str__(self):
+        return ''.join(leaf.text._text for leaf in _leaves(self._root))
+    
+    def __repr__(self):
+        return 'RopeText(' + repr(self.markup) + ')'
+    
+    def __add__(self, other):
+        if not isinstance(other, RopeText):
+            other = RopeText(other)
+        return RopeText._fromroot(_join(self._root, other._root), self.wrapper)
+    
+    def __radd__(self, other):
+        return RopeText(other).__add__(self)
 
 def markuptest(markup):
     parsed = list(fullmarkup(markup))
@@ -240,6 +758,24 @@ def test():
         print 'WRAPPED::',l
         print str(Text(l))
     #print t.wrappedlines()
+    
+    # extending a Text that ends in an empty run, with lines worked out
+    t = Text([('abc', 'B'), ('', 'A')], TextWrapper(width=30))
+    t.wrappedlines()
+    t.extend([('d', 'A')])
+    assert t.aslines() == [[('abc', 'B'), ('d', 'A')]]
+    assert t.wrappedlines() == Text(t.markup, TextWrapper(width=30)).wrappedlines()
+    
+    # what extend adds is joined onto the text when it is next needed
+    t = Text('start\n')
+    for i in range(100):
+        t.extend([('line %d\n' % i, 'bold' if i % 3 else None)])
+    assert len(t._pieces) == 100
+    expected = 'start\n' + ''.join('line %d\n' % i for i in range(100))
+    assert t.memsize() >= len(expected)
+    assert str(t) == expected and not t._pieces
+    assert ''.join(txt for txt, attr in t.runs()) == expected
+    assert str(Text(t)) == expected and str(t.slice(6, 13)) == 'line 0\n'
      
 
 if __name__ == '__main__':
@@ -0,0 +1,224 @@
+"""A stand-in for a curses window that keeps its contents in memory.
+
+MemoryWindow implements the parts of the curses window interface used in this
+package, without a terminal, so that widgets can be benchmarked and tested
+headlessly. It counts the calls made to it (in self.calls), which is how the
+benchmarks measure how much drawing a widget does.
+
+Keys for getch() can be queued with feed()."""
+
+import curses
+from collections import defaultdict, deque
+
+class MemoryWindow(object):
+    def __init__(self, nlines, ncols, begin_y=0, begin_x=0):
+        self.nlines = nlines
+        self.ncols = ncols
+        self.begin = (begin_y, begin_x)
+        self.cells = [[(' ', 0)] * ncols for y in range(nlines)]
+        self.y = self.x = 0
+        self.calls = defaultdict(int)
+        self.keys = deque()
+        self.refreshes = 0
+
+    def _count(self, name):
+        self.calls[name] += 1
+
+    def getmaxyx(self):
+        return self.nlines, self.ncols
+
+    def getbegyx(self):
+        return self.begin
+
+    def getyx(self):
+        return self.y, self.x
+
+    def move(self, y, x):
+        self._count('move')
+        if not (0 <= y < self.nlines and 0 <= x < self.ncols):
+            raise curses.error('move() returned ERR')
+        self.y, self.x = y, x
+
+    def addstr(self, *args):
+        """addstr([y, x,] str[, attr]), like a curses window; raises
+        curses.error after writing, if the text went past the last cell."""
+        self._count('addstr')
+        if len(args) >= 3:
+            self.move(args[0], args[1])
+            args = args[2:]
+        txt = args[0]
+        attr = args[1] if len(args) > 1 else 0
+        for ch in txt:
+            if ch == '\n':
+                self.cells[self.y][self.x:] = [(' ', 0)] * (self.ncols - self.x)
+                if self.y + 1 >= self.nlines:
+                    raise curses.error('addstr() returned ERR')
+                self.y, self.x = self.y + 1, 0
+                continue
+            self.cells[self.y][self.x] = (ch, attr)
+            if self.x + 1 < self.ncols:
+                self.x += 1
+            elif self.y + 1 < self.nlines:
+                self.y, self.x = self.y + 1, 0
+            else:
+                raise curses.error('addstr() returned ERR')
+
+    def addch(self, *args):
+        "addch([y, x,] ch[, attr]); ch may be a str, or an int with attributes."
+        self._count('addch')
+        if len(args) >= 3:
+            self.move(args[0], args[1])
+            args = args[2:]
+        ch = args[0]
+        attr = args[1] if len(args) > 1 else 0
+        if isinstance(ch, int):
+            ch, attr = chr(ch & 0xff), attr | (ch & ~0xff)
+        self.addstr(ch, attr)
+        self.calls['addstr'] -= 1
+
+    def inch(self, *args):
+        "inch([y, x]): returns the character and its attributes, as an int."
+        self._count('inch')
+        y, x = self.y, self.x
+        if len(args) >= 2:
+            y, x = args[0], args[1]
+        ch, attr = self.cells[y][x]
+        return ord(ch) | attr
+
+    def hline(self, *args):
+        "hline([y, x,] ch, n): draws a line of n ch, without moving the cursor."
+        self._count('hline')
+        y, x = self.y, self.x
+        if len(args) >= 4:
+            y, x = args[0], args[1]
+            args = args[2:]
+        ch, n = args
+        if isinstance(ch, int):
+            ch = chr(ch & 0xff)
+        row = self.cells[y]
+        for i in range(x, min(x + n, self.ncols)):
+            row[i] = (ch, 0)
+
+    def insstr(self, *args):
+        "insstr([y, x,] str[, attr]): inserts without moving the cursor."
+        self._count('insstr')
+        if len(args) >= 3:
+            self.move(args[0], args[1])
+            args = args[2:]
+        txt = args[0]
+        attr = args[1] if len(args) > 1 else 0
+        row = self.cells[self.y]
+        row[self.x:self.x] = [(ch, attr) for ch in txt]
+        del row[self.ncols:]
+
+    def insch(self, *args):
+        "insch([y, x,] ch[, attr])"
+        self._count('insch')
+        if len(args) >= 3:
+            self.move(args[0], args[1])
+            args = args[2:]
+        ch = args[0]
+        if isinstance(ch, int):
+            ch = chr(ch)
+        attr = args[1] if len(args) > 1 else 0
+        row = self.cells[self.y]
+        row.insert(self.x, (ch, attr))
+        del row[self.ncols:]
+
+    def delch(self, *args):
+        self._count('delch')
+        if len(args) >= 2:
+            self.move(args[0], args[1])
+        row = self.cells[self.y]
+        del row[self.x]
+        row.append((' ', 0))
+
+    def instr(self, *args):
+        "instr([y, x]): returns the characters from the cursor to the end."
+        self._count('instr')
+        y, x = self.y, self.x
+        if len(args) >= 2:
+            y, x = args[0], args[1]
+        return ''.join(ch for ch, attr in self.cells[y][x:])
+
+    def clrtoeol(self):
+        self._count('clrtoeol')
+        row = self.cells[self.y]
+        row[self.x:] = [(' ', 0)] * (self.ncols - self.x)
+
+    def insdelln(self, nlines):
+        """Inserts (nlines > 0) or deletes (nlines < 0) lines at the cursor,
+        moving the lines below down or up."""
+        self._count('insdelln')
+        y = self.y
+        if nlines > 0:
+            for i in range(min(nlines, self.nlines - y)):
+                self.cells.insert(y, [(' ', 0)] * self.ncols)
+            del self.cells[self.nlines:]
+        elif nlines < 0:
+            count = min(-nlines, self.nlines - y)
+            del self.cells[y:y + count]
+            self.cells.extend([(' ', 0)] * self.ncols for i in range(count))
+
+    def insertln(self):
+        self._count('insertln')
+        self.insdelln(1)
+        self.calls['insdelln'] -= 1
+
+    def deleteln(self):
+        self._count('deleteln')
+        self.insdelln(-1)
+        self.calls['insdelln'] -= 1
+
+    def erase(self):
+        self._count('erase')
+        self.cells = [[(' ', 0)] * self.ncols for y in range(self.nlines)]
+        self.y = self.x = 0
+
+    clear = erase
+
+    def refresh(self):
+        self._count('refresh')
+        self.refreshes += 1
+
+    def noutrefresh(self):
+        self._count('noutrefresh')
+
+    def feed(self, keys):
+        "Queues keys (ints, or the characters of a string) for getch()."
+        if isinstance(keys, basestring):
+            keys = [ord(ch) for ch in keys]
+        self.keys.extend(keys)
+
+    def getch(self):
+        "Returns the next queued key, or -1 if there are none."
+        self._count('getch')
+        if not self.keys:
+            return -1
+        return self.keys.popleft()
+
+    def lines(self):
+        "Returns the contents of the window, as a list of strings."
+        return [''.join(ch for ch, attr in row) for row in self.cells]
+
+    # settings that make no difference in memory
+    def keypad(self, flag):
+        pass
+
+    def scrollok(self, flag):
+        pass
+
+    def idlok(self, flag):
+        pass
+
+    def nodelay(self, flag):
+        pass
+
+    def timeout(self, delay):
+        pass
+
+    def bkgd(self, ch, attr=0):
+        pass
+
+    def redrawwin(self):
+        self._count('redrawwin')
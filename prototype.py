@@ -1,5 +1,7 @@
 #!/usr/bin/env python 
 import curses
+import signal
+from curses import textpad
 from optparse import OptionParser
 
 import pygments.lexers, pygments.styles
@@ -7,6 +9,13 @@ import pygments.lexers, pygments.styles
 from cursesextras import safescreen, log
 from cursespygments import CursesFormatter
 from interpreterwidget import InterpWidget
+from scrollback import Scrollback
+from eventloop import EventLoop
+from executor import Executor
+from kernel import KernelClient
+from highlighter import Highlighter
+from tokencache import TokenCache
+import fastlexer
 import markup
 
 if __name__ == '__main__':
@@ -18,6 +27,10 @@ if __name__ == '__main__':
     parser.add_option('-t', '--term', dest='term')
     #use a different style
     parser.add_option('-s', '--style', dest='style')
+    # run the code in this process, instead of in a kernel process
+    parser.add_option('-i', '--inprocess', dest='inprocess',action='store_true')
+    # lex the code with fastlexer instead of pygments
+    parser.add_option('-f', '--fast', dest='fast',action='store_true')
     
     opts, args = parser.parse_args()
     termname = opts.term
@@ -33,36 +46,143 @@ if __name__ == '__main__':
                 break
     
     formatter = CursesFormatter(style=style,usebg=True,defaultbg=-2)
-    lexer = pygments.lexers.get_lexer_by_name('python')
+    if opts.fast:
+        lexer = fastlexer.get_lexer_by_name('python')
+    else:
+        lexer = pygments.lexers.get_lexer_by_name('python')
     
     with safescreen(termname) as scr:
         interp = InterpWidget(scr)
-        scr.refresh()
         interp.topwin.addstr("This is where completions would be.\n")
         interp.topwin.scrollok(1)
-        interp.topwin.refresh()
         formatter.makebackground(interp.midwin)
-        interp.midwin.refresh()
-        allcode = []
+        interp.mark(interp.topwin, interp.midwin)
+        allcode = Scrollback()
+        loop = EventLoop(interp.botwin, interp.scheduler)
         
         #interp.midpad.texts.append(markup.Text('123'))
         #interp.midpad.refresh()
-        while True:
-            code = interp.textbox.edit().rstrip()
+        if opts.inprocess:
+            executor = Executor()
+        else:
+            executor = KernelClient()
+        
+        # code run again (or shown again) is not lexed again
+        highlighter = Highlighter(lexer, cache=TokenCache())
+        midtexts = interp.midpad.texts
+        
+        def showcode(cell):
+            # the code is shown when it starts running, above its output:
+            # plain at first, and in color once a worker has lexed it (so
+            # pasting a long module does not hold everything up)
+            code = cell.code if cell.code.endswith('\n') else cell.code + '\n'
+            midtexts.append(markup.Text(code))
+            interp.midpad.refresh()
+            # a position that stays the same as old texts are dropped
+            key = len(midtexts) - 1 + midtexts.dropped
+            highlighter.submit(key, code, lambda tokens: showcolors(key, tokens))
+        
+        def showcolors(key, tokens):
+            index = key - midtexts.dropped
+            if index < 0:
+                return
+            midtexts[index] = markup.Text(formatter.formattokens(tokens))
+            interp.midpad.invalidate(index)
+            interp.midpad.refresh()
+        
+        def poll():
+            # output written to the middle panel is drawn as it arrives, and
+            # the code on screen is highlighted first
+            interp.midpad.poll()
+            dropped = midtexts.dropped
+            for key in highlighter.keys():
+                if key < dropped:
+                    highlighter.cancel(key)
+            highlighter.setvisible(index + dropped
+                    for index in interp.midpad.visibletexts())
+        
+        def showoutput(cell, name, txt):
+            interp.midpad.write(txt, curses.A_BOLD if name == 'stderr' else 0)
+        
+        def showtimes(cell):
+            if cell.interrupted:
+                status = 'interrupted'
+            elif cell.error:
+                status = 'error'
+            else:
+                status = 'done'
+            if cell.walltime is None:
+                # the kernel died before the cell finished
+                interp.midpad.write('[%s]\n' % status, curses.A_DIM)
+            else:
+                interp.midpad.write('[%s: %.3fs wall, %.3fs CPU]\n' % (
+                    status, cell.walltime, cell.cputime), curses.A_DIM)
+            interp.midpad.endstream()
+        
+        def askinput(cell, prompt):
+            # raw_input in the kernel: the prompt is shown with the output,
+            # and the answer typed in the top window
+            interp.midpad.write(prompt)
+            interp.midpad.flush()
+            interp.topwin.erase()
+            interp.scheduler.cursorwin = interp.topwin
+            interp.mark(interp.topwin)
+            def answered(value):
+                value = value.rstrip()
+                interp.midpad.write(value + '\n')
+                interp.scheduler.cursorwin = interp.botwin
+                interp.topwin.erase()
+                interp.mark(interp.topwin, interp.botwin)
+                executor.reply(value)
+            loop.edit(textpad.Textbox(interp.topwin), answered)
+        
+        executor.onstart = showcode
+        executor.onoutput = showoutput
+        executor.ondone = showtimes
+        executor.oninput = askinput
+        loop.addreader(executor.fileno(), executor.handleevents)
+        
+        def restart(returncode):
+            # the kernel has died, taking its namespace with it: a new one
+            # runs the cells from now on
+            loop.removereader(executor.fileno())
+            executor.start()
+            loop.addreader(executor.fileno(), executor.handleevents)
+            interp.midpad.write('[the kernel died; started a new one]\n',
+                                curses.A_DIM)
+            interp.midpad.endstream()
+        if not opts.inprocess:
+            executor.onexit = restart
+            # notices a kernel whose socket a process it started still holds
+            loop.every(1.0, executor.checkalive)
+        loop.addreader(highlighter.fileno(), highlighter.handleevents)
+        
+        def interrupt(signum, frame):
+            # Ctrl-C stops the running cell, or, if there is none, the program
+            if not executor.interrupt():
+                raise KeyboardInterrupt
+        signal.signal(signal.SIGINT, interrupt)
+        
+        def submit(code):
+            code = code.rstrip()
             if not code:
-                break
+                loop.stop()
+                return
             allcode.append(code)
-            tokensource = lexer.get_tokens(code)
-            
-            textobj = markup.Text(formatter.formatgenerator(tokensource))
-            #wrapped = (textobj)
-            #interp.topwin.addstr(repr(wrapped) + '\n')
-            #interp.topwin.refresh()
-            
-            interp.midpad.texts.append(textobj)
-            #log(interp.midpad.texts)
-            interp.midpad.refresh()
+            # the next cell can be typed while this one runs
+            executor.submit(code)
             interp.botwin.clear()
+            interp.mark(interp.botwin)
+            loop.edit(interp.textbox, submit)
+        
+        loop.edit(interp.textbox, submit)
+        loop.every(1.0 / interp.midpad.maxfps, poll)
+        interp.frame(force=True)
+        try:
+            loop.run()
+        finally:
+            executor.close()
+            highlighter.close()
     
     for code in allcode:
         print code.rstrip()
\ No newline at end of file
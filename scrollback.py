@@ -0,0 +1,227 @@
+"""A list of the entries of a long session (such as markup.Text objects, or
+strings), using a bounded amount of memory.
+
+The most recent entries are kept as they are. Older ones are compressed with
+zlib, and decompressed again when they are looked at (a few of the most
+recently looked at are kept decompressed). When the total goes over the memory
+limit, the oldest entries are dropped, like the scrollback of a terminal.
+
+Entries must be markup.Text objects, or values that marshal can serialize
+(strings, numbers, tuples, ...)."""
+
+import sys
+import zlib
+import marshal
+from array import array
+from collections import OrderedDict
+
+import markup
+from basicsequence import BasicMutableSequence
+
+class _Cold(object):
+    "A compressed entry."
+    __slots__ = ('data', 'istext', 'wrapper')
+    def __init__(self, obj):
+        self.istext = isinstance(obj, markup.Text)
+        if self.istext:
+            # the attribute ids are only meaningful in this process, which is
+            # the only place they will be read
+            self.wrapper = obj.wrapper
+            obj = (obj._text, obj._lengths.tostring(), obj._attrids.tostring())
+        else:
+            self.wrapper = None
+        self.data = zlib.compress(marshal.dumps(obj))
+
+    def load(self):
+        obj = marshal.loads(zlib.decompress(self.data))
+        if not self.istext:
+            return obj
+        text, lengths, attrids = obj
+        return markup.Text.fromruns(text, array('i', lengths),
+                                    array('i', attrids), self.wrapper)
+
+def _sizeof(obj):
+    "Returns roughly how many bytes an entry that is not compressed is using."
+    if isinstance(obj, _Cold):
+        return len(obj.data)
+    if isinstance(obj, markup.Text):
+        return obj.memsize()
+    return sys.getsizeof(obj)
+
+class Scrollback(BasicMutableSequence):
+    """A list that compresses all but its last 'hotcount' entries, and drops
+    the oldest entries to stay under 'maxbytes'.
+
+    maxbytes limits the entries as stored (the last hotcount as they are,
+    the rest compressed); the cache of decompressed entries adds up to
+    cachesize entries to that. The last hotcount entries are never dropped.
+
+    self.dropped counts the entries dropped from the front, so that anything
+    keeping track of positions in the list can tell how far they moved.
+    stats() returns the memory in use and how well the cache of decompressed
+    entries is doing."""
+    def __init__(self, entries=(), maxbytes=32*1024*1024, hotcount=64,
+                 cachesize=32):
+        self.maxbytes = maxbytes
+        self.hotcount = hotcount
+        self.cachesize = cachesize
+        self._entries = []
+        self._sizes = []
+        self._coldend = 0 # entries before this one are compressed
+        self._bytes = 0 # the total of self._sizes
+        self._cache = OrderedDict() # index -> decompressed entry
+        self.dropped = 0
+        self.hits = 0
+        self.misses = 0
+        self.compressions = 0
+        self.extend(entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get(i)
+
+    def __contains__(self, item):
+        return any(entry == item for entry in self)
+
+    def _get(self, loc):
+        if loc >= self._coldend:
+            return self._entries[loc]
+        cache = self._cache
+        try:
+            obj = cache.pop(loc)
+            self.hits += 1
+        except KeyError:
+            obj = self._entries[loc].load()
+            self.misses += 1
+            if len(cache) >= self.cachesize:
+                cache.popitem(last=False)
+        cache[loc] = obj
+        return obj
+
+    def _put(self, loc, obj, cold):
+        "Stores obj at loc (replacing what was there), compressed if cold."
+        if cold:
+            obj = _Cold(obj)
+            self.compressions += 1
+        size = _sizeof(obj)
+        self._bytes += size - self._sizes[loc]
+        self._entries[loc] = obj
+        self._sizes[loc] = size
+
+    def _set(self, loc, obj):
+        self._cache.pop(loc, None)
+        self._put(loc, obj, loc < self._coldend)
+        self._trim()
+
+    def _delete(self, loc):
+        self._bytes -= self._sizes.pop(loc)
+        del self._entries[loc]
+        if loc < self._coldend:
+            self._coldend -= 1
+        self._cache.clear()
+
+    def insert(self, index, obj):
+        index = max(0, min(index, len(self)))
+        self._entries.insert(index, None)
+        self._sizes.insert(index, 0)
+        if index < self._coldend:
+            self._coldend += 1
+            self._cache.clear()
+            self._put(index, obj, True)
+        else:
+            self._put(index, obj, False)
+        self._cool()
+        self._trim()
+
+    def _cool(self):
+        "Compresses the entries that are no longer among the last hotcount."
+        while self._coldend < len(self) - self.hotcount:
+            self._put(self._coldend, self._entries[self._coldend], True)
+            self._coldend += 1
+
+    def _trim(self):
+        "Drops the oldest compressed entries, until under self.maxbytes."
+        count = 0
+        total = self._bytes
+        while total > self.maxbytes and count < self._coldend:
+            total -= self._sizes[count]
+            count += 1
+        if not count:
+            return
+        del self._entries[:count]
+        del self._sizes[:count]
+        self._bytes = total
+        self._coldend -= count
+        self.dropped += count
+        self._cache = OrderedDict((loc - count, obj)
+                for loc, obj in self._cache.items() if loc >= count)
+
+    def residentbytes(self):
+        """Returns roughly how many bytes the entries are using, including
+        the cache of decompressed ones."""
+        return self._bytes + sum(_sizeof(obj) for obj in self._cache.values())
+
+    def stats(self):
+        return dict(entries=len(self), compressed=self._coldend,
+                    dropped=self.dropped, residentbytes=self.residentbytes(),
+                    hits=self.hits, misses=self.misses,
+                    compressions=self.compressions)
+
+def test():
+    """Fills a small Scrollback with strings and Texts, edits it, and checks
+    it against a list."""
+    import random
+    def plain(obj):
+        return obj.markup if isinstance(obj, markup.Text) else obj
+    rand = random.Random(0)
+    def entry(i):
+        if i % 3 == 0:
+            return markup.Text(['entry %d ' % i, ('bold', 'bold'), ' x' * i])
+        return 'entry %d' % i * 5
+    expected = []
+    s = Scrollback(hotcount=4, cachesize=3)
+    for i in range(20):
+        s.append(entry(i))
+        expected.append(entry(i))
+    assert s.stats()['compressed'] == 16 and s.compressions == 16
+    assert [plain(obj) for obj in s] == [plain(obj) for obj in expected]
+    # looking at the same compressed entry again is a hit
+    misses = s.misses
+    s[2]
+    s[2]
+    assert s.misses == misses + 1 and s.hits >= 1
+    # edits in the compressed part, and at the end
+    for step in range(200):
+        i = rand.randrange(len(expected) + 1)
+        op = rand.randrange(3)
+        if op == 0 and i < len(expected):
+            s[i] = expected[i] = entry(step)
+        elif op == 1:
+            s.insert(i, entry(step))
+            expected.insert(i, entry(step))
+        elif i < len(expected):
+            del s[i]
+            del expected[i]
+        assert len(s) == len(expected)
+        j = rand.randrange(len(expected))
+        assert plain(s[j]) == plain(expected[j])
+    assert [plain(obj) for obj in s] == [plain(obj) for obj in expected]
+    assert s._bytes == sum(s._sizes)
+    # over the limit, the oldest go, but never the last hotcount
+    s = Scrollback(maxbytes=200, hotcount=4)
+    for i in range(100):
+        s.append(entry(i))
+    assert s.dropped > 0 and len(s) + s.dropped == 100
+    assert s._bytes <= 200 or s._coldend == 0
+    assert [plain(obj) for obj in s] == [plain(entry(i))
+                                         for i in range(s.dropped, 100)]
+    s = Scrollback(maxbytes=0, hotcount=4)
+    s.extend(entry(i) for i in range(10))
+    assert len(s) == 4 and s.dropped == 6
+    print s.stats()
+
+if __name__ == '__main__':
+    test()
@@ -1,6 +1,8 @@
 from cursesextras import *
 from myspath import path
 import cursespygments
+import fastlexer
+from tokencache import TokenCache
 import pygments, pygments.lexers, pygments.styles
 from optparse import OptionParser
 
@@ -37,6 +39,8 @@ def testformatter():
     parser=OptionParser()
     parser.add_option('-c', '--color', dest='color',action='store_true')
     parser.add_option('-t', '--term', dest='term')
+    # lex with fastlexer instead of pygments
+    parser.add_option('-f', '--fast', dest='fast',action='store_true')
     opts, args = parser.parse_args()
     termname = opts.term
     if opts.color and not opts.term:
@@ -46,10 +50,17 @@ def testformatter():
     fgcol = curses.COLOR_BLACK
     formatter = cursespygments.CursesFormatter(usebg=True, defaultbg=-2,
                     defaultfg = -2)
-    lexer = pygments.lexers.get_lexer_by_name('python')
+    if opts.fast:
+        lexer = fastlexer.get_lexer_by_name('python')
+    else:
+        lexer = pygments.lexers.get_lexer_by_name('python')
+    
+    # each snippet is lexed once; for every other style, its tokens are only
+    # given new attributes
+    cache = TokenCache()
     
     def texttoscreen(scr, txt):
-        for text, attr in formatter.formatgenerator(lexer.get_tokens(txt)):
+        for text, attr in formatter.formattokens(cache.get_tokens(lexer, txt)):
             scr.addstr(text, attr)
         #scr.addstr('\n')
     
@@ -61,6 +72,11 @@ def testformatter():
             texttoscreen(scr, s)
             texttoscreen(scr, 'def g(x=3+4, y = "abcd"): pass')
             formatter.updatewindow(scr)
+            # how many init_color / init_pair calls the palette diffing saved
+            scr.addstr('calls made: %d, saved: %d\n' %
+                        (formatter.callsmade, formatter.callssaved))
+            scr.addstr('token cache: %(hits)d hits, %(misses)d misses\n'
+                        % cache.stats())
             if scr.getch() == ord('q'):
                 break
 
@@ -0,0 +1,155 @@
+"""Remembers the tokens lexers gave for pieces of code, so that the same code
+is not lexed again: when the style changes, or the same cell is shown again,
+its tokens only need formatting (CursesFormatter.formattokens), which is much
+quicker than lexing.
+
+Tokens are stored without anything that depends on the style: for each piece
+of code, an array of token type ids and an array of their lengths, from which
+the tokens are cut out of the code again. The least recently used entries are
+dropped once there are more than maxentries, or they take more than maxbytes.
+
+A TokenCache can be shared between threads (a Highlighter's workers, and the
+interface's thread)."""
+
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+
+# token types are stored as their index in this list
+_ttypelist = []
+_ttypeids = {}
+
+def _ttypeid(ttype):
+    try:
+        return _ttypeids[ttype]
+    except KeyError:
+        ttypeid = _ttypeids[ttype] = len(_ttypelist)
+        _ttypelist.append(ttype)
+        return ttypeid
+
+def lexerkey(lexer):
+    "Returns what tells lexers apart in the cache: their class and options."
+    return type(lexer), repr(sorted(lexer.options.items()))
+
+class _Entry(object):
+    __slots__ = ('ttypeids', 'lengths', 'text', 'size')
+    def __init__(self, tokens, source):
+        self.ttypeids = array('H', [_ttypeid(ttype) for ttype, value in tokens])
+        self.lengths = array('i', [len(value) for ttype, value in tokens])
+        text = u''.join(value for ttype, value in tokens)
+        # the lexer usually gives back the code as it was (if as unicode);
+        # when it does not (adding a '\n' at the end, say), its text is kept
+        self.text = None if text == source else text
+        self.size = (self.ttypeids.itemsize * len(self.ttypeids) +
+                     self.lengths.itemsize * len(self.lengths) +
+                     len(self.text or ''))
+
+    def tokens(self, source):
+        text = source if self.text is None else self.text
+        ttypelist = _ttypelist
+        tokens = []
+        pos = 0
+        for ttypeid, length in zip(self.ttypeids, self.lengths):
+            tokens.append((ttypelist[ttypeid], text[pos:pos + length]))
+            pos += length
+        return tokens
+
+class TokenCache(object):
+    def __init__(self, maxentries=1000, maxbytes=8*1024*1024):
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self._entries = OrderedDict() # key -> _Entry, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(lexer, source):
+        "Returns the key of the tokens of source, lexed with lexer."
+        if isinstance(source, unicode):
+            data = source.encode('utf-8')
+        else:
+            data = source
+        return lexerkey(lexer), len(source), hashlib.sha1(data).digest()
+
+    def lookup(self, lexer, source):
+        """Returns the tokens of source, lexed with lexer, as a list of
+        (ttype, str), or None if they are not in the cache."""
+        key = self.key(lexer, source)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+        return entry.tokens(source)
+
+    def store(self, lexer, source, tokens):
+        "Keeps tokens (a list of (ttype, str)) as the tokens of source."
+        key = self.key(lexer, source)
+        entry = _Entry(tokens, source)
+        if entry.size > self.maxbytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while (len(self._entries) > self.maxentries or
+                   self._bytes > self.maxbytes):
+                key, old = self._entries.popitem(last=False)
+                self._bytes -= old.size
+                self.evictions += 1
+
+    def get_tokens(self, lexer, source):
+        """Returns the tokens of source, as lexer.get_tokens would, but as a
+        list, and lexing only if they are not in the cache."""
+        tokens = self.lookup(lexer, source)
+        if tokens is None:
+            tokens = list(lexer.get_tokens(source))
+            self.store(lexer, source, tokens)
+        return tokens
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Returns a dict of entries, bytes, hits, misses, evictions and
+        hitrate (hits over lookups)."""
+        lookups = self.hits + self.misses
+        return dict(entries=len(self._entries), bytes=self._bytes,
+                    hits=self.hits, misses=self.misses,
+                    evictions=self.evictions,
+                    hitrate=float(self.hits) / lookups if lookups else 0.0)
+
+def test():
+    "Lexes a few pieces of code, some twice, with a cache too small for all."
+    import pygments.lexers
+    lexer = pygments.lexers.get_lexer_by_name('python')
+    cache = TokenCache(maxentries=3)
+    a, b = 'x = 1\n', 'def f(a):\n    return a\n'
+    c, d = u'print "\xe9"\n', 'no newline at the end'
+    # a is used again just before d pushes out the least recently used, b
+    for source in [a, b, a, c, d, a, b]:
+        tokens = cache.get_tokens(lexer, source)
+        assert tokens == list(lexer.get_tokens(source))
+    print cache.stats()
+    assert cache.hits == 2 and cache.misses == 5 and cache.evictions == 2
+    other = pygments.lexers.get_lexer_by_name('python', stripnl=False)
+    assert cache.lookup(other, a) is None
+    cache = TokenCache(maxbytes=100)
+    cache.get_tokens(lexer, a * 50)
+    assert len(cache) == 0
+
+if __name__ == '__main__':
+    test()
@@ -3,9 +3,15 @@ from __future__ import print_function
 from curses.textpad import Textbox as orig_Textbox
 from exceptions import EOFError, KeyboardInterrupt
 
+import curses.ascii
+
 from cursesextras import *
 # /usr/lib/python2.5/curses/textpad.py
 from basicsequence import BasicMutableSequence
+from heightindex import HeightIndex
+import markup
+import linediff
+from incrementallexer import IncrementalLexer
 
 def parsemarkup(obj):
     """Accepts strings, (string, attr) tuples, or lists of tuples.
@@ -21,131 +27,187 @@ def parsemarkup(obj):
             yield item
 
 class Panelastext(BasicMutableSequence):
+    """A window, treated as a list of lines of text.
+    
+    The lines (str, (str, attr) pairs, or lists of them; see parsemarkup) are
+    kept in self._lines, which answers all reads: the window is only drawn on.
+    Lines longer than the window is wide are wrapped onto several physical
+    lines of the window; lines below the bottom of the window are kept, but
+    not drawn."""
     def __init__(self, win):
         """A window is required to instantiate the textbox."""
         self.win = win
+        # if set (to a FrameScheduler), refresh() marks the window for the
+        # next frame instead of refreshing it straight away
+        self.scheduler = None
+        # let curses scroll rows with the terminal's insert/delete line
+        # commands, rather than repainting them
+        win.idlok(1)
         self._maxyx = win.getmaxyx()
-        self._wrappedlines = set() # lines that are a continuation of the line above
-        self._lowerline = -1 # don't go beyond this (pad coord, not line coord)
+        self._lines = [] # the markup of each line, as it was given
+        # the number of physical (pad) lines each line of text takes up
+        self._heights = HeightIndex()
     
     def refresh(self):
-        self.win.refresh()
+        if self.scheduler is not None:
+            self.scheduler.mark(self.win)
+        else:
+            self.win.refresh()
     
     def _tophyscoord(self, linenum):
         """Returns (begin, end) representing the lines in the pad that 
         correspond to line linenum"""
         linenum = int(linenum)
-        begin = end = linenum
-        for i in sorted(self._wrappedlines):
-            if i <= begin:
-                begin += 1
-                end += 1
-            elif i <= end + 1:
-                end += 1
-            else:
-                break
-        return (begin, end)
+        begin = self._heights.offset(linenum)
+        if linenum >= len(self._heights):
+            return (begin, begin)
+        return (begin, begin + self._heights[linenum] - 1)
     
     def _tolinecoord(self, linenum):
         """Given a physical coordinate, returns the corresponding line number in
         the text"""
-        linenum = int(linenum)
-        for i in reversed(sorted(self._wrappedlines)):
-            if i <= linenum:
-                linenum -= 1
-        return linenum
+        return self._heights.find(int(linenum))[0]
+    
+    def _physlines(self, line):
+        """Splits a line into the markup of the physical lines it takes up."""
+        maxy, maxx = self._maxyx
+        wrapper = markup.LineWrapper(maxx, wordwrap=False)
+        return wrapper.wrapline(list(parsemarkup(line)))
+    
+    def _draw(self, begin, physlines):
+        """Draws the given physical lines, starting at pad line begin. Lines
+        below the bottom of the window are left out."""
+        maxy = self.win.getmaxyx()[0]
+        for i, physline in enumerate(physlines[:max(0, maxy - begin)]):
+            self.win.move(begin+i,0)
+            self.win.clrtoeol()
+            try:
+                for obj, attr in physline:
+                    if attr == None:
+                        attr = 0
+                    self.win.addstr(obj, attr)
+            except curses.error:
+                # writing the bottom right corner moves the cursor off the
+                # window, which curses reports as an error
+                pass
+    
+    def _replace(self, begin, end, newlines):
+        """Replaces lines begin up to end with the list newlines, making room
+        for them in the window with a single insdelln."""
+        physbegin = self._heights.offset(begin)
+        physend = self._heights.offset(end)
+        physlines = [self._physlines(line) for line in newlines]
+        heights = [len(lines) for lines in physlines]
+        change = sum(heights) - (physend - physbegin)
+        maxy = self.win.getmaxyx()[0]
+        if change and physbegin < maxy:
+            self.win.move(physbegin,0)
+            self.win.insdelln(change)
+        for lines in physlines:
+            self._draw(physbegin, lines)
+            physbegin += len(lines)
+        
+        self._heights.deleterange(begin, end)
+        self._heights.insertmany(begin, heights)
+        self._lines[begin:end] = newlines
+        if change < 0:
+            # lines that did not fit in the window may have moved up into it
+            self._drawrows(max(physbegin, maxy + change), maxy)
+    
+    def _drawrows(self, top, bottom):
+        "Draws the lines that take up window lines top up to bottom again."
+        line = self._tolinecoord(top)
+        row = self._heights.offset(line)
+        while row < bottom and line < len(self._lines):
+            physlines = self._physlines(self._lines[line])
+            self._draw(row, physlines)
+            row += len(physlines)
+            line += 1
     
     def _delete(self, linenum):
         """Removes the specified line."""
         log(str(type(self)) + "._delete(%d) %d" % (linenum, len(self)))
-        begin, end = self._tophyscoord(linenum)
-        self.win.move(begin,0)
-        lines = 0
-        for i in range(begin, end+1):
-            self.win.deleteln()
-            if i in self._wrappedlines:
-                self._wrappedlines.remove(i)
-            lines += 1
-        self._lowerline -= lines
-        for i in sorted(self._wrappedlines):
-            if i > end:
-                self._wrappedlines.remove(i)
-                self._wrappedlines.add(i-lines)
-        
-        log(self[:])
+        self._replace(linenum, linenum + 1, [])
+    
+    def _deleterange(self, begin, end):
+        log(str(type(self)) + "._deleterange(%d,%d) %d" % (begin, end, len(self)))
+        self._replace(begin, end, [])
     
     def __iter__(self):
-        return iter(self[:])
+        for line in self._lines:
+            yield self._astext(line)
+    
+    def __contains__(self, item):
+        return any(text == item for text in self)
     
     def insert(self, index, line):
         """Inserts the given line after the specified point."""
         log(str(type(self)) + ".insert(%d,%r)" % (index, line))
-        begin, end = self._tophyscoord(index)
-        self.win.move(begin,0)
-        self.win.insertln()
-        self._lowerline += 1
-        for i in sorted(self._wrappedlines):
-            if i >= begin:
-                self._wrappedlines.remove(i)
-                self._wrappedlines.add(i+1)
-        if line:
-            self._set(index, line)
+        index = max(0, min(index, len(self)))
+        self._replace(index, index, [line])
+    
+    def _insertmany(self, index, lines):
+        log(str(type(self)) + "._insertmany(%d,%d)" % (index, len(lines)))
+        index = max(0, min(index, len(self)))
+        self._replace(index, index, lines)
+    
+    @staticmethod
+    def _astext(line):
+        return ''.join(txt for txt, attr in parsemarkup(line))
     
     def _get(self, loc):
         "Returns the line as a str."
-        begin, end = self._tophyscoord(loc)
-        
-        line = ''
-        for linenum in range(begin,end+1):
-            line += self.win.instr(linenum,0)
-        
-        return line.rstrip()
+        return self._astext(self._lines[loc])
+    
+    def getmarkup(self, loc):
+        "Returns the line as a list of (str, attr) pairs."
+        return list(parsemarkup(self._lines[self._index(loc)]))
     
     def _set(self, loc, newline):
         log(str(type(self)) + "._set(%d,%r) %d" % (loc, newline, len(self)))
-        maxy, maxx = self._maxyx
-        begin, end = self._tophyscoord(loc)
-        numoldlines = end - begin + 1
-        numnewlines = max(((len(newline)-1) / maxx) + 1,1)
-        self.win.move(begin,0)
-        # add or delete the right number of physical lines to replace 
-        # what we have
-        for i in range(numoldlines - numnewlines):
-            self.win.deleteln()
-        for i in range(numnewlines - numoldlines):
-            self.win.insertln()
-        for i in range(numnewlines):
-            self.win.move(begin+i,0)
-            line, newline = newline[:maxx], newline[maxx:]
-            self.win.clrtoeol()
-            for obj, attr in reversed(list(parsemarkup(line))):
-                if attr == None:
-                    attr = 0
-                self.win.addstr(obj, attr)
+        if loc >= len(self):
+            raise IndexError('index out of range')
+        self._replace(loc, loc + 1, [newline])
+    
+    def _setrange(self, begin, lines):
+        log(str(type(self)) + "._setrange(%d,%d) %d" % (begin, len(lines), len(self)))
+        self._replace(begin, begin + len(lines), lines)
+    
+    def sync(self, newlines):
+        """Makes the lines equal to newlines, changing as few lines of the
+        window as possible: lines that are the same in both are moved with
+        the terminal's insert and delete line commands, never redrawn.
         
-        log('wrapped:', sorted(self._wrappedlines))
-        # update wrapped lines - we've changed things
-        if numnewlines != numoldlines:
-            newend = begin + numnewlines - 1
-            for i in range(newend+1, end+1):
-                self._wrappedlines.remove(i)
-            for i in range(end+1,newend+1):
-                self._wrappedlines.add(i)
-            for i in sorted(self._wrappedlines):
-                if i > newend:
-                    self._wrappedlines.remove(i)
-                    self._wrappedlines.add(i + numnewlines - numoldlines)
-        log('new wrapped:', sorted(self._wrappedlines))
-        # update how many lines there are
-        # we may have inserted / deleted a line in the middle,
-        # or possibly (through `x[-1:] = lines`, for example) put lines
-        # at the end
-        self._lowerline = max(self._lowerline + numnewlines - numoldlines, end)
-        log(self[:])
+        Returns the number of lines that were drawn."""
+        newlines = list(newlines)
+        old = [self._synckey(line) for line in self._lines]
+        new = [self._synckey(line) for line in newlines]
+        drawn = 0
+        # from the end, so that the hunks before are not moved
+        for i1, i2, j1, j2 in reversed(linediff.hunks(old, new)):
+            self._replace(i1, i2, newlines[j1:j2])
+            drawn += j2 - j1
+        return drawn
+    
+    def _synckey(self, line):
+        "Returns what sync compares lines by: their markup."
+        return list(parsemarkup(line))
     
+    def redraw(self):
+        """Draws every line again from self._lines, fitting them to the current
+        size of the window (for example, after it has been resized)."""
+        self._maxyx = self.win.getmaxyx()
+        self.win.erase()
+        self._heights = HeightIndex()
+        begin = 0
+        for line in self._lines:
+            physlines = self._physlines(line)
+            self._draw(begin, physlines)
+            self._heights.append(len(physlines))
+            begin += len(physlines)
     
     def __len__(self):
-        return (self._lowerline + 1) - len(self._wrappedlines)
+        return len(self._lines)
     
     
 
@@ -156,82 +218,147 @@ class ExtendedTextbox(Panelastext):
     - completion requests (TODO)
     - prompt for entry (TODO)
     - color management (TODO)
-    - auto indentation (TODO)"""
+    - auto indentation (TODO)
+    - syntax highlighting as the text is typed (see sethighlighting)
+    
+    The cursor is kept as a (line, column) position in the text, in
+    self.cury, self.curx."""
     def __init__(self, win):
         """A window is required to instantiate the textbox."""
         Panelastext.__init__(self, win)
         win.keypad(1)
+        self.cury = self.curx = 0
+        self.lexer = None # an IncrementalLexer, while highlighting
+        self.formatter = None
+    
+    def sethighlighting(self, lexer, formatter=None):
+        """Highlights the text with a pygments lexer, turning its tokens into
+        attributes with formatter (a CursesFormatter), from now on; or stops
+        highlighting, if lexer is None.
+        
+        Only the lines an edit changes the colors of are lexed again and
+        drawn: usually just the line being typed on."""
+        lines = list(self)
+        if lexer is None:
+            self.lexer = self.formatter = None
+            newlines = lines
+        else:
+            self.lexer = IncrementalLexer(lexer)
+            self.formatter = formatter
+            self.lexer.replace(0, 0, lines)
+            newlines = [self._highlighted(i) for i in range(len(lines))]
+        Panelastext._replace(self, 0, len(lines), newlines)
+    
+    def _synckey(self, line):
+        # while highlighting, the lines kept are the lexer's markup, and the
+        # lines given plain text: the text is what counts
+        if self.lexer is None:
+            return Panelastext._synckey(self, line)
+        return self._astext(line)
+    
+    def _highlighted(self, linenum):
+        "Returns the markup of a line, from the lexer's tokens."
+        return self.formatter.formattokens(self.lexer.tokens(linenum))
+    
+    def _replace(self, begin, end, newlines):
+        if self.lexer is None:
+            Panelastext._replace(self, begin, end, newlines)
+            return
+        texts = [self._astext(line) for line in newlines]
+        first, stop = self.lexer.replace(begin, end, texts)
+        # lines around the new ones whose colors changed are drawn again too
+        end += stop - (begin + len(texts))
+        Panelastext._replace(self, first, end,
+                             [self._highlighted(i) for i in range(first, stop)])
+    
+    def _placecursor(self):
+        "Moves the window's cursor to where self.cury, self.curx is drawn."
+        maxy, maxx = self._maxyx
+        begin, end = self._tophyscoord(self.cury)
+        y = min(begin + self.curx // maxx, maxy - 1)
+        self.win.move(y, self.curx % maxx)
     
     def movetoend(self):
         """Moves cursor to end of current line."""
+        self.curx = len(self[self.cury])
     
     def move(self, xdist, ydist = 0):
         """Move the cursor the specified amount, wrapping around lines, and not failing at edges."""
-        cury, curx = self.win.getyx()
-        maxy, maxx = self.win.maxyx()
-        
-        curx += xdist
-        while curx < 0 and cury >= 0:
-            curx += maxx
+        cury = max(0, min(self.cury + ydist, len(self) - 1))
+        curx = min(self.curx, len(self[cury])) + xdist
+        while curx < 0 and cury > 0:
             cury -= 1
-            
-        while curx > maxx:
-            curx -= maxx
+            curx += len(self[cury]) + 1
+        while curx > len(self[cury]) and cury < len(self) - 1:
+            curx -= len(self[cury]) + 1
             cury += 1
         
-        if cury < 0:
-            cury = 0
-        if cury > maxy:
-            cury = maxy
-        
-        self.win.move(cury,curx)
-        return cury, curx
+        self.cury = cury
+        self.curx = max(0, min(curx, len(self[cury])))
+        return self.cury, self.curx
     
     def do_command(self, ch):
         """Process a single editing command.
         
         Returns a boolean, where 'True' indicates editing has finished."""
-        cury, curx = self.win.getyx()
-        #(maxy, maxx) = self._getlim()
+        if not len(self):
+            self.append('')
+        cury, curx = self.cury, self.curx
+        line = self[cury]
         if ch == ord('\n'):
             return True
         elif curses.ascii.isprint(ch):
-            self.win.insch(cury, curx, ch)
-            cury, curx = self.move(1)
+            self[cury] = line[:curx] + chr(ch) + line[curx:]
+            self.move(1)
         elif ch == curses.KEY_LEFT:
-            cury, curx = self.move(-1)
+            self.move(-1)
         elif ch == curses.KEY_RIGHT:
-            cury, curx = self.move(1)
-        elif ch == curses.KEY_BACKSPACE:
-            cury, curx = self.move(-1)
-            self.win.delch()
+            self.move(1)
+        elif ch == curses.KEY_UP:
+            self.move(0, -1)
+        elif ch == curses.KEY_DOWN:
+            self.move(0, 1)
+        elif ch in (curses.KEY_BACKSPACE, curses.ascii.DEL):
+            if curx > 0:
+                self[cury] = line[:curx-1] + line[curx:]
+                self.move(-1)
+            elif cury > 0:
+                self.move(-1)
+                self[cury-1:cury+1] = [self[cury-1] + line]
         elif ch == curses.KEY_DC:
-            self.win.delch()
+            if curx < len(line):
+                self[cury] = line[:curx] + line[curx+1:]
+            elif cury < len(self) - 1:
+                self[cury:cury+2] = [line + self[cury+1]]
         elif ch == curses.KEY_HOME:
-            curx = 0
-            self.win.move(cury, curx)
+            self.curx = 0
         elif ch == curses.KEY_END:
-            length = len(self.win.instr().rstrip())
-            curx += length
-            self.win.move(cury, curx)
-            
+            self.movetoend()
         else:
             log('ExtendedTextbox.do_command - keyname:', curses.keyname(ch))
         
+        self._placecursor()
         return False
     
 
     def gather(self):
         "Collect and return the contents of the window."
-        result = self[:]
-        #for y in range(self._lowerline+1):
-            #result.append(self._getline(y))
-        return '\n'.join(result)
+        return '\n'.join(self)
         
+    def startedit(self):
+        """Gets ready to edit, by placing the cursor; edit() calls this, and
+        anything else calling do_command should call it first."""
+        if not len(self):
+            # the first line is there to be edited, even if it is empty
+            self.append('')
+        self.cury = min(self.cury, len(self) - 1)
+        self.curx = min(self.curx, len(self[self.cury]))
+        self._placecursor()
+    
     def edit(self):
         "Edit in the widget window and collect the results."
-        self._lowerline = max(self._lowerline, 0)
-        log(self._maxyx, self._lowerline)
+        self.startedit()
+        log(self._maxyx, len(self))
         while 1:
             ch = self.win.getch()
             if not ch:
@@ -239,4 +366,103 @@ class ExtendedTextbox(Panelastext):
             finished = self.do_command(ch)
             if finished:
                 break
-        return self.gather()
\ No newline at end of file
+        return self.gather()
+
+def randomtest(seed=0, steps=300, height=150):
+    """Makes random slice edits to a Panelastext on a MemoryWindow, and the
+    same edits to a list, checking after each that the lines, the heights
+    and what is drawn in the window agree with the list. With a small height,
+    the lines do not all fit in the window."""
+    import random
+    from memorywindow import MemoryWindow
+    rand = random.Random(seed)
+    width = 12
+    win = MemoryWindow(height, width)
+    panel = Panelastext(win)
+    lst = []
+    words = ['', 'x', 'short', 'twelve chars', 'a line long enough to wrap twice']
+    def newlines():
+        return [rand.choice(words) for i in range(rand.randrange(4))]
+    for step in range(steps):
+        begin = rand.randrange(len(lst) + 1)
+        end = rand.randrange(begin, min(len(lst), begin + 4) + 1)
+        kind = rand.randrange(6)
+        if len(lst) > 40:
+            # (so that everything fits in a window of the default height)
+            kind = 1
+        if kind == 0:
+            new = newlines()
+            panel[begin:end] = new
+            lst[begin:end] = new
+        elif kind == 1:
+            del panel[begin:end]
+            del lst[begin:end]
+        elif kind == 2:
+            line = rand.choice(words)
+            panel.insert(begin, line)
+            lst.insert(begin, line)
+        elif kind == 3 and lst:
+            index = rand.randrange(-len(lst), len(lst))
+            line = rand.choice(words)
+            panel[index] = line
+            lst[index] = line
+        elif kind == 4:
+            new = lst[:begin] + newlines() + lst[end:]
+            panel.sync(new)
+            lst = new
+        else:
+            line = rand.choice(words)
+            panel.append(line)
+            lst.append(line)
+        assert list(panel) == lst, (step, list(panel), lst)
+        heights = [max(1, (len(line) + width - 1) // width) for line in lst]
+        assert list(panel._heights) == heights
+        rows = []
+        for line in lst:
+            rows.extend(line[i:i + width].ljust(width)
+                        for i in range(0, max(len(line), 1), width))
+        rows = rows[:height]
+        assert win.lines()[:len(rows)] == rows, step
+        assert not win.lines()[len(rows):] or \
+               set(win.lines()[len(rows):]) == set([' ' * width])
+
+def test():
+    """Checks a Panelastext against a list; and that sync only draws the lines
+    that changed, with highlighting on too."""
+    randomtest()
+    randomtest(height=10)
+    # after the window shrinks, redraw draws what fits
+    from memorywindow import MemoryWindow
+    panel = Panelastext(MemoryWindow(20, 12))
+    panel[:] = ['line %d' % i for i in range(15)]
+    panel.win = MemoryWindow(5, 12)
+    panel.redraw()
+    assert panel.win.lines() == [('line %d' % i).ljust(12) for i in range(5)]
+    assert len(panel) == 15 and panel._heights.total() == 15
+    try:
+        panel[15] = 'past the end'
+    except IndexError:
+        pass
+    else:
+        assert False, 'setting past the end should raise IndexError'
+    panel[-1:] = ['last', 'added']
+    assert panel[-2:] == ['last', 'added'] and len(panel) == 16
+    import pygments.lexers
+    from cursespygments import CursesFormatter
+    formatter = CursesFormatter(style='default')
+    # stand in for setup_styles, which needs a terminal
+    formatter.style_attrs = dict((str(ttype), n) for n, (ttype, ndef)
+                                 in enumerate(formatter.style))
+    formatter._setup = True
+    formatter._maketokentable()
+    box = ExtendedTextbox(MemoryWindow(12, 30))
+    box.sethighlighting(pygments.lexers.get_lexer_by_name('python'), formatter)
+    lines = ['x%d = %d' % (i, i) for i in range(10)]
+    box[:] = lines
+    assert box.sync(lines) == 0
+    lines[4] = 'x4 = "changed"'
+    assert box.sync(lines) == 1
+    assert list(box) == lines
+
+if __name__ == '__main__':
+    test()
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 import curses
 from curses import textpad
+import pygments.lexers
 import vipad
 from basicsequence import basictester
+from cursespygments import CursesFormatter
 
 def main():
     with vipad.safescreen('xterm-256color') as scr:
@@ -86,6 +88,11 @@ def test_textbox(textbox, tb):
     assert tb == textbox[:]
     assert len(tb) == len(textbox)
     
+    textbox.sync(["0", "2", "3", "4", "5"])
+    tb[:] = ["0", "2", "3", "4", "5"]
+    assert tb == textbox[:]
+    assert len(tb) == len(textbox)
+    
     textbox [:] = []
     textbox.append(('123',curses.A_BOLD))
     textbox.append(('123',curses.color_pair(curses.COLOR_RED) | curses.A_BOLD))
@@ -106,13 +113,18 @@ def mainedit():
         starty = 0
         editwin = scr.subwin(height, width, startx, starty)
         editbox = vipad.ExtendedTextbox(editwin)
+        # colored as it is typed
+        formatter = CursesFormatter(usebg=True, defaultbg=-2)
+        formatter.makebackground(editwin)
+        editbox.sethighlighting(pygments.lexers.get_lexer_by_name('python'),
+                                formatter)
         #editbox.append('EDIT')
         #editbox.refresh()
         textbox.append('TEXT')
         textbox.refresh()
         alltxt = []
         for i in range(3):
-            editbox[:] = []
+            editbox.sync([])
             txt = editbox.edit()
             alltxt.append(txt)
             for line in txt.split('\n'):